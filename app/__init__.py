@@ -1,11 +1,25 @@
-from flask import Flask, current_app
+import asyncio
+import functools
+import hashlib
+import hmac
+import inspect
+import math
+import random
+import time
+import pymongo
+from flask import Flask, Response, current_app, g, jsonify, request
+from utils.admission import ConcurrencyLimiter, MemoryRateLimitStore, MongoRateLimitStore
 from utils.logger import logger
+from utils.metrics import (REGISTRY, HTTP_REQUEST_DURATION, ADMISSION_QUEUE_WAIT, ADMISSION_REJECTIONS,
+                           MongoCommandTimer)
+from utils.profiling import SamplingProfiler, profile_path, write_collapsed
 from app.config import Config
-from .custom_json_encoder import CustomJSONEncoder
+from .catalogues import catalogue_config
+from .custom_json_encoder import create_json_provider
 from pymongo import MongoClient
 
 
-def create_app(config_class=Config):
+def create_app(config_class=Config, mongo_client=None):
     # Create Flask app
     logger.info("Creating Sci-Fi Book Catalog Flask app")
     app = Flask(__name__)
@@ -13,36 +27,241 @@ def create_app(config_class=Config):
 
     # Configure DB
     logger.info("Configuring MongoDB")
-    init_db(app)
+    init_db(app, mongo_client)
+
+    # Setup JSON provider
+    # Before the API, as the services serialize books with it
+    logger.info("Setting up JSON provider")
+    app.json = create_json_provider(app, app.config['JSON_PROVIDER'])
 
     # Setup API
     logger.info("Setting up API")
-    from app.api.books import books_api
+    # Services are created on import and need the app's config and DB
+    with app.app_context():
+        from app.api.books import books_api
     app.register_blueprint(books_api)
+    # Every route is also served per catalogue, e.g. /api/v1/catalogues/<catalogue_id>/search
+    app.register_blueprint(books_api, name='catalogue_books_api', url_prefix='/api/v1/catalogues/<catalogue_id>')
+
+    # Setup metrics
+    if app.config['METRICS_ENABLED']:
+        logger.info("Setting up metrics")
+        init_metrics(app)
+
+    # Setup profiling
+    if app.config['PROFILING_ENABLED'] or app.config['PROFILING_ADMIN_TOKEN']:
+        logger.info("Setting up request profiling")
+        init_profiling(app)
 
-    # Setup JSON encoder
-    logger.info("Setting up custom JSON encoder")
-    app.json = CustomJSONEncoder(app)
+    # Setup admission control
+    # After metrics and profiling, so rejected requests are still timed
+    logger.info("Setting up admission control")
+    init_admission_control(app)
 
     return app
 
 
-def init_db(app):
+def init_metrics(app):
+    """
+    Times every request by route and exposes the metrics registry at /metrics.
+    """
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def observe_request_duration(response):
+        start = g.pop('request_start', None)
+        if start is not None:
+            # The route template (e.g. /api/v1/book/<isbn_13>) keeps the number of label values bounded
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            HTTP_REQUEST_DURATION.labels(request.method, route, response.status_code).observe(time.perf_counter() - start)
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+def init_profiling(app):
+    """
+    Profiles a random PROFILING_SAMPLE_RATE fraction of requests when PROFILING_ENABLED is set, and any request
+    whose PROFILING_HEADER matches PROFILING_ADMIN_TOKEN. The collapsed stacks of each profiled request are
+    written to PROFILING_DIR/<method>_<route>/, to be merged with scripts/merge_profiles.py.
+    """
+    header = app.config['PROFILING_HEADER']
+    admin_token = app.config['PROFILING_ADMIN_TOKEN']
+
+    def requested_by_admin():
+        token = request.headers.get(header)
+        return bool(admin_token and token and hmac.compare_digest(token.encode(), admin_token.encode()))
+
+    @app.before_request
+    def start_profiler():
+        sampled = app.config['PROFILING_ENABLED'] and random.random() < app.config['PROFILING_SAMPLE_RATE']
+        if sampled or requested_by_admin():
+            g.profiler = SamplingProfiler(app.config['PROFILING_INTERVAL_SECONDS'])
+            g.profiler.start()
+
+    def with_profiled_loop(view):
+        @functools.wraps(view)
+        async def wrapper(*args, **kwargs):
+            # The view runs on its own event loop thread, whose executor threads run its blocking calls
+            profiler = g.get('profiler')
+            if profiler is not None:
+                profiler.add_thread()
+                profiler.add_loop(asyncio.get_running_loop())
+            return await view(*args, **kwargs)
+        return wrapper
+
+    for endpoint, view in list(app.view_functions.items()):
+        if inspect.iscoroutinefunction(view):
+            app.view_functions[endpoint] = with_profiled_loop(view)
+
+    @app.after_request
+    def write_profile(response):
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            stacks = profiler.stop()
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            path = profile_path(app.config['PROFILING_DIR'], request.method, route)
+            try:
+                write_collapsed(stacks, path)
+                logger.info("Profile of %s %s written to %s", request.method, route, path)
+            except OSError as e:
+                logger.error("Failed to write profile %s: %s", path, e)
+        return response
+
+
+def init_admission_control(app):
     """
-    Initialize the MongoDB database connection.
+    Protects the API from overload:
+    - Each client, identified by the API key in RATE_LIMIT_KEY_HEADER or else its IP address, is rate limited with a
+      token bucket of RATE_LIMIT_PER_SECOND tokens per second and RATE_LIMIT_BURST capacity. Over the limit, 429.
+    - Views marked expensive share EXPENSIVE_MAX_CONCURRENT slots per process, with a queue of EXPENSIVE_MAX_QUEUE.
+      When the queue is full or a slot is not free within EXPENSIVE_QUEUE_TIMEOUT_SECONDS, 503.
+    - Reads must finish within REQUEST_TIMEOUT_SECONDS, or 504. The view is cancelled and its MongoDB operations
+      time out. Writes are not cancelled, as that would skip the rollback of a partly stored book.
+    Rejections carry a Retry-After header.
     """
-    # Store database connection on app instance
-    app.mongo_client = MongoClient(app.config['MONGO_URI'])
-    app.db = app.mongo_client[app.config['MONGO_DB']]
+    rate = app.config['RATE_LIMIT_PER_SECOND']
+    burst = app.config['RATE_LIMIT_BURST']
+    key_header = app.config['RATE_LIMIT_KEY_HEADER']
+    request_timeout = app.config['REQUEST_TIMEOUT_SECONDS']
+    queue_timeout = app.config['EXPENSIVE_QUEUE_TIMEOUT_SECONDS']
 
-    # Create indexes
-    app.db.books.create_index({ "isbn_13": 1}, unique=True)
+    store = None
+    if rate > 0:
+        if app.config['RATE_LIMIT_STORE'] == 'mongodb':
+            store = MongoRateLimitStore(app.db.rate_limits)
+        elif app.config['RATE_LIMIT_STORE'] == 'memory':
+            store = MemoryRateLimitStore()
+        else:
+            raise ValueError(f"Unknown RATE_LIMIT_STORE: {app.config['RATE_LIMIT_STORE']}")
+    limiter = None
+    if app.config['EXPENSIVE_MAX_CONCURRENT'] > 0:
+        limiter = ConcurrencyLimiter(app.config['EXPENSIVE_MAX_CONCURRENT'], app.config['EXPENSIVE_MAX_QUEUE'])
+
+    def rejection(reason, status, message, retry_after=None):
+        ADMISSION_REJECTIONS.labels(reason).inc()
+        response = jsonify({'error': message})
+        response.status_code = status
+        if retry_after is not None:
+            response.retry_after = max(1, math.ceil(retry_after))
+        return response
+
+    def client_key():
+        api_key = request.headers.get(key_header)
+        if api_key:
+            # The key itself is a credential, so only its hash is stored
+            return 'key:' + hashlib.blake2b(api_key.encode(), digest_size=16).hexdigest()
+        return f"ip:{request.remote_addr}"
+
+    @app.before_request
+    def admit_request():
+        g.deadline = time.monotonic() + request_timeout if request_timeout > 0 else None
+
+        # Scrapes of /metrics must keep working when clients are throttled
+        if store is not None and request.endpoint != 'metrics':
+            allowed, retry_after = store.take(client_key(), rate, burst)
+            if not allowed:
+                logger.warning("Rate limit exceeded: %s", request.remote_addr)
+                return rejection('rate_limited', 429, 'Too Many Requests', retry_after)
+
+        view = app.view_functions.get(request.endpoint)
+        if limiter is not None and getattr(view, 'expensive', False):
+            timeout = queue_timeout
+            if g.deadline is not None:
+                timeout = min(timeout, g.deadline - time.monotonic())
+            start = time.perf_counter()
+            admitted = limiter.acquire(timeout=max(0, timeout))
+            ADMISSION_QUEUE_WAIT.observe(time.perf_counter() - start)
+            if not admitted:
+                logger.warning("Overloaded, shedding %s %s", request.method, request.path)
+                return rejection('overloaded', 503, 'Service Unavailable', queue_timeout)
+            g.admission_slot = True
+
+    @app.teardown_request
+    def release_slot(exception=None):
+        if g.pop('admission_slot', False):
+            limiter.release()
+
+    if request_timeout <= 0:
+        return
+
+    def with_deadline(view):
+        @functools.wraps(view)
+        async def wrapper(*args, **kwargs):
+            remaining = g.deadline - time.monotonic()
+            if remaining <= 0:
+                return rejection('deadline_exceeded', 504, 'Gateway Timeout')
+            try:
+                # The timeout is held in a context variable, so it also applies to queries run in asyncio.to_thread
+                with pymongo.timeout(remaining):
+                    response = current_app.make_response(await asyncio.wait_for(view(*args, **kwargs), remaining))
+            except asyncio.TimeoutError:
+                logger.warning("Deadline exceeded: %s %s", request.method, request.path)
+                return rejection('deadline_exceeded', 504, 'Gateway Timeout')
+            # A view that catches the MongoDB timeout answers 500 instead
+            if response.status_code >= 500 and time.monotonic() >= g.deadline:
+                logger.warning("Deadline exceeded: %s %s", request.method, request.path)
+                return rejection('deadline_exceeded', 504, 'Gateway Timeout')
+            return response
+        return wrapper
+
+    # Threads cannot be interrupted, so work already handed to one (e.g. encoding a query) runs to completion.
+    # The concurrency cap bounds how much of it there can be
+    read_endpoints = {rule.endpoint for rule in app.url_map.iter_rules() if rule.methods <= {'GET', 'HEAD', 'OPTIONS'}}
+    for endpoint in read_endpoints:
+        view = app.view_functions[endpoint]
+        if inspect.iscoroutinefunction(view):
+            app.view_functions[endpoint] = with_deadline(view)
+
+
+def init_db(app, mongo_client=None):
+    """
+    Initialize the MongoDB database connection. app.db is the database of the default catalogue.
+    An existing client (e.g. an in-memory fake for benchmarks) can be passed instead of connecting to MONGO_URI.
+    """
+    # Store database connection on app instance. Every catalogue uses this client, so they share its connection pool
+    event_listeners = [MongoCommandTimer()] if app.config['METRICS_ENABLED'] else []
+    app.mongo_client = mongo_client or MongoClient(app.config['MONGO_URI'], event_listeners=event_listeners)
+    app.db = app.mongo_client[catalogue_config(app.config)['MONGO_DB']]
+    create_indexes(app.db)
 
     # Close database connection on app exit
     import atexit
     atexit.register(lambda: app.mongo_client.close())
 
 
+def create_indexes(db):
+    """
+    Creates the indexes of a catalogue's database.
+    """
+    db.books.create_index([("isbn_13", 1)], unique=True)
+    db.books.create_index([("updated_at", 1), ("_id", 1)])
+
+
 def get_db():
     """
     Get the database instance from the current Flask app context.
@@ -1,16 +1,154 @@
 
-from flask import Blueprint, jsonify, request
+import time
+from datetime import datetime, timezone
+from flask import Blueprint, g, jsonify, request
+from werkzeug.http import is_resource_modified
 from .schemas import BookSchema, BookUpdateSchema
 from marshmallow import ValidationError
-import os
-from ..services.s3_service import S3Service
-from ..services.book_service import BookService
+from ..services.s3_service import PRESIGNED_URL_EXPIRATION, S3Service
+from ..services.catalogue_registry import CatalogueRegistry
+from ..services.rerank_service import RerankService
+from ..services.suggest_index import normalize_tokens
+from ..services.vector_service import VectorService, create_vector_index
+from ..catalogues import catalogue_config
+from ..exceptions import BookNotFoundError, BookExistsError, CatalogueNotFoundError, ThumbnailUploadError, VectorServiceError
+from flask import current_app
+from utils.admission import expensive
+from utils.helpers import book_version_etag, parse_field_weights, parse_fields
+from utils.images import RENDITION_WIDTHS
 from utils.logger import logger
 
 
 books_api = Blueprint('books_api', __name__, url_prefix='/api/v1')
+
+# The S3 session, the vector index connection, the models and the MongoDB client are shared by every catalogue
 s3_service = S3Service()
-book_service = BookService(s3_service)
+vector_service = VectorService(
+    index=create_vector_index(catalogue_config(current_app.config)),
+    upsert_batch_size=current_app.config['VECTOR_UPSERT_BATCH_SIZE'],
+    mode=current_app.config['RETRIEVAL_MODE'],
+    field_weights=current_app.config['FIELD_WEIGHTS'],
+    multi_vector_fields=current_app.config['MULTI_VECTOR_FIELDS']
+)
+rerank_service = RerankService(
+    model_name=current_app.config['RERANK_MODEL_NAME'],
+    max_length=current_app.config['RERANK_MAX_LENGTH'],
+    candidates=current_app.config['RERANK_CANDIDATES'],
+    budget_seconds=current_app.config['RERANK_BUDGET_SECONDS'],
+    cache_size=current_app.config['RERANK_CACHE_SIZE'],
+    max_pending=current_app.config['RERANK_MAX_PENDING']
+) if current_app.config['RERANK_ENABLED'] else None
+catalogues = CatalogueRegistry(
+    current_app.config,
+    current_app.mongo_client,
+    s3_service,
+    vector_service,
+    current_app.json,
+    reranker=rerank_service
+)
+
+# The default catalogue is created eagerly, and is also served without a catalogue id in the URL
+default_catalogue = catalogues.get()
+book_service = default_catalogue.book_service
+payload_cache = default_catalogue.payload_cache
+suggest_index = default_catalogue.suggest_index
+
+
+@books_api.url_value_preprocessor
+def pop_catalogue_id(endpoint, values):
+    """
+    Takes the catalogue id out of the URL values, so views do not receive it.
+    """
+    g.catalogue_id = values.pop('catalogue_id', None) if values else None
+
+
+@books_api.before_request
+def load_catalogue():
+    """
+    Looks up the services of the requested catalogue, creating them on its first request.
+    """
+    try:
+        g.catalogue = catalogues.get(g.catalogue_id)
+    except CatalogueNotFoundError as e:
+        logger.warning("Catalogue not found: %s", g.catalogue_id)
+        return jsonify({'error': 'Catalogue not found.', 'message': str(e)}), 404
+
+
+# Fields that can be requested with the 'fields' query parameter
+BOOK_FIELDS = set(BookSchema().fields) | {'_id', 'updated_at'}
+
+
+def books_response(books, status=200, fields=None):
+    """
+    Returns books as a JSON response, assembled from their cached serialized JSON.
+    The response is gzip compressed if the client accepts it and it is at least COMPRESSION_MIN_SIZE bytes.
+
+    Args:
+        books (dict or list): A book, or a list of books.
+        status (int): The HTTP status code.
+        fields (set): The fields to include. Every field is included if not set.
+    """
+    compress = current_app.config['COMPRESSION_ENABLED']
+    compress_min_size = current_app.config['COMPRESSION_MIN_SIZE'] if compress and request.accept_encodings['gzip'] else None
+    body, compressed = g.catalogue.payload_cache.render(books, fields, compress_min_size=compress_min_size)
+
+    response = current_app.response_class(body, status=status, mimetype='application/json')
+    if compressed:
+        response.content_encoding = 'gzip'
+    if compress:
+        response.vary.add('Accept-Encoding')
+    return response
+
+
+def presign_epoch():
+    """
+    Returns the start, in seconds since the epoch, of the current presign epoch.
+
+    Responses embed presigned thumbnail URLs, which expire even though the books do not change. Epochs last the
+    URL lifetime less HTTP_CACHE_MAX_AGE, and are part of the ETag and Last-Modified of such responses, so a
+    representation revalidated with a 304 is reused no longer than its URLs stay valid.
+    """
+    window = max(PRESIGNED_URL_EXPIRATION - current_app.config['HTTP_CACHE_MAX_AGE'], 1)
+    return int(time.time() // window) * window
+
+
+def not_modified(etag, last_modified=None):
+    """
+    Returns a 304 response if the client's cached representation is current, or None otherwise.
+    Routes call this before presigning thumbnails or serializing, so a revalidation only costs the database read.
+
+    Args:
+        etag (str): The ETag of the current representation. No check is made if None.
+        last_modified (datetime): When the representation last changed, compared with If-Modified-Since.
+    """
+    if etag is None or is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+    return set_cache_headers(current_app.response_class(status=304), etag, last_modified)
+
+
+def limit_too_large(limit):
+    """
+    Returns a 400 response if limit is above MAX_LIMIT, or None otherwise.
+    The work of a request grows with its limit, so a single request must not be able to ask for the whole catalogue.
+    """
+    max_limit = current_app.config['MAX_LIMIT']
+    if limit <= max_limit:
+        return None
+    logger.warning("Limit too large: %s", limit)
+    return jsonify({"error": "Invalid parameters", "message": f"limit must be at most {max_limit}"}), 400
+
+
+def set_cache_headers(response, etag, last_modified=None):
+    """
+    Sets the validators and caching policy of a response.
+    HTTP_CACHE_MAX_AGE is kept well below the lifetime of the presigned thumbnail URLs in the response.
+    """
+    if etag is not None:
+        response.set_etag(etag, weak=True)
+        response.cache_control.max_age = current_app.config['HTTP_CACHE_MAX_AGE']
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
 
 # PING
 @books_api.route('/')
@@ -26,36 +164,220 @@ async def get_books():
     
     Query Parameters:
         page (int): The page number to retrieve (default: 1).
-        limit (int): The number of books to retrieve per page (default: 20).
+        limit (int): The number of books to retrieve per page (default: 20, at most MAX_LIMIT).
+        size (str): The thumbnail rendition to link to: small, medium or large (default: original).
+        fields (str): Comma-separated fields to return, e.g. 'title,author,thumbnail' (default: all).
     
     Returns:
-        JSON: List of book objects with presigned URLs for thumbnails
+        JSON: List of book objects with presigned URLs for thumbnails, with an ETag.
+            304 if the page is unchanged since the ETag in If-None-Match.
     """
     # Parse input
-    logger.info(f"GET /books request received with params: page={request.args.get('page')}, limit={request.args.get('limit')}")
+    logger.info("GET /books request received with params: page=%s, limit=%s", request.args.get('page'), request.args.get('limit'))
     page = int(request.args.get('page', 1))
     limit = int(request.args.get('limit', 20))
+    size = request.args.get('size')
+    try:
+        fields = parse_fields(request.args.get('fields'), BOOK_FIELDS)
+    except ValueError as e:
+        logger.warning("Invalid fields: %s", request.args.get('fields'))
+        return jsonify({"error": "Invalid parameters", "message": str(e)}), 400
 
     # Validate input
     if page < 1 or limit < 1:
-        logger.warning(f"Invalid parameters: page={page}, limit={limit}")
+        logger.warning("Invalid parameters: page=%s, limit=%s", page, limit)
         return jsonify({
             "error": "Invalid parameters",
             "message": "Page and limit must be greater than 0"
         }), 400
+    response = limit_too_large(limit)
+    if response is not None:
+        return response
+    if size and size not in RENDITION_WIDTHS:
+        logger.warning("Invalid thumbnail size: %s", size)
+        return jsonify({
+            "error": "Invalid parameters",
+            "message": f"Size must be one of: {', '.join(RENDITION_WIDTHS)}"
+        }), 400
 
     # Get books
     try:
-        books = await book_service.retrieve_books(page, limit)
+        books = await g.catalogue.book_service.find_books(page, limit, fields=fields)
+        # A page is identified by its books and their versions, so there is no Last-Modified:
+        # deleting a book changes the page without changing any remaining book
+        epoch = presign_epoch() if fields is None or 'thumbnail' in fields else None
+        etag = book_version_etag(books, page, limit, size, sorted(fields) if fields else None, epoch)
+        response = not_modified(etag)
+        if response is not None:
+            logger.info("Books not modified: page=%s, limit=%s", page, limit)
+            return response
+        if fields is None or 'thumbnail' in fields:
+            await g.catalogue.book_service.attach_thumbnail_urls(books, size)
     except Exception as e:
-        logger.exception(f"Error retrieving books: {str(e)}")
+        logger.exception("Error retrieving books: %s", e)
         return jsonify({
             'error': 'Internal Server Error',
             'message': str(e)
         }), 500
     
-    logger.info(f"Returning {len(books)} books")
-    return jsonify(books), 200
+    logger.info("Returning %s books", len(books))
+    return set_cache_headers(books_response(books, fields=fields), etag)
+
+
+# SEARCH
+@books_api.route('/search', methods=['GET'])
+@expensive
+async def search_books():
+    """
+    Searches for books similar to a free-text query.
+
+    Query Parameters:
+        q (str): The search query.
+        limit (int): The maximum number of books to return (default: 10, at most MAX_LIMIT).
+        size (str): The thumbnail rendition to link to: small, medium or large (default: original).
+        weights (str): Field weights as 'field:weight,...', e.g. 'title:1,description:4' (multi-vector retrieval mode only).
+        fields (str): Comma-separated fields to return, e.g. 'title,author,thumbnail' (default: all). The score is always returned.
+        rerank (str): 'false' to skip the cross-encoder re-ranking stage, if RERANK_ENABLED (default: true).
+
+    Returns:
+        JSON: List of book objects with similarity scores and presigned URLs for thumbnails, most similar first.
+            The scores are the re-ranker's relevance scores if the results were re-ranked within RERANK_BUDGET_SECONDS.
+    """
+    logger.info("GET /search request received with params: q=%s, limit=%s", request.args.get('q'), request.args.get('limit'))
+    query = request.args.get('q', '').strip()
+    limit = int(request.args.get('limit', 10))
+    size = request.args.get('size')
+    rerank = request.args.get('rerank', 'true').lower() != 'false'
+
+    # Validate input
+    if not query or limit < 1:
+        logger.warning("Invalid parameters: q=%s, limit=%s", query, limit)
+        return jsonify({
+            "error": "Invalid parameters",
+            "message": "q must not be empty and limit must be greater than 0"
+        }), 400
+    response = limit_too_large(limit)
+    if response is not None:
+        return response
+    if size and size not in RENDITION_WIDTHS:
+        logger.warning("Invalid thumbnail size: %s", size)
+        return jsonify({
+            "error": "Invalid parameters",
+            "message": f"Size must be one of: {', '.join(RENDITION_WIDTHS)}"
+        }), 400
+
+    try:
+        weights = parse_field_weights(request.args.get('weights'))
+        if weights:
+            g.catalogue.vector_service.validate_query_weights(weights)
+    except ValueError as e:
+        logger.warning("Invalid field weights: %s: %s", request.args.get('weights'), e)
+        return jsonify({"error": "Invalid parameters", "message": str(e)}), 400
+    try:
+        fields = parse_fields(request.args.get('fields'), BOOK_FIELDS)
+        if fields is not None:
+            fields.add('score')
+    except ValueError as e:
+        logger.warning("Invalid fields: %s", request.args.get('fields'))
+        return jsonify({"error": "Invalid parameters", "message": str(e)}), 400
+
+    try:
+        books = await g.catalogue.book_service.search_books(query, limit, size=size, weights=weights, fields=fields, rerank=rerank)
+    except Exception as e:
+        logger.exception("Error searching books: %s", e)
+        return jsonify({'error': 'Internal Server Error', 'message': str(e)}), 500
+
+    logger.info("Returning %s search results", len(books))
+    return books_response(books, fields=fields)
+
+
+# SUGGEST
+@books_api.route('/suggest', methods=['GET'])
+def suggest_books():
+    """
+    Suggests books whose title or author words start with the typed prefix, for search-as-you-type.
+    Answered from an in-memory index without a database or model call, so the view is synchronous.
+
+    Query Parameters:
+        prefix (str): The text typed so far, e.g. 'frank her'. Its longest word must have at least
+            SUGGEST_MIN_PREFIX_LENGTH characters.
+        limit (int): The maximum number of suggestions (default: 10, at most SUGGEST_MAX_RESULTS).
+
+    Returns:
+        JSON: List of objects with the ISBN-13, title, author and rating of each book, best rated first
+    """
+    prefix = request.args.get('prefix', '')
+    limit = int(request.args.get('limit', 10))
+
+    # Validate input
+    if not prefix.strip() or limit < 1:
+        logger.warning("Invalid parameters: prefix=%s, limit=%s", prefix, limit)
+        return jsonify({
+            "error": "Invalid parameters",
+            "message": "prefix must not be empty and limit must be greater than 0"
+        }), 400
+    min_length = g.catalogue.suggest_index.min_prefix_length
+    if len(max(normalize_tokens(prefix), key=len, default='')) < min_length:
+        logger.warning("Prefix too short: %s", prefix)
+        return jsonify({
+            "error": "Invalid parameters",
+            "message": f"prefix must contain a word of at least {min_length} characters"
+        }), 400
+
+    suggestions = g.catalogue.suggest_index.suggest(prefix, min(limit, current_app.config['SUGGEST_MAX_RESULTS']))
+    logger.debug("Returning %s suggestions for prefix %s", len(suggestions), prefix)
+    return jsonify(suggestions)
+
+
+@books_api.route('/books:batchUpsert', methods=['POST'])
+@expensive
+async def batch_upsert_books():
+    """
+    Insert or replace many books in one request.
+
+    Request Body:
+        JSON: List of book objects, each with its ISBN-13 and optionally the URL of its thumbnail
+
+    Returns:
+        JSON: Status of each book, in request order. 200 if every book was stored and indexed, 207 otherwise.
+    """
+    logger.info("POST /books:batchUpsert request received")
+    items = request.json
+    max_books = current_app.config['BATCH_UPSERT_MAX_BOOKS']
+
+    # Validate input
+    if not isinstance(items, list):
+        logger.warning("Invalid batch: request body is not a list")
+        return jsonify({'error': 'Invalid batch', 'message': 'Request body must be a list of books'}), 400
+    if len(items) > max_books:
+        logger.warning("Batch too large: %s books", len(items))
+        return jsonify({'error': 'Batch too large', 'message': f'A batch can contain at most {max_books} books'}), 413
+
+    # Validate every book, and only store the valid ones
+    schema = BookSchema(many=True, enums=g.catalogue.enums)
+    errors = schema.validate(items)
+    valid_indexes = [index for index in range(len(items)) if index not in errors]
+
+    try:
+        books = schema.load([items[index] for index in valid_indexes])
+        results = await g.catalogue.book_service.batch_upsert_books(
+            books,
+            thumbnail_concurrency=current_app.config['THUMBNAIL_UPLOAD_CONCURRENCY']
+        )
+    except Exception as e:
+        logger.exception("Error upserting books: %s", e)
+        return jsonify({'error': 'Internal Server Error', 'message': str(e)}), 500
+
+    statuses = [None] * len(items)
+    for index, result in zip(valid_indexes, results):
+        statuses[index] = result
+    for index, messages in errors.items():
+        isbn_13 = items[index].get('isbn_13') if isinstance(items[index], dict) else None
+        statuses[index] = {'isbn_13': isbn_13, 'status': 'invalid', 'indexed': False, 'error': messages}
+
+    succeeded = sum(1 for status in statuses if status['status'] in ('created', 'updated') and 'error' not in status)
+    logger.info("Batch upsert stored %s/%s books without errors", succeeded, len(items))
+    return jsonify(statuses), 200 if succeeded == len(items) else 207
 
 
 # CRUD ROUTES
@@ -66,86 +388,160 @@ async def get_book(id):
 
     Query Parameters:
         id (str): The ISBN-13 of the book to retrieve.
+        size (str): The thumbnail rendition to link to: small, medium or large (default: original).
 
     Returns:
-        JSON: Book object with presigned URL for thumbnail
+        JSON: Book object with presigned URL for thumbnail, with an ETag and Last-Modified.
+            304 if the book is unchanged since the ETag in If-None-Match, or the date in If-Modified-Since.
     """
     # Validate input
-    logger.info(f"GET /book/{id} request received")
+    logger.info("GET /book/%s request received", id)
     if not id.isdigit() or len(id) != 13:
-        logger.warning(f"Invalid ISBN-13 format: {id}")
+        logger.warning("Invalid ISBN-13 format: %s", id)
         return jsonify({
             'error': 'Invalid ISBN-13 format.',
             'message': 'ISBN-13 must be a 13-digit number.'
         }), 400
+    size = request.args.get('size')
+    if size and size not in RENDITION_WIDTHS:
+        logger.warning("Invalid thumbnail size: %s", size)
+        return jsonify({
+            'error': 'Invalid parameters',
+            'message': f"Size must be one of: {', '.join(RENDITION_WIDTHS)}"
+        }), 400
 
     # Get book
     try:
-        book = await book_service.retrieve_book(id)
+        book = await g.catalogue.book_service.find_book(id)
         if not book:
-            logger.warning(f"Book not found: {id}")
+            logger.warning("Book not found: %s", id)
             return jsonify({'error': 'Book not found.'}), 404
+        epoch = presign_epoch()
+        etag, last_modified = book_version_etag([book], size, epoch), book.get('updated_at')
+        if last_modified is not None:
+            # MongoDB returns naive UTC datetimes
+            last_modified = max(last_modified, datetime.fromtimestamp(epoch, timezone.utc).replace(tzinfo=last_modified.tzinfo))
+        response = not_modified(etag, last_modified)
+        if response is not None:
+            logger.info("Book not modified: %s", id)
+            return response
+        await g.catalogue.book_service.attach_thumbnail_urls([book], size)
     except Exception as e:
-        logger.exception(f"Error retrieving book: {str(e)}")
+        logger.exception("Error retrieving book: %s", e)
         return jsonify({'error': 'Internal Server Error', 'message': str(e)}), 500
     
-    logger.info(f"Book found: {book}")
-    return jsonify(book), 200
+    logger.info("Book found: %s", id)
+    return set_cache_headers(books_response(book), etag, last_modified)
+
+
+@books_api.route('/book/<id>/similar', methods=['GET'])
+@expensive
+async def get_similar_books(id):
+    """
+    Retrieve the books most similar to a book, from its stored vector.
+
+    Query Parameters:
+        id (str): The ISBN-13 of the book.
+        limit (int): The maximum number of books to return (default: 10, at most MAX_LIMIT).
+        size (str): The thumbnail rendition to link to: small, medium or large (default: original).
+        fields (str): Comma-separated fields to return, e.g. 'title,author,thumbnail' (default: all). The score is always returned.
+
+    Returns:
+        JSON: List of book objects with similarity scores and presigned URLs for thumbnails, most similar first
+    """
+    logger.info("GET /book/%s/similar request received with params: limit=%s", id, request.args.get('limit'))
+    if not id.isdigit() or len(id) != 13:
+        logger.warning("Invalid ISBN-13 format: %s", id)
+        return jsonify({
+            'error': 'Invalid ISBN-13 format.',
+            'message': 'ISBN-13 must be a 13-digit number.'
+        }), 400
+    limit = int(request.args.get('limit', 10))
+    size = request.args.get('size')
+    if limit < 1:
+        logger.warning("Invalid parameters: limit=%s", limit)
+        return jsonify({"error": "Invalid parameters", "message": "limit must be greater than 0"}), 400
+    response = limit_too_large(limit)
+    if response is not None:
+        return response
+    if size and size not in RENDITION_WIDTHS:
+        logger.warning("Invalid thumbnail size: %s", size)
+        return jsonify({
+            'error': 'Invalid parameters',
+            'message': f"Size must be one of: {', '.join(RENDITION_WIDTHS)}"
+        }), 400
+    try:
+        fields = parse_fields(request.args.get('fields'), BOOK_FIELDS)
+        if fields is not None:
+            fields.add('score')
+    except ValueError as e:
+        logger.warning("Invalid fields: %s", request.args.get('fields'))
+        return jsonify({"error": "Invalid parameters", "message": str(e)}), 400
+
+    try:
+        books = await g.catalogue.book_service.similar_books(id, limit, size=size, fields=fields)
+    except BookNotFoundError:
+        logger.warning("Book not found: %s", id)
+        return jsonify({'error': 'Book not found.'}), 404
+    except Exception as e:
+        logger.exception("Error finding similar books: %s", e)
+        return jsonify({'error': 'Internal Server Error', 'message': str(e)}), 500
+
+    logger.info("Returning %s similar books", len(books))
+    return books_response(books, fields=fields)
 
 
 @books_api.route('/book/<id>', methods=['PUT'])
+@expensive
 async def add_book(id):
     """
     Add a new book to the database.
+    The book is stored in MongoDB, S3 and the vector index concurrently. If the vector index is
+    updated by the indexer instead, 202 is returned as the book is not searchable yet.
 
     Query Parameters:
         id (str): The ISBN-13 of the book to add.
 
     Request Body:
-        JSON: Book metadata (title, author, genre, etc.)
+        JSON: Book metadata (title, author, genre, etc.) and the URL of the thumbnail
 
     Returns:
-        JSON: Book object with presigned URL for thumbnail
+        JSON: Stored book object
     """
-    logger.info(f"PUT /book/{id} request received with data: {request.json}")
-    schema = BookSchema()
+    logger.info("PUT /book/%s request received", id)
+    schema = BookSchema(enums=g.catalogue.enums)
 
     try:
         # Validate and deserialize input
         request_data = request.json
         request_data['isbn_13'] = id
         book_data = schema.load(request_data)
-        
-        # TODO: USE BOOK_SERVICE TO STORE BOOK
-
-        # Insert book metadata
-        book = db.books.insert_one(book_data)
-        # Embed book metadata
-        model = WeightedEmbeddingModel(use_mps=True)
-        embedding = model.embed([book_data])[0]
-        pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-        index = pc.Index(host=os.getenv("PINECONE_INDEX_HOST"))
-        result = index.upsert(vectors=[(book_data['isbn_13'], embedding)])
-        # Upload to thumbnail to S3
-
-
 
+        book = await g.catalogue.book_service.store_book(book_data)
     except ValidationError as e:
-        logger.warning(f"Validation error: {e.messages}")
+        logger.warning("Validation error: %s", e.messages)
         return jsonify({'error': 'Validation Error', 'message': e.messages}), 400
+    except BookExistsError as e:
+        logger.warning("Book already exists: %s", id)
+        return jsonify({'error': 'Book already exists.', 'message': str(e)}), 409
+    except (ThumbnailUploadError, VectorServiceError) as e:
+        logger.error("Error storing book in a downstream service: %s", e)
+        return jsonify({'error': 'Bad Gateway', 'message': str(e)}), 502
     except Exception as e:
-        logger.exception(f"Error adding book: {str(e)}")
+        logger.exception("Error adding book: %s", e)
         return jsonify({'error': 'Internal Server Error', 'message': str(e)}), 500
     
-    logger.info(f"Book added successfully: {book}")
-    return jsonify(book), 200
+    logger.info("Book added successfully: %s", id)
+    return jsonify(book), 200 if g.catalogue.book_service.index_on_write else 202
 
     
 
 @books_api.route('/book/<id>', methods=['PATCH'])
-def update_book(id):
+@expensive
+async def update_book(id):
     """
     Update an existing book in the database.
+    The book's vector is only refreshed if a field that contributes to its embedding changed.
 
     Query Parameters:
         id (str): The ISBN-13 of the book to update.
@@ -156,33 +552,37 @@ def update_book(id):
     Returns:
         JSON: Updated book object
     """
-    logger.info(f"PATCH /book/{id} request received with data: {request.json}")
-    schema = BookUpdateSchema()
+    logger.info("PATCH /book/%s request received", id)
+    schema = BookUpdateSchema(enums=g.catalogue.enums)
 
-    # TODO: USE BOOK_SERVICE TO UPDATE BOOK
     try:
-        data = schema.load(request.json)
-        book = db.books.update_one(
-            {'_id': ObjectId(id)},
-            {'$set': data}
-        )
-
+        request_data = request.json
+        request_data['isbn_13'] = id
+        data = schema.load(request_data)
+        book = await g.catalogue.book_service.update_book(id, data)
     except ValidationError as e:
-        logger.warning(f"Validation error: {e.messages}")
+        logger.warning("Validation error: %s", e.messages)
         return jsonify({'error': 'Validation Error', 'messages': e.messages}), 400
+    except BookNotFoundError:
+        logger.warning("Book not found with id %s", id)
+        return jsonify({'error': 'Book not found.'}), 404
+    except VectorServiceError as e:
+        # The update is stored and the indexer re-embeds the book
+        logger.error("Error refreshing the vector of book %s: %s", id, e)
+        return jsonify({'error': 'Bad Gateway', 'message': f"The book was updated, but its vector was not: {e}"}), 502
     except Exception as e:
-        logger.exception(f"Error updating book: {str(e)}")
+        logger.exception("Error updating book: %s", e)
         return jsonify({'error': 'Internal Server Error', 'message': str(e)}), 500
     
-    logger.info(f"Book updated successfully: {book}")
+    logger.info("Book updated successfully: %s", id)
     return jsonify(book), 200
 
      
 
 @books_api.route('/book/<id>', methods=['DELETE'])
-def delete_book(id):
+async def delete_book(id):
     """
-    Delete a book from the database.
+    Delete a book from the database, along with its thumbnail and vector.
 
     Query Parameters:
         id (str): The ISBN-13 of the book to delete.
@@ -190,17 +590,15 @@ def delete_book(id):
     Returns:
         JSON: Success message
     """
-    logger.info(f"DELETE /book/{id} request received")
-    # TODO: USE BOOK_SERVICE TO DELETE BOOK
+    logger.info("DELETE /book/%s request received", id)
     try:
-        result = db.books.delete_one({'isbn_13': id})
+        await g.catalogue.book_service.delete_book(id)
+    except BookNotFoundError:
+        logger.warning("Book not found with id %s", id)
+        return jsonify({'error': 'Book not found.'}), 404
     except Exception as e:
-        logger.exception(f"Error deleting book: {str(e)}")
+        logger.exception("Error deleting book: %s", e)
         return jsonify({'error': 'Internal Server Error', 'message': str(e)}), 500
     
-    if result.deleted_count > 0:
-        logger.info(f"Book deleted successfully with id {id}")
-        return jsonify({'success': 'Book deleted successfully!'}), 204
-    else:
-        logger.warning(f"Book not found with id {id}")
-        return jsonify({'error': 'Book not found.'}), 404
\ No newline at end of file
+    logger.info("Book deleted successfully with id %s", id)
+    return jsonify({'success': 'Book deleted successfully!'}), 204
\ No newline at end of file
@@ -1,6 +1,29 @@
 from marshmallow import Schema, fields, validate
 
-class BookSchema(Schema):
+# The values of the enum fields, unless a catalogue defines its own
+CATEGORIES = ["Cyberpunk", "Thriller", "Comics", "Mystery", "Action Adventure"]
+FORMATS = ["Ebook", "Audiobook", "Paperback"]
+LENGTHS = ["Short Read", "Standard Length", "Long Read"]
+
+class CatalogueSchema(Schema):
+    """
+    Base schema whose enum fields are validated against the values of a catalogue.
+    """
+    # Enum fields, and the catalogue setting holding their values
+    ENUM_FIELDS = {'category': 'categories', 'format': 'formats', 'length': 'lengths'}
+
+    def __init__(self, *args, enums=None, **kwargs):
+        """
+        Args:
+            enums (dict): The values of 'categories', 'formats' and 'lengths'. Defaults to CATEGORIES, FORMATS and LENGTHS.
+        """
+        super().__init__(*args, **kwargs)
+        enums = {'categories': CATEGORIES, 'formats': FORMATS, 'lengths': LENGTHS, **(enums or {})}
+        # The fields are copied per schema instance, so this does not affect other catalogues
+        for field, setting in self.ENUM_FIELDS.items():
+            self.fields[field].validators = [validate.OneOf(enums[setting])]
+
+class BookSchema(CatalogueSchema):
     """
     Schema for validating and deserializing complete book data.
     Used for book creation.
@@ -9,16 +32,17 @@ class BookSchema(Schema):
         validate.Length(equal=13),
         validate.Regexp('^[0-9]+$', error="ISBN must be numeric")
     ))
-    title = fields.Str(requried=True)
+    title = fields.Str(required=True)
     author = fields.Str(required=True)
     description = fields.Str(required=True)
-    category = fields.Str(required=True, validate=validate.OneOf(["Romance", "Thriller", "Comics", "Mystery", "Action Adventure"]))
-    format = fields.Str(required=True, validate=validate.OneOf(["Ebook", "Audiobook", "Paperback"]))
-    length = fields.Str(required=True, validate=validate.OneOf(["Short Read", "Standard Length", "Long Read"]))
+    category = fields.Str(required=True)
+    format = fields.Str(required=True)
+    length = fields.Str(required=True)
     rating = fields.Float(validate=validate.Range(min=0, max=5))
     published_year = fields.Int(required=True, validate=validate.Range(min=1970, max=2024))
+    thumbnail = fields.Url()
 
-class BookUpdateSchema(Schema):
+class BookUpdateSchema(CatalogueSchema):
     """
     Schema for validating and deserializing partial book data.
     Used for updating book information.
@@ -30,8 +54,8 @@ class BookUpdateSchema(Schema):
     title = fields.Str()
     author = fields.Str()
     description = fields.Str()
-    category = fields.Str(validate=validate.OneOf(["Romance", "Thriller", "Comics", "Mystery", "Action Adventure"]))
-    format = fields.Str(validate=validate.OneOf(["Ebook", "Audiobook", "Paperback"]))
-    length = fields.Str(validate=validate.OneOf(["Short Read", "Standard Length", "Long Read"]))
+    category = fields.Str()
+    format = fields.Str()
+    length = fields.Str()
     rating = fields.Float(validate=validate.Range(min=0, max=5))
     published_year = fields.Int(validate=validate.Range(min=1970, max=2024))
\ No newline at end of file
@@ -0,0 +1,68 @@
+import os
+from .api.schemas import CATEGORIES, FORMATS, LENGTHS
+from .exceptions import CatalogueNotFoundError
+from utils.helpers import THUMBNAIL_PREFIX
+
+# Enum values of a catalogue that does not define its own
+DEFAULT_ENUMS = {'categories': CATEGORIES, 'formats': FORMATS, 'lengths': LENGTHS}
+
+
+def catalogue_ids(config):
+    """
+    Returns the ids of every configured catalogue.
+
+    Args:
+        config (dict): The app config.
+
+    Returns:
+        list: The catalogue ids, the default catalogue first.
+    """
+    default = config['DEFAULT_CATALOGUE']
+    return [default] + [catalogue_id for catalogue_id in config['CATALOGUES'] if catalogue_id != default]
+
+
+def catalogue_config(config, catalogue_id=None):
+    """
+    Returns the config of a catalogue: the app config, with the storage settings and enum values of the catalogue.
+
+    The default catalogue is stored in MONGO_DB, AWS_BUCKET_NAME under thumbnails/, the default vector namespace
+    and LOCAL_VECTOR_INDEX_PATH, so a single-catalogue deployment keeps its data. Any other catalogue is stored in
+    the '<MONGO_DB>_<id>' database of the same cluster, under 'catalogues/<id>/thumbnails/' in the same bucket, in
+    the '<id>' namespace of the same Pinecone index, or in a '<LOCAL_VECTOR_INDEX_PATH>_<id>.npz' local index.
+    Each of these but the thumbnail prefix can be overridden in the catalogue's settings. The prefixes never
+    overlap, so catalogues that hold the same ISBN-13 write, delete and audit their own thumbnails.
+
+    Args:
+        config (dict): The app config.
+        catalogue_id (str): The catalogue. Defaults to DEFAULT_CATALOGUE.
+
+    Returns:
+        dict: The config, with CATALOGUE set to the catalogue id, THUMBNAIL_PREFIX to the S3 prefix of its
+            thumbnails and CATALOGUE_ENUMS to its enum values.
+
+    Raises:
+        CatalogueNotFoundError: If the catalogue is not configured.
+    """
+    default = config['DEFAULT_CATALOGUE']
+    catalogue_id = catalogue_id or default
+    if catalogue_id != default and catalogue_id not in config['CATALOGUES']:
+        raise CatalogueNotFoundError(f"Catalogue '{catalogue_id}' not found")
+
+    settings = config['CATALOGUES'].get(catalogue_id, {})
+    is_default = catalogue_id == default
+
+    local_vector_index_path = config.get('LOCAL_VECTOR_INDEX_PATH')
+    if local_vector_index_path and not is_default:
+        root, extension = os.path.splitext(local_vector_index_path)
+        local_vector_index_path = f"{root}_{catalogue_id}{extension}"
+
+    return {
+        **config,
+        'CATALOGUE': catalogue_id,
+        'MONGO_DB': settings.get('mongo_db') or (config['MONGO_DB'] if is_default else f"{config['MONGO_DB']}_{catalogue_id}"),
+        'AWS_BUCKET_NAME': settings.get('bucket') or config['AWS_BUCKET_NAME'],
+        'THUMBNAIL_PREFIX': THUMBNAIL_PREFIX if is_default else f"catalogues/{catalogue_id}/{THUMBNAIL_PREFIX}",
+        'PINECONE_NAMESPACE': settings.get('vector_namespace', None if is_default else catalogue_id),
+        'LOCAL_VECTOR_INDEX_PATH': settings.get('local_vector_index_path', local_vector_index_path),
+        'CATALOGUE_ENUMS': {setting: settings.get(setting, values) for setting, values in DEFAULT_ENUMS.items()}
+    }
@@ -1,4 +1,5 @@
 import os
+from utils.helpers import load_catalogues, parse_field_weights
 
 class Config:
     """
@@ -7,13 +8,118 @@ class Config:
     MONGO_URI =os.getenv('MONGO_URI')
     MONGO_DB = os.getenv('MONGO_DB')
 
+    # Catalogues are served under /api/v1/catalogues/<id>/ and share the connections and models. CATALOGUES_FILE
+    # is a JSON object of settings by catalogue id. DEFAULT_CATALOGUE is also served under /api/v1/ and stored in
+    # MONGO_DB, AWS_BUCKET_NAME and the default vector namespace unless its settings say otherwise
+    CATALOGUES = load_catalogues(os.getenv('CATALOGUES_FILE'))
+    DEFAULT_CATALOGUE = os.getenv('DEFAULT_CATALOGUE', 'scifi')
+
     AWS_BUCKET_NAME = os.getenv('AWS_BUCKET_NAME')
     AWS_REGION = os.getenv('AWS_REGION', 'us-east-1')
     AWS_ACCESS_KEY_ID = os.getenv('AWS_ACCESS_KEY_ID')
     AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
+    # Set to use an S3-compatible emulator (e.g. MinIO or LocalStack) instead of AWS
+    AWS_ENDPOINT_URL = os.getenv('AWS_ENDPOINT_URL') or None
 
     HF_MODEL_NAME = os.getenv('HF_MODEL_NAME')
 
     PINECONE_API_KEY = os.getenv('PINECONE_API_KEY')
     PINECONE_INDEX_HOST = os.getenv('PINECONE_INDEX_HOST')
 
+    # 'pinecone' or 'local'
+    VECTOR_BACKEND = os.getenv('VECTOR_BACKEND', 'pinecone')
+    LOCAL_VECTOR_INDEX_PATH = os.getenv('LOCAL_VECTOR_INDEX_PATH', 'data/vectors.npz')
+
+    VECTOR_UPSERT_BATCH_SIZE = int(os.getenv('VECTOR_UPSERT_BATCH_SIZE', 100))
+
+    # Field weights as 'field:weight,...'. Defaults to WeightedEmbeddingModel.FIELD_WEIGHTS
+    FIELD_WEIGHTS = parse_field_weights(os.getenv('FIELD_WEIGHTS'))
+    # 'single' stores one weighted vector per book, so changing FIELD_WEIGHTS requires a re-index.
+    # 'multi' stores a vector per field in MULTI_VECTOR_FIELDS, and the weights are applied at query time.
+    RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'single')
+    MULTI_VECTOR_FIELDS = [field.strip() for field in os.getenv('MULTI_VECTOR_FIELDS', '').split(',') if field.strip()] or None
+
+    # Re-orders the top RERANK_CANDIDATES search results with a cross-encoder. Searches wait at most
+    # RERANK_BUDGET_SECONDS for it and keep the vector search order otherwise
+    RERANK_ENABLED = os.getenv('RERANK_ENABLED', 'false').lower() == 'true'
+    RERANK_MODEL_NAME = os.getenv('RERANK_MODEL_NAME', 'cross-encoder/ms-marco-MiniLM-L-6-v2')
+    RERANK_MAX_LENGTH = int(os.getenv('RERANK_MAX_LENGTH', 256))
+    RERANK_CANDIDATES = int(os.getenv('RERANK_CANDIDATES', 50))
+    RERANK_BUDGET_SECONDS = float(os.getenv('RERANK_BUDGET_SECONDS', 0.15))
+    RERANK_CACHE_SIZE = int(os.getenv('RERANK_CACHE_SIZE', 1024))
+    # Model passes that may be running or waiting at once per process. Searches over it skip re-ranking
+    RERANK_MAX_PENDING = int(os.getenv('RERANK_MAX_PENDING', 2))
+
+    BATCH_UPSERT_MAX_BOOKS = int(os.getenv('BATCH_UPSERT_MAX_BOOKS', 5000))
+    THUMBNAIL_UPLOAD_CONCURRENCY = int(os.getenv('THUMBNAIL_UPLOAD_CONCURRENCY', 32))
+    IMAGE_PROCESS_WORKERS = int(os.getenv('IMAGE_PROCESS_WORKERS', os.cpu_count() or 1))
+
+    # When false, writes return 202 and the indexer worker updates the vector index
+    INDEX_ON_WRITE = os.getenv('INDEX_ON_WRITE', 'true').lower() == 'true'
+
+    INDEXER_BATCH_SIZE = int(os.getenv('INDEXER_BATCH_SIZE', 256))
+    INDEXER_MAX_WAIT_SECONDS = float(os.getenv('INDEXER_MAX_WAIT_SECONDS', 1.0))
+    INDEXER_POLL_INTERVAL_SECONDS = float(os.getenv('INDEXER_POLL_INTERVAL_SECONDS', 1.0))
+    # Retries of a failing batch before it is split to find the books that fail, which are dead-lettered
+    INDEXER_MAX_RETRIES = int(os.getenv('INDEXER_MAX_RETRIES', 5))
+
+    # 'orjson', 'default', or 'auto' to use orjson if it is installed
+    JSON_PROVIDER = os.getenv('JSON_PROVIDER', 'auto')
+    # Number of books whose serialized JSON is cached for list responses. 0 disables the cache
+    BOOK_PAYLOAD_CACHE_SIZE = int(os.getenv('BOOK_PAYLOAD_CACHE_SIZE', 10000))
+
+    # Gzip responses of at least COMPRESSION_MIN_SIZE bytes for clients that accept it.
+    # COMPRESSION_LEVEL applies to the cached book fragments, so it is paid once per book
+    COMPRESSION_ENABLED = os.getenv('COMPRESSION_ENABLED', 'true').lower() == 'true'
+    COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))
+    COMPRESSION_LEVEL = int(os.getenv('COMPRESSION_LEVEL', 9))
+
+    # Seconds clients may reuse a book or page before revalidating with its ETag.
+    # Must stay well below the 1 hour lifetime of the presigned thumbnail URLs in the response. Validators change
+    # every hour less HTTP_CACHE_MAX_AGE, so a revalidated response never outlives its URLs
+    HTTP_CACHE_MAX_AGE = int(os.getenv('HTTP_CACHE_MAX_AGE', 300))
+
+    # Neighbours stored per book by scripts/compute_similar_books.py
+    SIMILAR_BOOKS_TOP_N = int(os.getenv('SIMILAR_BOOKS_TOP_N', 50))
+
+    # Upper bound on the limit of /suggest, and the number of recent prefixes whose suggestions are cached
+    SUGGEST_MAX_RESULTS = int(os.getenv('SUGGEST_MAX_RESULTS', 20))
+    SUGGEST_CACHE_SIZE = int(os.getenv('SUGGEST_CACHE_SIZE', 1024))
+    # Minimum length of the longest word of a /suggest prefix
+    SUGGEST_MIN_PREFIX_LENGTH = int(os.getenv('SUGGEST_MIN_PREFIX_LENGTH', 2))
+    # Seconds between refreshes of the suggest index from MongoDB, for writes made by other processes. 0 disables them
+    SUGGEST_REFRESH_SECONDS = float(os.getenv('SUGGEST_REFRESH_SECONDS', 5))
+
+    # Exposes Prometheus metrics at /metrics
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+
+    # Samples PROFILING_SAMPLE_RATE of requests with a statistical profiler
+    PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'false').lower() == 'true'
+    PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', 0.01))
+    # Requests sending this token in PROFILING_HEADER are always profiled, even when PROFILING_ENABLED is false
+    PROFILING_ADMIN_TOKEN = os.getenv('PROFILING_ADMIN_TOKEN') or None
+    PROFILING_HEADER = os.getenv('PROFILING_HEADER', 'X-Profile-Token')
+    PROFILING_INTERVAL_SECONDS = float(os.getenv('PROFILING_INTERVAL_SECONDS', 0.005))
+    PROFILING_DIR = os.getenv('PROFILING_DIR', 'profiles')
+
+    # Rate limits each client, identified by the API key in RATE_LIMIT_KEY_HEADER or else its IP address, to
+    # RATE_LIMIT_PER_SECOND requests per second with bursts of RATE_LIMIT_BURST. 0 disables rate limiting.
+    # RATE_LIMIT_STORE is 'memory' (each process limits on its own) or 'mongodb' (shared by every process)
+    RATE_LIMIT_PER_SECOND = float(os.getenv('RATE_LIMIT_PER_SECOND', 0))
+    RATE_LIMIT_BURST = int(os.getenv('RATE_LIMIT_BURST', 20))
+    RATE_LIMIT_KEY_HEADER = os.getenv('RATE_LIMIT_KEY_HEADER', 'X-API-Key')
+    RATE_LIMIT_STORE = os.getenv('RATE_LIMIT_STORE', 'memory')
+
+    # At most EXPENSIVE_MAX_CONCURRENT searches and embedding writes run at once per process. Up to
+    # EXPENSIVE_MAX_QUEUE more wait up to EXPENSIVE_QUEUE_TIMEOUT_SECONDS for a slot, the rest get a 503.
+    # 0 disables the cap
+    EXPENSIVE_MAX_CONCURRENT = int(os.getenv('EXPENSIVE_MAX_CONCURRENT', 8))
+    EXPENSIVE_MAX_QUEUE = int(os.getenv('EXPENSIVE_MAX_QUEUE', 32))
+    EXPENSIVE_QUEUE_TIMEOUT_SECONDS = float(os.getenv('EXPENSIVE_QUEUE_TIMEOUT_SECONDS', 1.0))
+
+    # Reads still running after REQUEST_TIMEOUT_SECONDS get a 504 and their MongoDB operations are cancelled.
+    # 0 disables the deadline
+    REQUEST_TIMEOUT_SECONDS = float(os.getenv('REQUEST_TIMEOUT_SECONDS', 10))
+
+    # Upper bound on the limit of /books, /search and /book/<isbn_13>/similar
+    MAX_LIMIT = int(os.getenv('MAX_LIMIT', 100))
@@ -1,5 +1,16 @@
-from flask.json.provider import DefaultJSONProvider
+from datetime import date
+from decimal import Decimal
+from uuid import UUID
+from flask.json.provider import DefaultJSONProvider, JSONProvider
+from werkzeug.http import http_date
 from bson import ObjectId
+from utils.logger import logger
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 class CustomJSONEncoder(DefaultJSONProvider):
     """
@@ -9,4 +20,72 @@ class CustomJSONEncoder(DefaultJSONProvider):
     def default(self, obj):
         if isinstance(obj, ObjectId):
             return str(obj)
-        return DefaultJSONProvider.default(self, obj)
\ No newline at end of file
+        return super().default(obj)
+
+
+    def dumpb(self, obj):
+        """
+        Serializes an object to UTF-8 JSON bytes.
+        """
+        return self.dumps(obj).encode()
+
+
+class OrjsonProvider(JSONProvider):
+    """
+    A JSON provider backed by orjson, which serializes documents several times faster than the json module.
+    ObjectIds are serialized as strings, and dates as HTTP dates like the default provider, so responses
+    are interchangeable with CustomJSONEncoder's.
+    """
+    sort_keys = True
+    mimetype = 'application/json'
+
+    def dumps(self, obj, **kwargs):
+        return self.dumpb(obj).decode()
+
+
+    def dumpb(self, obj):
+        """
+        Serializes an object to UTF-8 JSON bytes.
+        """
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=_orjson_default, option=option)
+
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumpb(obj), mimetype=self.mimetype)
+
+
+def _orjson_default(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, date):
+        return http_date(obj)
+    if isinstance(obj, (Decimal, UUID)):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def create_json_provider(app, name='auto'):
+    """
+    Creates the app's JSON provider.
+
+    Args:
+        app (Flask): The app.
+        name (str): 'orjson', 'default', or 'auto' to use orjson if it is installed.
+
+    Returns:
+        JSONProvider: The provider, with a dumpb method that serializes to bytes.
+    """
+    if name in ('orjson', 'auto') and orjson is not None:
+        return OrjsonProvider(app)
+    if name in ('orjson', 'auto'):
+        logger.warning("JSON_PROVIDER is %s, but orjson is not installed (pip install orjson). "
+                       "Using the slower default JSON provider", name)
+    return CustomJSONEncoder(app)
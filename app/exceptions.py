@@ -43,4 +43,9 @@ class VectorEmbeddingError(VectorServiceError):
 
 class VectorUpsertError(VectorServiceError):
     """Raised when upserting vectors to Pinecone fails"""
-    pass
\ No newline at end of file
+    pass
+
+# Catalogue exceptions
+class CatalogueNotFoundError(ServiceError):
+    """Raised when a request names a catalogue that is not configured"""
+    pass
@@ -0,0 +1,62 @@
+import numpy as np
+from utils.logger import logger
+from utils.metrics import SERVICE_CALL_DURATION, timed
+
+class CrossEncoderReranker():
+    """
+    A class to score how relevant books are to a query using a cross-encoder, which reads the query and a book
+    together. It ranks far better than comparing independent embeddings, but costs a model pass per pair, so it
+    is only used to re-order the top candidates of the vector search.
+    """
+
+    # Book fields the cross-encoder reads, in order
+    FIELDS = ['title', 'author', 'description']
+
+    def __init__(self, model_name, max_length=256, use_mps=True):
+        """
+        Initializes the CrossEncoderReranker with a CrossEncoder model and warms it up. Sets the device to use mps if available.
+
+        Args:
+            model_name (str): The name of the HF model, e.g. 'cross-encoder/ms-marco-MiniLM-L-6-v2'.
+            max_length (int): The number of tokens a query and book pair is truncated to.
+            use_mps (bool): Flag to use MPS device if available.
+        """
+        logger.info("Initializing CrossEncoderReranker")
+        # Imported here, so the app can be created without the model's dependencies when reranking is disabled
+        import torch
+        from sentence_transformers import CrossEncoder
+
+        if torch.backends.mps.is_available() and use_mps:
+            device = "mps"
+        else:
+            device = "cpu"
+        logger.debug("Loading cross-encoder %s on %s", model_name, device)
+        self._model = CrossEncoder(model_name, max_length=max_length, device=device)
+        self._model.predict([('warmup', 'warmup')], show_progress_bar=False)
+
+
+    @timed(SERVICE_CALL_DURATION, 'CrossEncoderReranker', 'score')
+    def score(self, query, books):
+        """
+        Scores the relevance of books to a query, with every pair in one batch.
+
+        Args:
+            query (str): The search query.
+            books (list): Book dictionaries with the fields in FIELDS.
+
+        Returns:
+            list: The relevance score of each book, higher is more relevant.
+        """
+        if not books:
+            return []
+        pairs = [(query, self.book_text(book)) for book in books]
+        scores = self._model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+        return np.asarray(scores, dtype=float).tolist()
+
+
+    @classmethod
+    def book_text(cls, book):
+        """
+        Returns the text of a book that is paired with the query, e.g. 'Dune. Frank Herbert. A desert planet...'.
+        """
+        return '. '.join(str(book[field]) for field in cls.FIELDS if book.get(field))
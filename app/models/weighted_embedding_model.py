@@ -1,8 +1,10 @@
-from sentence_transformers import SentenceTransformer
-import torch
+from collections import OrderedDict
+import threading
+import time
 import os
 import numpy as np
 from utils.logger import logger
+from utils.metrics import CACHE_REQUESTS, EMBED_BATCH_SIZE, ENCODE_BATCH_SIZE, ENCODE_DURATION, SERVICE_CALL_DURATION, timed
 from flask import current_app
 
 class WeightedEmbeddingModel():
@@ -11,7 +13,21 @@ class WeightedEmbeddingModel():
     Weights are applied to different fields of the book data to create a combined embedding.
     """
 
-    def __init__(self, model_name=None, batch_size=64, use_mps=True):
+    # Relative importance of each book field in the combined embedding. 'published' is derived from published_year.
+    FIELD_WEIGHTS = {
+        'title': 2,
+        'author': 2,
+        'description': 4,
+        'category': 1,
+        'format': 0.5,
+        'length': 0.5,
+        'published': 0.5
+    }
+
+    # Fields stored per book in the multi-vector retrieval mode. The short categorical fields are left out to keep it compact.
+    MULTI_VECTOR_FIELDS = ['title', 'author', 'description', 'category']
+
+    def __init__(self, model_name=None, batch_size=64, use_mps=True, cache_size=10000, weights=None):
         """
         Initializes the WeightedEmbeddingModel with a SentenceTranformer model and warms it up. Sets the device to use mps if available.
 
@@ -19,8 +35,15 @@ class WeightedEmbeddingModel():
             model_name (str): The name of the HF model.
             batch_size (int): The batch size for encoding.
             use_mps (bool): Flag to use MPS device if available.
+            cache_size (int): The maximum number of per-field text embeddings to keep cached.
+            weights (dict): Field weights to use instead of FIELD_WEIGHTS. Fields that are left out get a weight of 0.
         """
         logger.info("Initializing WeightedEmbeddingModel")
+        # Imported here, so the weighting and caching can be used without the model's dependencies (e.g. by the
+        # benchmarks' stand-in model)
+        import torch
+        from sentence_transformers import SentenceTransformer
+
         if not model_name:
             model_name = current_app.config["HF_MODEL_NAME"]
 
@@ -34,24 +57,22 @@ class WeightedEmbeddingModel():
         self._device = device
 
         # Load model and warm it up
-        logger.debug(f"Loading model: sentence-transformers/{model_name}")
+        logger.debug("Loading model: sentence-transformers/%s", model_name)
         self._model = SentenceTransformer(f'sentence-transformers/{model_name}').to(device)
         self._model.encode('warmup', device=device)
         self._batch_size = batch_size
 
+        # LRU cache of field text -> embedding, so unchanged fields are never re-encoded
+        self._cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
         # Define weights and normalize them
-        self._weights = {
-            'title': 2,
-            'author': 2,
-            'description': 4,
-            'category': 1,
-            'format': 0.5,
-            'length': 0.5,
-            'published': 0.5
-        }
+        self._weights = self.validate_weights(weights or self.FIELD_WEIGHTS)
         self._normalize_weights()
 
 
+    @timed(SERVICE_CALL_DURATION, 'WeightedEmbeddingModel', 'embed')
     def embed(self, books):
         """
         Creates weighted embeddings for a list of books.
@@ -62,46 +83,196 @@ class WeightedEmbeddingModel():
         Returns:
             list: A list of vectors representing the weighted embeddings of the books.
         """
-        logger.debug(f"Generating weighted embeddings for {len(books)} books")
-        # Flattened array that contains texts from each field for all the books. 
+        logger.debug("Generating weighted embeddings for %s books", len(books))
+        EMBED_BATCH_SIZE.labels('embed').observe(len(books))
+        # Dimensions: (books, num_fields, embedding_dim)
+        field_embeddings = self.embed_fields(books)
+
+        # Collapse the fields into a single vector per book using the normalized weights
+        # Dimensions: (books, embedding_dim)
+        weights = np.array(list(self._weights.values()))
+        weighted_embeddings = np.einsum('bfd,f->bd', field_embeddings, weights)
+
+        return weighted_embeddings.tolist()
+
+
+    @timed(SERVICE_CALL_DURATION, 'WeightedEmbeddingModel', 'embed_query')
+    def embed_query(self, query):
+        """
+        Embeds a free-text search query into the same space as the book embeddings.
+
+        Args:
+            query (str): The search query.
+
+        Returns:
+            list: The query vector.
+        """
+        return np.asarray(self._model.encode(query, device=self._device)).tolist()
+
+
+    @timed(SERVICE_CALL_DURATION, 'WeightedEmbeddingModel', 'embed_multi')
+    def embed_multi(self, books, fields=None):
+        """
+        Creates the multi-vector embedding of a list of books: the normalized vector of each field, concatenated.
+        The dot product with a query vector repeated once per field, each copy scaled by a field weight, is the
+        weighted sum of the per-field cosine similarities, so weights can be chosen at query time.
+
+        Args:
+            books (list): A list of book dictionaries.
+            fields (list): The fields to store. Defaults to MULTI_VECTOR_FIELDS.
+
+        Returns:
+            list: A list of vectors of length len(fields) * embedding_dim.
+        """
+        fields = fields or self.MULTI_VECTOR_FIELDS
+        logger.debug("Generating multi-vector embeddings of %s fields for %s books", len(fields), len(books))
+        EMBED_BATCH_SIZE.labels('embed_multi').observe(len(books))
+        # Dimensions: (books, num_fields, embedding_dim)
+        field_embeddings = self.embed_fields(books, fields)
+        norms = np.linalg.norm(field_embeddings, axis=2, keepdims=True)
+        norms[norms == 0] = 1
+        return (field_embeddings / norms).reshape(len(books), -1).tolist()
+
+
+    def embed_fields(self, books, fields=None):
+        """
+        Creates the unweighted embedding of every weighted field for a list of books.
+        Field texts that were encoded before are served from the cache, and duplicate texts are only encoded once.
+
+        Args:
+            books (list): A list of book dictionaries.
+            fields (list): The fields to embed. Defaults to the weighted fields.
+
+        Returns:
+            np.ndarray: An array of shape (books, num_fields, embedding_dim), with fields in the order of the weights.
+        """
+        fields = list(fields or self._weights)
+
+        # Flattened array that contains texts from each field for all the books.
         # Ex: ['title1', 'author1', 'description1', ..., 'title2', 'author2', 'description2', ...]
         # Dimensions: (books * num_fields,)
-        texts = []
-        # Contains the associated normalized weights for each text in the texts array.
-        # Dimsensions: (books * num_fields,)
-        text_weights = []
-
-        # Populate the texts and text_weights arrays by iterating through each book its fields
-        for book in books:
-            for field, weight in self._weights.items():
-                if field == 'published':
-                    # Get the book's age category instead of the published year. When searching for a book, we want to search for the age category, not the year.
-                    texts.append(self._get_book_age_category(book))
+        texts = [self.field_text(book, field) for book in books for field in fields]
+
+        # Only encode the texts that are not cached yet
+        unique_texts = dict.fromkeys(texts)
+        with self._cache_lock:
+            missing = [text for text in unique_texts if text not in self._cache]
+        logger.debug("Encoding %s of %s field texts (%s cached or duplicate)", len(missing), len(texts), len(texts) - len(missing))
+        CACHE_REQUESTS.labels('embedding_fields', 'hit').inc(len(unique_texts) - len(missing))
+        CACHE_REQUESTS.labels('embedding_fields', 'miss').inc(len(missing))
+
+        encoded = {}
+        if missing:
+            # Encode the texts using the SentenceTransformer model
+            # Dimensions: (missing, embedding_dim)
+            start = time.perf_counter()
+            embeddings = np.array(self._model.encode(
+                    missing,
+                    device=self._device,
+                    batch_size=self._batch_size
+                ))
+            ENCODE_DURATION.observe(time.perf_counter() - start)
+            ENCODE_BATCH_SIZE.observe(len(missing))
+            encoded = dict(zip(missing, embeddings))
+
+        # Assemble the per-field embeddings, refreshing the cache as we go
+        with self._cache_lock:
+            vectors = []
+            for text in texts:
+                if text in encoded:
+                    vector = encoded[text]
+                    self._cache[text] = vector
                 else:
-                    texts.append(book[field])
-                text_weights.append(weight)
-
-        # Encode the texts using the SentenceTransformer model
-        # Dimensions: (books * num_fields, embedding_dim)
-        embeddings = np.array(self._model.encode(
-                texts,
-                device=self._device,
-                batch_size=self._batch_size
-            ))
-        logger.debug(f"Generated {len(embeddings)} embeddings with shape {embeddings.shape}")
-
-        # Create a new array to store the combined weighted embeddings
-        # Dimensions: (books, embedding_dim)
-        weighted_embeddings = np.zeros((len(books), embeddings.shape[1]))
+                    vector = self._cache[text]
+                    self._cache.move_to_end(text)
+                vectors.append(vector)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+        return np.array(vectors).reshape(len(books), len(fields), -1)
+
+
+    def clear_cache(self):
+        """
+        Empties the per-field embedding cache.
+        """
+        with self._cache_lock:
+            self._cache.clear()
+
+
+    @classmethod
+    def field_text(cls, book, field):
+        """
+        Returns the text that is encoded for a weighted field of a book.
+
+        Args:
+            book (dict): A dictionary representing a book.
+            field (str): The name of the weighted field.
+
+        Returns:
+            str: The text to encode.
+        """
+        if field == 'published':
+            # Get the book's age category instead of the published year. When searching for a book, we want to search for the age category, not the year.
+            return cls._get_book_age_category(book)
+        return book[field]
+
+
+    @classmethod
+    def validate_weights(cls, weights):
+        """
+        Checks a set of field weights and puts them in the order of FIELD_WEIGHTS.
+
+        Args:
+            weights (dict): The weight of each field. Fields that are left out get a weight of 0.
+
+        Returns:
+            dict: The fields with a non-zero weight and their weights.
+
+        Raises:
+            ValueError: If a field is unknown, a weight is negative, or all weights are 0.
+        """
+        unknown = set(weights) - set(cls.FIELD_WEIGHTS)
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}. Fields: {', '.join(cls.FIELD_WEIGHTS)}")
+        if any(weight < 0 for weight in weights.values()):
+            raise ValueError("Field weights must not be negative")
+
+        weights = {field: weights[field] for field in cls.FIELD_WEIGHTS if weights.get(field)}
+        if not weights:
+            raise ValueError("At least one field weight must be greater than 0")
+        return weights
+
+
+    @classmethod
+    def source_fields(cls):
+        """
+        Returns the book fields that the weighted fields are derived from.
+
+        Returns:
+            set: The names of the book fields that affect the embedding.
+        """
+        return {'published_year' if field == 'published' else field for field in cls.FIELD_WEIGHTS}
+
+
+    @classmethod
+    def changed_fields(cls, old_book, new_book):
+        """
+        Determines which weighted fields differ between two versions of a book.
+        Changes to fields that are not weighted (e.g. rating) never affect the embedding.
+
+        Args:
+            old_book (dict): The stored version of the book.
+            new_book (dict): The updated version of the book.
+
+        Returns:
+            list: The names of the weighted fields whose encoded text changed.
+        """
+        return [
+            field for field in cls.FIELD_WEIGHTS
+            if cls.field_text(old_book, field) != cls.field_text(new_book, field)
+        ]
 
-        # Iterate through the embeddings and weights to create the weighted embeddings
-        num_weights = len(self._weights)
-        for i, (embedding, weight) in enumerate(zip(embeddings, text_weights)):
-            book_index = i // num_weights
-            weighted_embeddings[book_index] += embedding * weight
-        
-        return weighted_embeddings.tolist()
-        
 
     def _normalize_weights(self):
         """
@@ -112,7 +283,8 @@ class WeightedEmbeddingModel():
         self._weights = {key: value / total_weights for key, value in self._weights.items()}
         
 
-    def _get_book_age_category(self, book):
+    @staticmethod
+    def _get_book_age_category(book):
         """
         Determines the age category of a book based on its published year.
 
@@ -1,87 +1,629 @@
-from ..exceptions import BookExistsError
+import asyncio
+from datetime import datetime, timezone
+from pymongo import ReturnDocument, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+from ..exceptions import BookExistsError, BookNotFoundError, BookServiceError, VectorServiceError
+from ..models.cross_encoder_reranker import CrossEncoderReranker
+from ..workers.indexer import BookIndexer
+from utils.helpers import THUMBNAIL_PREFIX, generate_s3_key, generate_rendition_key
 from utils.logger import logger
+from utils.metrics import SERVICE_CALL_DURATION, timed
 
 class BookService:
     """
     BookService is a class that provides methods to retrieve and manipulate book data stored in a range of databases.
     """
 
-    def __init__(self, db, s3_service):
+    def __init__(self, db, s3_service, vector_service, index_on_write=True, payload_cache=None, suggest_index=None,
+                 reranker=None, thumbnail_prefix=THUMBNAIL_PREFIX):
         """
-        Initializes the BookService with a database connection and an S3 service instance.
+        Initializes the BookService with a database connection, an S3 service instance and a vector service instance.
+
+        Args:
+            index_on_write (bool): Flag to update the vector index in the request. When False, the indexer worker
+                picks up the change from MongoDB instead.
+            payload_cache (BookPayloadCache): The cache of serialized books to invalidate on writes, if any.
+            suggest_index (SuggestIndex): The prefix index to keep up to date on writes, if any.
+            reranker (RerankService): The second stage that re-orders search results, if any.
+            thumbnail_prefix (str): The S3 prefix the catalogue's thumbnails are stored under.
         """
         logger.info("Initializing BookService")
         self._db = db
         self._s3 = s3_service
+        self._vectors = vector_service
+        self._index_on_write = index_on_write
+        self._payloads = payload_cache
+        self._suggestions = suggest_index
+        self._reranker = reranker
+        self._thumbnail_prefix = thumbnail_prefix
+
+
+    @property
+    def index_on_write(self):
+        """
+        Returns whether writes update the vector index before returning.
+        """
+        return self._index_on_write
 
 
-    async def retrieve_books(self, page, limit):
+    @timed(SERVICE_CALL_DURATION, 'BookService', 'retrieve_books')
+    async def retrieve_books(self, page, limit, size=None, fields=None):
         """
         Asynchronously retrieves a list of books from the database with pagination.
 
         Args:
             page (int): The page number to retrieve.
             limit (int): The number of books to retrieve per page.
+            size (str): The thumbnail rendition to link to. Links to the original thumbnail if not set.
+            fields (set): The fields to read. Every field is read if not set.
 
         Returns:
             list: A list of books.
             None: If no books are found.
         """
-        # Retrieve book metadata from db
-        logger.debug(f"Retrieving books: page={page}, limit={limit}")
+        books = await self.find_books(page, limit, fields=fields)
+        if fields is None or 'thumbnail' in fields:
+            await self.attach_thumbnail_urls(books, size)
+        return books
+
+
+    @timed(SERVICE_CALL_DURATION, 'BookService', 'find_books')
+    async def find_books(self, page, limit, fields=None):
+        """
+        Asynchronously retrieves a page of books from the database, without thumbnail URLs.
+
+        Args:
+            page (int): The page number to retrieve.
+            limit (int): The number of books to retrieve per page.
+            fields (set): The fields to read, in addition to 'isbn_13' and 'updated_at'. Every field is read if not set.
+
+        Returns:
+            list: A list of books.
+        """
+        logger.debug("Retrieving books: page=%s, limit=%s, fields=%s", page, limit, fields)
         skip = (page - 1) * limit
-        cursor = self._db.books.find().skip(skip).limit(limit)
+        cursor = self._db.books.find({}, self._projection(fields)).skip(skip).limit(limit)
         books = list(cursor)
-        logger.debug(f"Retrieved {len(books)} books from the database")
-        
-        # Fetch presigned URLs for book covers
-        if books:
-            logger.debug(f"Fetching presigned URLs for {len(books)} books")
-            s3_keys = [book["thumbnail"] for book in books]
-            presigned_urls = await self._s3.fetch_presigned_urls(s3_keys)
-            for book, url in zip(books, presigned_urls):
-                book["thumbnail"] = url
-        
+        logger.debug("Retrieved %s books from the database", len(books))
         return books
-    
 
-    async def retrieve_book(self, isbn_13):
+
+    @timed(SERVICE_CALL_DURATION, 'BookService', 'retrieve_book')
+    async def retrieve_book(self, isbn_13, size=None):
         """
         Asynchronously retrieves a single book from the database.
 
         Args:
             isbn_13 (str): The ISBN-13 of the book to retrieve.
+            size (str): The thumbnail rendition to link to. Links to the original thumbnail if not set.
         
         Returns:
             dict: The book data.
             None: If the book is not found.
         """
-        # Retrieve book metadata from db
-        logger.debug(f"Retrieving book with ISBN-13: {isbn_13}")
-        book = self._db.books.find_one({'isbn_13': isbn_13})
-
-        # Fetch presigned URL for book cover
+        book = await self.find_book(isbn_13)
         if book:
-            logger.debug(f"Book found: {book}. Fetching presigned URL for cover")
-            presigned_url = await self._s3.fetch_presigned_url([book["thumbnail"]])
-            book["thumbnail"] = presigned_url
+            await self.attach_thumbnail_urls([book], size)
         return book
 
 
+    @timed(SERVICE_CALL_DURATION, 'BookService', 'find_book')
+    async def find_book(self, isbn_13):
+        """
+        Asynchronously retrieves a single book from the database, without its thumbnail URL.
+
+        Args:
+            isbn_13 (str): The ISBN-13 of the book to retrieve.
+
+        Returns:
+            dict: The book data.
+            None: If the book is not found.
+        """
+        logger.debug("Retrieving book with ISBN-13: %s", isbn_13)
+        return self._db.books.find_one({'isbn_13': isbn_13})
+
+
+    @timed(SERVICE_CALL_DURATION, 'BookService', 'attach_thumbnail_urls')
+    async def attach_thumbnail_urls(self, books, size=None):
+        """
+        Asynchronously replaces the thumbnail S3 key of each book with a presigned URL. Books without a thumbnail
+        keep None.
+
+        Args:
+            books (list): The books, as stored in the database. Updated in place.
+            size (str): The thumbnail rendition to link to. Links to the original thumbnail if not set.
+
+        Returns:
+            list: The books.
+        """
+        if books:
+            logger.debug("Fetching presigned URLs for %s books", len(books))
+            with_thumbnails = [book for book in books if book.get("thumbnail")]
+            s3_keys = [self._thumbnail_key(book, size) for book in with_thumbnails]
+            presigned_urls = await self._s3.fetch_presigned_urls(s3_keys)
+            for book, url in zip(with_thumbnails, presigned_urls):
+                book["thumbnail"] = url
+        return books
+
+
+    @timed(SERVICE_CALL_DURATION, 'BookService', 'search_books')
+    async def search_books(self, query, limit, size=None, weights=None, fields=None, rerank=True):
+        """
+        Asynchronously finds the books most similar to a free-text query.
+        With a re-ranker, the top candidates of the vector search are re-ordered by a cross-encoder if it
+        answers within its time budget.
+
+        Args:
+            query (str): The search query.
+            limit (int): The maximum number of books to return.
+            size (str): The thumbnail rendition to link to. Links to the original thumbnail if not set.
+            weights (dict): Field weights for this query (multi-vector retrieval mode only).
+            fields (set): The fields to read, in addition to 'isbn_13' and 'updated_at'. Every field is read if not set.
+            rerank (bool): Flag to use the re-ranker, if there is one.
+
+        Returns:
+            list: The matching books, most similar first, each with its similarity 'score', or the re-ranker's
+                relevance 'score' if they were re-ranked.
+
+        Raises:
+            ValueError: If the weights are invalid for the retrieval mode.
+            VectorServiceError: If the query could not be embedded or the index could not be queried.
+        """
+        logger.debug("Searching books: query=%s, limit=%s, weights=%s, rerank=%s", query, limit, weights, rerank)
+        if not rerank or self._reranker is None:
+            matches = await asyncio.to_thread(self._vectors.search, query, limit, weights)
+            return await self._retrieve_matches(matches, size, fields)
+
+        matches = await asyncio.to_thread(self._vectors.search, query, max(limit, self._reranker.candidates), weights)
+        # The cross-encoder reads fields that may not have been requested. They are left out of the response
+        read_fields = fields | set(CrossEncoderReranker.FIELDS) if fields is not None else None
+        books = await self._reranker.rerank(query, await self._find_matches(matches, read_fields))
+        books = books[:limit]
+        if fields is None or 'thumbnail' in fields:
+            await self.attach_thumbnail_urls(books, size)
+        return books
+
+
+    @timed(SERVICE_CALL_DURATION, 'BookService', 'similar_books')
+    async def similar_books(self, isbn_13, limit, size=None, fields=None):
+        """
+        Asynchronously finds the books most similar to a book.
+        The neighbours precomputed by the similar books job are used if there are enough of them. Otherwise the
+        book's stored vector is looked up in the vector index, so nothing is embedded either way.
+
+        Args:
+            isbn_13 (str): The ISBN-13 of the book.
+            limit (int): The maximum number of books to return.
+            size (str): The thumbnail rendition to link to. Links to the original thumbnail if not set.
+            fields (set): The fields to read, in addition to 'isbn_13' and 'updated_at'. Every field is read if not set.
+
+        Returns:
+            list: The similar books, most similar first, each with its similarity 'score'.
+
+        Raises:
+            BookNotFoundError: If the book does not exist.
+            VectorServiceError: If the index could not be queried.
+        """
+        logger.debug("Finding books similar to %s: limit=%s", isbn_13, limit)
+        precomputed = self._db.similar_books.find_one({'_id': isbn_13}, {'neighbours': {'$slice': limit}})
+        if precomputed and len(precomputed['neighbours']) >= limit:
+            matches = [(neighbour['isbn_13'], neighbour['score']) for neighbour in precomputed['neighbours']]
+        else:
+            matches = await asyncio.to_thread(self._vectors.similar, isbn_13, limit)
+
+        if matches is None:
+            if not self.book_exists(isbn_13):
+                raise BookNotFoundError(f"Book with ISBN-13 {isbn_13} not found")
+            # The book is stored, but not indexed yet
+            logger.warning("No vector stored for book %s", isbn_13)
+            matches = []
+        return await self._retrieve_matches(matches, size, fields)
+
+
+    async def _retrieve_matches(self, matches, size, fields):
+        """
+        Retrieves the books of vector matches in their ranked order, with their scores and thumbnail URLs.
+
+        Args:
+            matches (list): (isbn_13, score) tuples, best first.
+            size (str): The thumbnail rendition to link to.
+            fields (set): The fields to read.
+
+        Returns:
+            list: The books that still exist, each with its 'score'.
+        """
+        books = await self._find_matches(matches, fields)
+
+        # Fetch presigned URLs for book covers
+        if fields is None or 'thumbnail' in fields:
+            await self.attach_thumbnail_urls(books, size)
+        return books
+
+
+    async def _find_matches(self, matches, fields):
+        """
+        Reads the books of vector matches in their ranked order, with their scores.
+        """
+        # Fetch the matched books in one query and restore the ranking
+        isbns = [isbn_13 for isbn_13, _ in matches]
+        books_by_isbn = {
+            book['isbn_13']: book
+            for book in self._db.books.find({'isbn_13': {'$in': isbns}}, self._projection(fields))
+        }
+        return [
+            {**books_by_isbn[isbn_13], 'score': score}
+            for isbn_13, score in matches if isbn_13 in books_by_isbn
+        ]
+
+
+    @timed(SERVICE_CALL_DURATION, 'BookService', 'store_book')
     async def store_book(self, book):
         """
-        Asynchronously stores a book in the database.
+        Asynchronously stores a new book.
+        The MongoDB insert runs first and claims the ISBN-13, as the thumbnail and the vector are keyed by it: a
+        request that loses a race for the same ISBN-13 must not overwrite, or roll back, the winner's. The thumbnail
+        upload and the embedding upsert then run concurrently. If either fails, the book and the stage that
+        succeeded are rolled back. A book without a thumbnail URL is stored with a None thumbnail key.
 
         Args:
-            book (dict): The book data to store.
+            book (dict): The validated book data. 'thumbnail' is the URL of the source image, if any.
+
+        Returns:
+            dict: The stored book data.
 
         Raises:
             BookExistsError: If the book already exists in the database.
+            ThumbnailUploadError: If the thumbnail could not be uploaded.
+            VectorServiceError: If the book could not be embedded or upserted.
+            BookServiceError: If the book could not be inserted.
         """
         # Check to see if the book already exists
         if self.book_exists(book['isbn_13']):
             raise BookExistsError(f"Book with ISBN-13 {book['isbn_13']} already exists")
 
+        thumbnail_url = book.get('thumbnail')
+        book = {
+            **book,
+            'thumbnail': generate_s3_key(book, self._thumbnail_prefix) if thumbnail_url else None,
+            'updated_at': datetime.now(timezone.utc)
+        }
+
+        # Claim the ISBN-13. Nothing has been written yet if this fails, so there is nothing to roll back
+        book_id = await self._insert_book(book)
+
+        # Fan out the independent stages
+        stages = {}
+        if thumbnail_url:
+            stages['thumbnail'] = self._s3.upload_thumbnail(thumbnail_url, book['thumbnail'])
+        if self._index_on_write:
+            stages['vector'] = asyncio.to_thread(self._vectors.upsert_books, [book])
+
+        logger.debug("Storing book %s with stages: %s", book['isbn_13'], list(stages))
+        results = await asyncio.gather(*stages.values(), return_exceptions=True)
+        results = dict(zip(stages, results))
+        failures = {stage: result for stage, result in results.items() if isinstance(result, Exception)}
+
+        if failures:
+            succeeded = ['mongodb'] + [stage for stage in stages if stage not in failures]
+            logger.error("Failed to store book %s in %s. Rolling back %s", book['isbn_13'], list(failures), succeeded)
+            await self._rollback(book, succeeded, book_id=book_id)
+            raise next(iter(failures.values()))
+
+        self._invalidate_payloads([book['isbn_13']])
+        self._update_suggestions([book])
+        return book
+
+
+    @timed(SERVICE_CALL_DURATION, 'BookService', 'batch_upsert_books')
+    async def batch_upsert_books(self, books, thumbnail_concurrency=32):
+        """
+        Asynchronously inserts or replaces many books at once.
+        The books are written with one unordered bulk upsert, their thumbnails are transferred over shared
+        clients, and the books that are new or whose weighted fields changed are embedded in a single model
+        call. The three stages run concurrently. A book only keeps a thumbnail key if its upload succeeded; when
+        it fails, the book keeps its previous thumbnail key, or None if it had none, as S3 still holds that object.
+
+        Args:
+            books (list): The validated book data. 'thumbnail' is the URL of the source image, if any.
+            thumbnail_concurrency (int): The maximum number of thumbnails transferred at once.
+
+        Returns:
+            list: A status dict per book, in input order, with the ISBN-13, 'status' ('created', 'updated'
+                or 'failed'), 'indexed' and, if something went wrong, 'error'.
+        """
+        now = datetime.now(timezone.utc)
+        statuses = [{'isbn_13': book['isbn_13'], 'status': None, 'indexed': False} for book in books]
+
+        # Later occurrences of an ISBN-13 in the batch win
+        latest = {book['isbn_13']: index for index, book in enumerate(books)}
+        docs, indexes, thumbnails = [], [], []
+        for index, book in enumerate(books):
+            if latest[book['isbn_13']] != index:
+                statuses[index].update(status='failed', error='Superseded by a later book with the same ISBN-13 in the batch')
+                continue
+            s3_key = generate_s3_key(book, self._thumbnail_prefix) if book.get('thumbnail') else None
+            doc = {**book, 'thumbnail': s3_key, 'updated_at': now}
+            docs.append(doc)
+            indexes.append(index)
+            if s3_key:
+                thumbnails.append((book['thumbnail'], s3_key))
+
+        # Only embed the books whose vector would change
+        existing = {
+            book['isbn_13']: book
+            for book in self._db.books.find({'isbn_13': {'$in': list(latest)}})
+        }
+        embed_positions = [
+            position for position, doc in enumerate(docs)
+            if doc['isbn_13'] not in existing or self._vectors.needs_reindex(existing[doc['isbn_13']], doc)
+        ]
+        logger.debug("Batch upserting %s books: %s to embed, %s thumbnails", len(docs), len(embed_positions), len(thumbnails))
+
+        stages = {'mongodb': asyncio.to_thread(self._bulk_upsert, docs)}
+        if thumbnails:
+            stages['thumbnail'] = self._s3.upload_thumbnails(thumbnails, concurrency=thumbnail_concurrency)
+        if self._index_on_write and embed_positions:
+            stages['vector'] = asyncio.to_thread(self._vectors.upsert_books, [docs[position] for position in embed_positions])
+        results = dict(zip(stages, await asyncio.gather(*stages.values(), return_exceptions=True)))
+        self._invalidate_payloads(latest)
+
+        # MongoDB decides whether each book was stored
+        write_errors = results['mongodb']
+        if isinstance(write_errors, Exception):
+            write_errors = {position: str(write_errors) for position in range(len(docs))}
+        for position, (doc, index) in enumerate(zip(docs, indexes)):
+            if position in write_errors:
+                statuses[index].update(status='failed', error=write_errors[position])
+            else:
+                statuses[index]['status'] = 'updated' if doc['isbn_13'] in existing else 'created'
+        self._update_suggestions([doc for position, doc in enumerate(docs) if position not in write_errors])
+
+        # Thumbnail failures are reported, but the book metadata stays stored
+        thumbnail_errors = results.get('thumbnail', [])
+        if isinstance(thumbnail_errors, Exception):
+            thumbnail_errors = [thumbnail_errors] * len(thumbnails)
+        thumbnail_failures = {
+            s3_key: error for (_, s3_key), error in zip(thumbnails, thumbnail_errors) if error
+        }
+        await self._revert_thumbnail_keys(
+            [doc for position, doc in enumerate(docs) if position not in write_errors and doc['thumbnail'] in thumbnail_failures],
+            existing, now
+        )
+
+        vector_error = results.get('vector')
+        embedded = set(embed_positions)
+        for position, (doc, index) in enumerate(zip(docs, indexes)):
+            status = statuses[index]
+            if status['status'] == 'failed':
+                continue
+            if doc['thumbnail'] in thumbnail_failures:
+                status['error'] = str(thumbnail_failures[doc['thumbnail']])
+            if position not in embedded:
+                status['indexed'] = True
+            elif isinstance(vector_error, Exception):
+                status['error'] = f"Stored, but the vector index was not updated: {vector_error}"
+            else:
+                status['indexed'] = self._index_on_write
+
+        # Vectors of books that could not be stored must not be searchable
+        failed_vectors = [
+            docs[position]['isbn_13'] for position in embed_positions
+            if statuses[indexes[position]]['status'] == 'failed' and docs[position]['isbn_13'] not in existing
+        ]
+        if failed_vectors and 'vector' in stages and not isinstance(vector_error, Exception):
+            await self._rollback_vectors(failed_vectors)
+
+        return statuses
+
+
+    @timed(SERVICE_CALL_DURATION, 'BookService', 'delete_book')
+    async def delete_book(self, isbn_13):
+        """
+        Asynchronously deletes a book along with its thumbnail and vector.
+
+        Args:
+            isbn_13 (str): The ISBN-13 of the book to delete.
+
+        Raises:
+            BookNotFoundError: If the book does not exist.
+        """
+        logger.debug("Deleting book with ISBN-13: %s", isbn_13)
+        book = self._db.books.find_one_and_delete({'isbn_13': isbn_13})
+        if not book:
+            raise BookNotFoundError(f"Book with ISBN-13 {isbn_13} not found")
+        self._invalidate_payloads([isbn_13])
+        if self._suggestions is not None:
+            self._suggestions.remove([isbn_13])
+        self._db.similar_books.delete_one({'_id': isbn_13})
+
+        # The book is gone from the catalogue, so failing to clean up the other stores is only logged
+        await self._rollback(book, ['thumbnail', 'vector'] if book.get('thumbnail') else ['vector'])
+
+
+    async def _insert_book(self, book):
+        """
+        Inserts a book into the database without blocking the event loop.
+
+        Returns:
+            ObjectId: The _id of the inserted document.
+
+        Raises:
+            BookExistsError: If a book with the same ISBN-13 was inserted concurrently.
+            BookServiceError: If the insert failed.
+        """
+        try:
+            # Insert a copy, as insert_one adds an _id to the document
+            result = await asyncio.to_thread(self._db.books.insert_one, dict(book))
+        except DuplicateKeyError as e:
+            raise BookExistsError(f"Book with ISBN-13 {book['isbn_13']} already exists") from e
+        except PyMongoError as e:
+            raise BookServiceError(f"Failed to insert book {book['isbn_13']}: {e}") from e
+        return result.inserted_id
+
+
+    def _invalidate_payloads(self, isbns):
+        """
+        Drops the cached serialized JSON of books that were written or deleted.
+        """
+        if self._payloads is not None:
+            self._payloads.invalidate(isbns)
+
+
+    def _update_suggestions(self, books):
+        """
+        Adds books that were written to the suggest index.
+        """
+        if self._suggestions is not None and books:
+            self._suggestions.update(books)
+
+
+    @staticmethod
+    def _projection(fields):
+        """
+        Returns the MongoDB projection of the requested fields, or None for every field.
+        'isbn_13' and 'updated_at' are always read, as responses are cached and versioned by them.
+        """
+        if fields is None:
+            return None
+        projection = {field: 1 for field in set(fields) | {'isbn_13', 'updated_at'}}
+        if '_id' not in fields:
+            projection['_id'] = 0
+        return projection
+
+
+    @staticmethod
+    def _thumbnail_key(book, size):
+        """
+        Returns the S3 key of a book's thumbnail rendition, or of the original thumbnail if size is not set.
+        """
+        return generate_rendition_key(book["thumbnail"], size) if size else book["thumbnail"]
+
+
+    def _bulk_upsert(self, docs):
+        """
+        Upserts books by ISBN-13 with a single unordered bulk write.
+
+        Returns:
+            dict: The error message of each document that could not be written, keyed by its position.
+        """
+        if not docs:
+            return {}
+        try:
+            self._db.books.bulk_write(
+                [ReplaceOne({'isbn_13': doc['isbn_13']}, doc, upsert=True) for doc in docs],
+                ordered=False
+            )
+        except BulkWriteError as e:
+            return {error['index']: error['errmsg'] for error in e.details['writeErrors']}
+        return {}
+
+
+    async def _revert_thumbnail_keys(self, docs, existing, updated_at):
+        """
+        Restores the previous thumbnail key of stored books whose thumbnail upload failed, so readers are not given
+        URLs to objects that do not exist. Books written again since updated_at are left alone.
+        """
+        if not docs:
+            return
+        reverts = [
+            UpdateOne(
+                {'isbn_13': doc['isbn_13'], 'updated_at': updated_at},
+                {'$set': {'thumbnail': existing.get(doc['isbn_13'], {}).get('thumbnail')}}
+            )
+            for doc in docs
+        ]
+        try:
+            await asyncio.to_thread(self._db.books.bulk_write, reverts, ordered=False)
+        except PyMongoError as e:
+            logger.error("Failed to revert the thumbnail keys of %s books: %s", len(docs), e)
+
+
+    async def _rollback_vectors(self, isbns):
+        """
+        Deletes vectors that were upserted for books that could not be stored.
+        """
+        try:
+            await asyncio.to_thread(self._vectors.delete_books, isbns)
+        except Exception as e:
+            logger.error("Failed to clean up %s vectors: %s", len(isbns), e)
+
+
+    async def _rollback(self, book, stages, book_id=None):
+        """
+        Undoes the given write stages for a book. Failures are logged, as there is nothing left to compensate with.
+
+        Args:
+            book (dict): The book data.
+            stages (list): The stages to undo ('mongodb', 'thumbnail' and/or 'vector').
+            book_id (ObjectId): The _id of the inserted document. Only that document is deleted if set.
+        """
+        book_filter = {'isbn_13': book['isbn_13']} if book_id is None else {'_id': book_id}
+        undo = {
+            'mongodb': lambda: asyncio.to_thread(self._db.books.delete_one, book_filter),
+            'thumbnail': lambda: self._s3.delete_thumbnail(book['thumbnail']),
+            'vector': lambda: asyncio.to_thread(self._vectors.delete_books, [book['isbn_13']])
+        }
+        results = await asyncio.gather(*(undo[stage]() for stage in stages), return_exceptions=True)
+        for stage, result in zip(stages, results):
+            if isinstance(result, Exception):
+                logger.error("Failed to clean up %s for book %s: %s", stage, book['isbn_13'], result)
+
+
+    @timed(SERVICE_CALL_DURATION, 'BookService', 'update_book')
+    async def update_book(self, isbn_13, data):
+        """
+        Asynchronously applies a partial update to a book.
+        The book's vector is only re-embedded and upserted when one of the weighted fields changed. MongoDB is
+        updated first, so if the vector cannot be refreshed the update is kept, the stale vector is left in the
+        index, and a repair is queued for the indexer to re-embed the book.
+
+        Args:
+            isbn_13 (str): The ISBN-13 of the book to update.
+            data (dict): The fields to update.
+
+        Returns:
+            dict: The updated book data.
+
+        Raises:
+            BookNotFoundError: If the book does not exist.
+            VectorServiceError: If the book's vector could not be refreshed. The update is stored.
+        """
+        logger.debug("Updating book with ISBN-13: %s", isbn_13)
+        data = {key: value for key, value in data.items() if key != 'isbn_13'}
+        data['updated_at'] = datetime.now(timezone.utc)
+
+        # Apply the update and get the previous version of the book in a single round trip
+        old_book = self._db.books.find_one_and_update(
+            {'isbn_13': isbn_13},
+            {'$set': data},
+            return_document=ReturnDocument.BEFORE
+        )
+        if not old_book:
+            raise BookNotFoundError(f"Book with ISBN-13 {isbn_13} not found")
+        self._invalidate_payloads([isbn_13])
+        book = {**old_book, **data}
+        self._update_suggestions([book])
+
+        # Only refresh the vector if the embedding would actually change
+        changed_fields = self._vectors.needs_reindex(old_book, book)
+        if changed_fields and not self._index_on_write:
+            logger.debug("Weighted fields changed for %s: %s. Leaving vector to the indexer", isbn_13, changed_fields)
+        elif changed_fields:
+            logger.debug("Weighted fields changed for %s: %s. Refreshing vector", isbn_13, changed_fields)
+            try:
+                await asyncio.to_thread(self._vectors.upsert_books, [book])
+            except VectorServiceError as e:
+                logger.error("Failed to refresh the vector of %s, queueing a repair: %s", isbn_13, e)
+                try:
+                    BookIndexer.enqueue_repairs(self._db, [('upsert', isbn_13, 'vector_refresh_failed')])
+                except PyMongoError as queue_error:
+                    logger.error("Failed to queue a vector repair for %s: %s", isbn_13, queue_error)
+                raise
+        else:
+            logger.debug("No weighted fields changed for %s. Keeping vector", isbn_13)
+
+        return book
+
 
     def book_exists(self, isbn_13):
         """
@@ -93,5 +635,5 @@ class BookService:
         Returns:
             bool: True if the book exists, False otherwise.
         """
-        existing_book = self.db.books.find_one({'isbn_13': isbn_13})
+        existing_book = self._db.books.find_one({'isbn_13': isbn_13}, {'_id': 1})
         return True if existing_book else False
\ No newline at end of file
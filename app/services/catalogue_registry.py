@@ -0,0 +1,135 @@
+import threading
+from .book_service import BookService
+from .payload_cache import BookPayloadCache
+from .suggest_index import SuggestIndex
+from .vector_service import create_vector_index
+from .. import create_indexes
+from ..catalogues import catalogue_config, catalogue_ids
+from utils.logger import logger
+
+
+class Catalogue:
+    """
+    The services of one catalogue.
+    """
+
+    def __init__(self, config, db, book_service, vector_service, payload_cache, suggest_index):
+        """
+        Args:
+            config (dict): The config of the catalogue, from catalogue_config.
+            db: The catalogue's MongoDB database.
+            book_service (BookService): The catalogue's BookService.
+            vector_service (VectorService): The VectorService of the catalogue's index.
+            payload_cache (BookPayloadCache): The cache of the catalogue's serialized books.
+            suggest_index (SuggestIndex): The prefix index of the catalogue's books.
+        """
+        self.id = config['CATALOGUE']
+        self.config = config
+        self.enums = config['CATALOGUE_ENUMS']
+        self.db = db
+        self.book_service = book_service
+        self.vector_service = vector_service
+        self.payload_cache = payload_cache
+        self.suggest_index = suggest_index
+
+
+class CatalogueRegistry:
+    """
+    CatalogueRegistry creates the services of each catalogue the first time it is requested.
+
+    Catalogues share everything that is expensive to hold: the MongoDB client and its connection pool, the S3
+    session and image process pool, the Pinecone index connection, the embedding model and the re-ranker. Each
+    catalogue only has its own database, vector namespace (or local index file), bucket if configured, payload
+    cache and suggest index, so an unused catalogue costs nothing.
+    """
+
+    def __init__(self, config, mongo_client, s3_service, vector_service, json_provider, reranker=None):
+        """
+        Args:
+            config (dict): The app config.
+            mongo_client (MongoClient): The shared MongoDB client.
+            s3_service (S3Service): The S3Service of the default catalogue's bucket.
+            vector_service (VectorService): The VectorService of the default catalogue's index.
+            json_provider (JSONProvider): The app's JSON provider, used by the payload caches.
+            reranker (RerankService): The shared re-ranker, if any.
+        """
+        self._config = config
+        self._mongo_client = mongo_client
+        self._s3 = s3_service
+        self._vectors = vector_service
+        self._json_provider = json_provider
+        self._reranker = reranker
+        self._catalogues = {}
+        self._lock = threading.Lock()
+
+
+    def ids(self):
+        """
+        Returns the ids of every configured catalogue, the default catalogue first.
+        """
+        return catalogue_ids(self._config)
+
+
+    def get(self, catalogue_id=None):
+        """
+        Returns the services of a catalogue, creating them on first use.
+
+        Args:
+            catalogue_id (str): The catalogue. Defaults to DEFAULT_CATALOGUE.
+
+        Returns:
+            Catalogue: The catalogue's services.
+
+        Raises:
+            CatalogueNotFoundError: If the catalogue is not configured.
+        """
+        catalogue_id = catalogue_id or self._config['DEFAULT_CATALOGUE']
+        catalogue = self._catalogues.get(catalogue_id)
+        if catalogue is not None:
+            return catalogue
+
+        config = catalogue_config(self._config, catalogue_id)
+        with self._lock:
+            if catalogue_id not in self._catalogues:
+                self._catalogues[catalogue_id] = self._create(config)
+            return self._catalogues[catalogue_id]
+
+
+    def _create(self, config):
+        """
+        Creates the services of a catalogue on the shared clients and models.
+        """
+        logger.info("Initializing catalogue %s", config['CATALOGUE'])
+        db = self._mongo_client[config['MONGO_DB']]
+        create_indexes(db)
+
+        if config['CATALOGUE'] == self._config['DEFAULT_CATALOGUE']:
+            vector_service = self._vectors
+        else:
+            # Pinecone namespaces share the default catalogue's index connection
+            vector_service = self._vectors.for_index(create_vector_index(config, shared_index=self._vectors.index))
+
+        payload_cache = BookPayloadCache(
+            self._json_provider,
+            max_size=config['BOOK_PAYLOAD_CACHE_SIZE'],
+            compression_level=config['COMPRESSION_LEVEL']
+        )
+        suggest_index = SuggestIndex(
+            cache_size=config['SUGGEST_CACHE_SIZE'],
+            min_prefix_length=config['SUGGEST_MIN_PREFIX_LENGTH']
+        )
+        suggest_index.build(db.books.find({}, dict.fromkeys(SuggestIndex.FIELDS, 1)))
+        # Picks up the writes of other processes and scripts, which the write hooks of this process do not see
+        if config['SUGGEST_REFRESH_SECONDS'] > 0:
+            suggest_index.start_refreshing(db.books, config['SUGGEST_REFRESH_SECONDS'])
+        book_service = BookService(
+            db,
+            self._s3.for_bucket(config['AWS_BUCKET_NAME']),
+            vector_service,
+            index_on_write=config['INDEX_ON_WRITE'],
+            payload_cache=payload_cache,
+            suggest_index=suggest_index,
+            reranker=self._reranker,
+            thumbnail_prefix=config['THUMBNAIL_PREFIX']
+        )
+        return Catalogue(config, db, book_service, vector_service, payload_cache, suggest_index)
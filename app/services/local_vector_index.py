@@ -0,0 +1,296 @@
+import os
+import threading
+from contextlib import contextmanager
+import numpy as np
+from filelock import FileLock
+from utils.logger import logger
+
+class LocalVectorIndex:
+    """
+    An in-process vector index that mirrors the subset of the Pinecone Index API used by the app.
+    Vectors are kept L2-normalized in a contiguous float32 matrix, so a query is a single matrix-vector product.
+    Used for local development, tests and benchmarks where Pinecone is not available.
+
+    Several processes (e.g. the API and the indexer) can write to the same file. Each write holds a lock file next
+    to it, reloads the file if another process changed it, and replaces it atomically, so no write is lost. Every
+    write rewrites the whole file, so writes are O(N): batch them, and use Pinecone for large catalogues.
+    """
+
+    def __init__(self, path=None, dimension=None):
+        """
+        Creates a LocalVectorIndex, loading the vectors stored at path if it exists.
+
+        Args:
+            path (str): The .npz file the index is persisted to. The index is memory-only if not set.
+            dimension (int): The vector dimension. Inferred from the first upsert if not set.
+        """
+        self._path = path
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(f"{path}.lock") if path else None
+        self._ids = []
+        self._positions = {}
+        self._vectors = np.zeros((0, dimension or 0), dtype=np.float32)
+        self._size = 0
+        self._version = None
+        self._maybe_reload()
+
+
+    def upsert(self, vectors):
+        """
+        Inserts or replaces vectors.
+
+        Args:
+            vectors (list): A list of (id, values) tuples.
+
+        Returns:
+            dict: The number of upserted vectors.
+        """
+        if not vectors:
+            return {'upserted_count': 0}
+
+        ids = [id for id, _ in vectors]
+        values = self._normalize(np.asarray([values for _, values in vectors], dtype=np.float32))
+
+        with self._writing():
+            self._reserve(self._size + len(ids), values.shape[1])
+            for id, value in zip(ids, values):
+                position = self._positions.get(id)
+                if position is None:
+                    position = self._size
+                    self._positions[id] = position
+                    self._ids.append(id)
+                    self._size += 1
+                self._vectors[position] = value
+            self._save()
+
+        return {'upserted_count': len(ids)}
+
+
+    def delete(self, ids=None, delete_all=False):
+        """
+        Deletes vectors by id, or all vectors.
+
+        Args:
+            ids (list): The ids of the vectors to delete.
+            delete_all (bool): Flag to delete every vector in the index.
+        """
+        with self._writing():
+            if delete_all:
+                self._ids, self._positions, self._size = [], {}, 0
+            else:
+                for id in ids or []:
+                    position = self._positions.pop(id, None)
+                    if position is None:
+                        continue
+                    # Move the last vector into the freed slot to keep the matrix contiguous
+                    last = self._size - 1
+                    if position != last:
+                        last_id = self._ids[last]
+                        self._vectors[position] = self._vectors[last]
+                        self._ids[position] = last_id
+                        self._positions[last_id] = position
+                    self._ids.pop()
+                    self._size -= 1
+            self._save()
+        return {}
+
+
+    def fetch(self, ids):
+        """
+        Fetches stored vectors by id.
+
+        Args:
+            ids (list): The ids of the vectors to fetch.
+
+        Returns:
+            dict: The found vectors, keyed by id.
+        """
+        with self._lock:
+            self._maybe_reload()
+            vectors = {
+                id: {'id': id, 'values': self._vectors[self._positions[id]].tolist()}
+                for id in ids if id in self._positions
+            }
+        return {'vectors': vectors}
+
+
+    def query(self, vector, top_k=10, include_values=False, **kwargs):
+        """
+        Finds the vectors with the highest cosine similarity to a query vector.
+
+        Args:
+            vector (list): The query vector.
+            top_k (int): The number of matches to return.
+            include_values (bool): Flag to include the vector values in the matches.
+
+        Returns:
+            dict: The matches, ordered by descending score.
+        """
+        query = self._normalize(np.asarray([vector], dtype=np.float32))[0]
+
+        with self._lock:
+            self._maybe_reload()
+            if self._size == 0:
+                return {'matches': []}
+            vectors = self._vectors[:self._size]
+            scores = vectors @ query
+
+            # Partial sort: only the top k scores need ordering
+            k = min(top_k, self._size)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+
+            matches = []
+            for position in top:
+                match = {'id': self._ids[position], 'score': float(scores[position])}
+                if include_values:
+                    match['values'] = vectors[position].tolist()
+                matches.append(match)
+
+        return {'matches': matches}
+
+
+    def snapshot(self):
+        """
+        Returns a copy of every stored vector, for batch jobs that scan the whole index.
+
+        Returns:
+            tuple: The ids, and the normalized vectors in the same order as a (count, dimension) float32 matrix.
+        """
+        with self._lock:
+            self._maybe_reload()
+            return list(self._ids), self._vectors[:self._size].copy()
+
+
+    def restore(self, ids, vectors):
+        """
+        Replaces every stored vector at once, e.g. from a snapshot, with a single write to disk.
+
+        Args:
+            ids (list): The ids, in the order of the rows of vectors.
+            vectors (np.ndarray): A (count, dimension) matrix.
+        """
+        if len(ids) != len(vectors):
+            raise ValueError(f"Got {len(ids)} ids for {len(vectors)} vectors")
+        if len(set(ids)) != len(ids):
+            raise ValueError("Vector ids must be unique")
+
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(ids):
+            vectors = np.zeros((0, self._vectors.shape[1]), dtype=np.float32)
+        vectors = np.ascontiguousarray(self._normalize(vectors), dtype=np.float32)
+        with self._writing():
+            self._ids = list(ids)
+            self._positions = {id: position for position, id in enumerate(self._ids)}
+            self._vectors = vectors
+            self._size = len(self._ids)
+            self._save()
+
+
+    def list(self, prefix='', limit=100):
+        """
+        Yields the stored ids in sorted order, a page at a time, like Pinecone's Index.list.
+
+        Args:
+            prefix (str): Only list the ids starting with this prefix.
+            limit (int): The number of ids per page.
+
+        Yields:
+            list: A page of ids.
+        """
+        with self._lock:
+            self._maybe_reload()
+            ids = sorted(id for id in self._ids if id.startswith(prefix))
+        for start in range(0, len(ids), limit):
+            yield ids[start:start + limit]
+
+
+    def describe_index_stats(self):
+        """
+        Returns the number of vectors and their dimension.
+        """
+        with self._lock:
+            self._maybe_reload()
+            return {'dimension': self._vectors.shape[1], 'total_vector_count': self._size}
+
+
+    @staticmethod
+    def _normalize(vectors):
+        """
+        L2-normalizes the rows of a matrix, leaving zero rows untouched.
+        """
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+
+    def _reserve(self, size, dimension):
+        """
+        Grows the vector matrix geometrically so upserts are amortized O(1).
+        """
+        if self._vectors.shape[1] != dimension:
+            if self._size:
+                raise ValueError(f"Vector dimension {dimension} does not match index dimension {self._vectors.shape[1]}")
+            self._vectors = np.zeros((0, dimension), dtype=np.float32)
+
+        capacity = self._vectors.shape[0]
+        if size > capacity:
+            grown = np.zeros((max(size, capacity * 2, 1024), dimension), dtype=np.float32)
+            grown[:self._size] = self._vectors[:self._size]
+            self._vectors = grown
+
+
+    @contextmanager
+    def _writing(self):
+        """
+        Holds the thread lock and, if the index is persisted, the file lock, with the latest version loaded.
+        """
+        with self._lock:
+            if self._file_lock is None:
+                yield
+                return
+            with self._file_lock:
+                self._maybe_reload()
+                yield
+
+
+    def _save(self):
+        """
+        Atomically persists the index to disk if a path is configured. Must be called while _writing.
+        """
+        if not self._path:
+            return
+
+        tmp_path = f"{self._path}.tmp.npz"
+        np.savez(tmp_path, ids=np.array(self._ids, dtype=str), vectors=self._vectors[:self._size])
+        os.replace(tmp_path, self._path)
+        self._version = self._file_version()
+
+
+    def _file_version(self):
+        """
+        Identifies the saved file. Every save creates a new inode, so saves within one mtime tick still differ.
+        """
+        stat = os.stat(self._path)
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+    def _maybe_reload(self):
+        """
+        Reloads the index if another process (e.g. the indexer) saved a newer version to disk.
+        """
+        if not self._path or not os.path.exists(self._path):
+            return
+
+        version = self._file_version()
+        if version == self._version:
+            return
+
+        with self._lock:
+            logger.debug("Loading local vector index from %s", self._path)
+            with np.load(self._path) as data:
+                self._ids = data['ids'].tolist()
+                self._vectors = data['vectors'].astype(np.float32)
+            self._positions = {id: position for position, id in enumerate(self._ids)}
+            self._size = len(self._ids)
+            self._version = version
@@ -0,0 +1,184 @@
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from utils.logger import logger
+from utils.metrics import CACHE_REQUESTS
+
+# A gzip member header: magic, deflate, no flags, no mtime, no extra flags, unknown OS
+GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+# An empty final deflate block with fixed Huffman codes, which terminates the concatenated blocks
+DEFLATE_FINAL_BLOCK = b'\x03\x00'
+
+class BookPayloadCache:
+    """
+    A cache of the serialized JSON of each book, so list responses are assembled by concatenating bytes
+    instead of serializing every document on every request.
+
+    A cached fragment is the book's JSON object without its closing brace and without the fields that change
+    per request (the presigned thumbnail URL and the search score), which are appended when a response is built.
+    Fragments are keyed by ISBN-13 and the requested field set, and validated against the book's 'updated_at',
+    so a book changed by another process is re-serialized. The BookService also invalidates the books it writes.
+
+    Fragments also keep their raw deflate encoding, compressed once and ending on a byte boundary without
+    back-references into earlier data. A gzip response is the concatenation of these blocks with the
+    per-request parts in stored (uncompressed) deflate blocks in between, so building it costs little more
+    than building the uncompressed body. As every fragment is compressed on its own, the ratio is lower than
+    compressing the whole body, which would cost as much CPU per request as the rest of a listing.
+    """
+    # Fields that differ between requests for the same stored book
+    TRANSIENT_FIELDS = ('thumbnail', 'score')
+
+    def __init__(self, json_provider, max_size=10000, compression_level=9):
+        """
+        Args:
+            json_provider (JSONProvider): The app's JSON provider. Must have a dumpb method.
+            max_size (int): The maximum number of cached books. Caching is disabled if 0.
+            compression_level (int): The zlib level of the cached fragments. Paid once per fragment.
+        """
+        logger.info("Initializing BookPayloadCache")
+        self._dumpb = json_provider.dumpb
+        self._max_size = max_size
+        self._compression_level = compression_level
+        # ISBN-13 -> {field set: [version, fragment, deflated fragment]}, least recently used first
+        self._fragments = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = CACHE_REQUESTS.labels('book_payload', 'hit')
+        self._misses = CACHE_REQUESTS.labels('book_payload', 'miss')
+
+
+    def render(self, books, fields=None, compress_min_size=None):
+        """
+        Serializes a book or a list of books, compressing the result with gzip if it is large enough.
+
+        Args:
+            books (dict or list): A book, or a list of books, including their transient fields.
+            fields (set): The fields to include. Every field is included if not set.
+            compress_min_size (int): The minimum uncompressed size to compress at. Never compresses if None.
+
+        Returns:
+            tuple: The body, and whether it is gzip compressed.
+        """
+        variant = tuple(sorted(fields)) if fields is not None else None
+        if isinstance(books, list):
+            pieces = [(b'[', None)]
+            for index, book in enumerate(books):
+                if index:
+                    pieces.append((b',', None))
+                self._append_book(pieces, book, fields, variant)
+            pieces.append((b']', None))
+        else:
+            pieces = []
+            self._append_book(pieces, books, fields, variant)
+
+        # Merge adjacent per-request parts, so each becomes one stored block when compressed
+        merged = []
+        for data, entry in pieces:
+            if entry is None and merged and merged[-1][1] is None:
+                merged[-1] = (merged[-1][0] + data, None)
+            else:
+                merged.append((data, entry))
+
+        body = b''.join(data for data, _ in merged)
+        if compress_min_size is None or len(body) < compress_min_size:
+            return body, False
+        # Small fragments (e.g. a few sparse fields) can grow when compressed on their own
+        compressed = self._gzip(merged, len(body))
+        return (compressed, True) if len(compressed) < len(body) else (body, False)
+
+
+    def invalidate(self, isbns):
+        """
+        Drops the cached fragments of books that were written or deleted.
+
+        Args:
+            isbns (list): The ISBN-13s of the books.
+        """
+        with self._lock:
+            for isbn_13 in isbns:
+                self._fragments.pop(isbn_13, None)
+
+
+    def clear(self):
+        with self._lock:
+            self._fragments.clear()
+
+
+    def _append_book(self, pieces, book, fields, variant):
+        """
+        Appends the cached fragment of a book and its per-request tail to a list of (data, cache entry) pieces.
+        """
+        entry = self._entry(book, fields, variant)
+        pieces.append((entry[1], entry))
+        tail = []
+        for field in self.TRANSIENT_FIELDS:
+            if field in book and (fields is None or field in fields):
+                separator = b',' if tail or entry[1] != b'{' else b''
+                tail.append(separator + self._dumpb(field) + b':' + self._dumpb(book[field]))
+        tail.append(b'}')
+        pieces.append((b''.join(tail), None))
+
+
+    def _entry(self, book, fields, variant):
+        """
+        Returns the cache entry of a book, serializing the book if it is missing or stale.
+        """
+        isbn_13, version = book.get('isbn_13'), book.get('updated_at')
+        cacheable = self._max_size and isbn_13 is not None
+        if cacheable:
+            with self._lock:
+                entry = self._fragments.get(isbn_13, {}).get(variant)
+                if entry is not None and entry[0] == version:
+                    self._fragments.move_to_end(isbn_13)
+                    self._hits.inc()
+                    return entry
+            self._misses.inc()
+
+        stored = {
+            key: value for key, value in book.items()
+            if key not in self.TRANSIENT_FIELDS and (fields is None or key in fields)
+        }
+        # Drop the closing brace, so the transient fields can be appended
+        entry = [version, self._dumpb(stored)[:-1], None]
+
+        if cacheable:
+            with self._lock:
+                self._fragments.setdefault(isbn_13, {})[variant] = entry
+                self._fragments.move_to_end(isbn_13)
+                while len(self._fragments) > self._max_size:
+                    self._fragments.popitem(last=False)
+        return entry
+
+
+    def _gzip(self, pieces, size):
+        """
+        Assembles a gzip member from pieces, reusing the deflated fragment of every cached piece.
+        """
+        blocks = [GZIP_HEADER]
+        crc = 0
+        for data, entry in pieces:
+            crc = zlib.crc32(data, crc)
+            if entry is None:
+                blocks.append(_stored_blocks(data))
+                continue
+            if entry[2] is None:
+                # A full flush ends the fragment on a byte boundary and resets the history,
+                # so the fragment can be placed after any other data
+                fragment_compressor = zlib.compressobj(self._compression_level, zlib.DEFLATED, -zlib.MAX_WBITS)
+                entry[2] = fragment_compressor.compress(data) + fragment_compressor.flush(zlib.Z_FULL_FLUSH)
+            blocks.append(entry[2])
+        blocks.append(DEFLATE_FINAL_BLOCK)
+        blocks.append(struct.pack('<II', crc, size & 0xffffffff))
+        return b''.join(blocks)
+
+
+def _stored_blocks(data):
+    """
+    Returns data as non-final stored deflate blocks, which start and end on a byte boundary.
+    """
+    blocks = []
+    for start in range(0, len(data), 0xffff):
+        chunk = data[start:start + 0xffff]
+        # BFINAL=0 and BTYPE=00 padded to a byte, then LEN and its one's complement NLEN
+        blocks.append(struct.pack('<BHH', 0, len(chunk), len(chunk) ^ 0xffff) + chunk)
+    return b''.join(blocks)
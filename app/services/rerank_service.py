@@ -0,0 +1,149 @@
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from ..models.cross_encoder_reranker import CrossEncoderReranker
+from utils.logger import logger
+from utils.metrics import CACHE_REQUESTS, RERANK_REQUESTS
+
+
+class RerankService:
+    """
+    RerankService re-orders the top candidates of a vector search with a cross-encoder, within a time budget.
+    The cross-encoder is only loaded the first time a search is re-ranked.
+
+    Model passes run one at a time on a dedicated thread, as a single pass already uses every core. If a pass
+    does not finish within the budget, the first-stage order is returned and the pass completes in the background,
+    so its scores are cached for the next identical search. When more passes are waiting than max_pending,
+    searches skip re-ranking instead of queueing behind them.
+
+    Scores are cached per query and candidate set. A candidate's 'updated_at' is part of the key, so editing a
+    book invalidates the searches it appears in.
+    """
+
+    def __init__(self, model=None, model_name=None, max_length=256, candidates=50, budget_seconds=0.15,
+                 cache_size=1024, max_pending=2):
+        """
+        Args:
+            model (CrossEncoderReranker): A model to use instead of lazily loading model_name.
+            model_name (str): The name of the HF cross-encoder.
+            max_length (int): The number of tokens a query and book pair is truncated to.
+            candidates (int): The number of first-stage results to re-rank.
+            budget_seconds (float): How long a search waits for the re-ranker before using the first-stage order.
+            cache_size (int): The number of re-ranked searches to cache.
+            max_pending (int): The number of model passes that may be running or waiting at once.
+        """
+        logger.info("Initializing RerankService")
+        self._model = model
+        self._model_name = model_name
+        self._max_length = max_length
+        self._model_lock = threading.Lock()
+        self.candidates = candidates
+        self._budget_seconds = budget_seconds
+        self._max_pending = max_pending
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='reranker')
+        self._pending = 0
+        self._lock = threading.Lock()
+        # (query, candidates) -> scores, least recently used first
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+
+
+    def get_model(self):
+        """
+        Returns the cross-encoder, loading it on first use.
+        """
+        with self._model_lock:
+            if self._model is None:
+                self._model = CrossEncoderReranker(self._model_name, max_length=self._max_length)
+        return self._model
+
+
+    def set_model(self, model):
+        """
+        Replaces the cross-encoder, e.g. with a stand-in for benchmarks.
+
+        Args:
+            model (CrossEncoderReranker): The model to score query and book pairs with.
+        """
+        with self._model_lock:
+            self._model = model
+        self.clear_cache()
+
+
+    async def rerank(self, query, books):
+        """
+        Re-orders books by their cross-encoder relevance to a query, if it can be done within the budget.
+
+        Args:
+            query (str): The search query.
+            books (list): The first-stage results, best first, with 'isbn_13', 'updated_at' and the fields the
+                cross-encoder reads.
+
+        Returns:
+            list: The books, most relevant first, with the cross-encoder's 'score'. The books are returned in
+                the first-stage order, with their first-stage 'score', if the budget was exceeded.
+        """
+        if len(books) < 2:
+            return books
+        key = (' '.join(query.casefold().split()), tuple((book['isbn_13'], book.get('updated_at')) for book in books))
+
+        with self._lock:
+            scores = self._cache.get(key)
+            if scores is not None:
+                self._cache.move_to_end(key)
+            elif self._pending >= self._max_pending:
+                RERANK_REQUESTS.labels('overloaded').inc()
+                logger.debug("Re-ranker busy, keeping first-stage order for query: %s", query)
+                return books
+            else:
+                self._pending += 1
+        if scores is not None:
+            CACHE_REQUESTS.labels('rerank', 'hit').inc()
+            RERANK_REQUESTS.labels('cached').inc()
+            return self._reorder(books, scores)
+        CACHE_REQUESTS.labels('rerank', 'miss').inc()
+
+        future = asyncio.get_running_loop().run_in_executor(self._executor, self._score, key, query, books)
+        try:
+            # Shielded, so a timeout leaves the pass running and its scores are still cached
+            scores = await asyncio.wait_for(asyncio.shield(future), self._budget_seconds)
+        except asyncio.TimeoutError:
+            RERANK_REQUESTS.labels('budget_exceeded').inc()
+            logger.debug("Re-ranking exceeded %ss, keeping first-stage order for query: %s", self._budget_seconds, query)
+            return books
+        except Exception as e:
+            RERANK_REQUESTS.labels('failed').inc()
+            logger.error("Failed to re-rank results for query %s: %s", query, e)
+            return books
+        RERANK_REQUESTS.labels('reranked').inc()
+        return self._reorder(books, scores)
+
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+
+
+    def _score(self, key, query, books):
+        """
+        Scores books on the model thread and caches the scores.
+        """
+        try:
+            scores = self.get_model().score(query, books)
+            with self._lock:
+                self._cache[key] = scores
+                while len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+            return scores
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+
+    @staticmethod
+    def _reorder(books, scores):
+        # A stable sort, so ties keep their first-stage order
+        ranked = sorted(zip(books, scores), key=lambda pair: -pair[1])
+        return [{**book, 'score': score} for book, score in ranked]
@@ -1,9 +1,20 @@
 import asyncio
+import copy
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 import aioboto3
+import aiohttp
 import botocore.exceptions
+from ..exceptions import ThumbnailUploadError, S3ServiceError
+from utils.helpers import generate_rendition_key
+from utils.images import create_renditions, RENDITION_WIDTHS, RENDITION_CONTENT_TYPE
 from utils.logger import logger
+from utils.metrics import S3_PRESIGN, S3_PRESIGN_DURATION, SERVICE_CALL_DURATION, timed
 from flask import current_app
 
+# Seconds presigned thumbnail URLs stay valid
+PRESIGNED_URL_EXPIRATION = 3600
 class S3Service:
     """
     S3Service is a class that provides methods to interact with AWS S3.
@@ -15,6 +26,8 @@ class S3Service:
         """
         logger.info("Initializing S3Service")
         self._bucket_name = current_app.config['AWS_BUCKET_NAME']
+        # Set to use an S3-compatible emulator instead of AWS
+        self._endpoint_url = current_app.config['AWS_ENDPOINT_URL']
 
         # Create session
         self.session = aioboto3.Session(
@@ -23,14 +36,50 @@ class S3Service:
             aws_secret_access_key=current_app.config['AWS_SECRET_ACCESS_KEY']
         )
 
+        # Image processing is CPU-bound, so it runs in a lazily created process pool
+        self._image_workers = current_app.config['IMAGE_PROCESS_WORKERS']
+        self._image_pool = None
+        self._image_pool_lock = threading.Lock()
+
+
+    def get_image_pool(self):
+        """
+        Returns the process pool used to create thumbnail renditions.
+        """
+        with self._image_pool_lock:
+            if self._image_pool is None:
+                self._image_pool = ProcessPoolExecutor(max_workers=self._image_workers)
+        return self._image_pool
+
+
+    def for_bucket(self, bucket_name):
+        """
+        Returns an S3Service for another bucket, e.g. of another catalogue.
+        The session and the image process pool are shared.
+
+        Args:
+            bucket_name (str): The name of the bucket.
+
+        Returns:
+            S3Service: The service for the bucket.
+        """
+        if bucket_name == self._bucket_name:
+            return self
+        service = copy.copy(self)
+        service._bucket_name = bucket_name
+        # Delegate to this service, so only one process pool is ever created
+        service.get_image_pool = self.get_image_pool
+        return service
+
 
     async def get_client(self):
         """
         Returns the S3 client.
         """
-        return self.session.client('s3')
+        return self.session.client('s3', endpoint_url=self._endpoint_url)
 
 
+    @timed(SERVICE_CALL_DURATION, 'S3Service', 'fetch_presigned_urls')
     async def fetch_presigned_urls(self, s3_keys):
         """
         Asynchronously fetches presigned URLs for a list of S3 keys.
@@ -41,8 +90,8 @@ class S3Service:
         Returns:
             list: A list of presigned URLs.
         """
-        logger.debug(f"Fetching presigned URLs for {len(s3_keys)} keys")
-        async with await self.get_client as s3_client:
+        logger.debug("Fetching presigned URLs for %s keys", len(s3_keys))
+        async with await self.get_client() as s3_client:
             tasks = []
             for s3_key in s3_keys:
                 task = asyncio.create_task(self._generate_presigned_url(s3_client, s3_key))
@@ -51,6 +100,7 @@ class S3Service:
             return await asyncio.gather(*tasks)
         
     
+    @timed(SERVICE_CALL_DURATION, 'S3Service', 'fetch_presigned_url')
     async def fetch_presigned_url(self, s3_key):
         """
         Asynchronously fetches a single presigned URL for a given S3 keys.
@@ -61,12 +111,12 @@ class S3Service:
         Returns:
             str: The presigned URL.
         """
-        logger.debug(f"Fetching presigned URL for key: {s3_key}")
-        async with await self.get_client as s3_client:
+        logger.debug("Fetching presigned URL for key: %s", s3_key)
+        async with await self.get_client() as s3_client:
             return await self._generate_presigned_url(s3_client, s3_key)
 
 
-    async def _generate_presigned_url(self, s3_client, s3_key, expiration=3600):
+    async def _generate_presigned_url(self, s3_client, s3_key, expiration=PRESIGNED_URL_EXPIRATION):
         """
         Generates a presigned URL for a given S3 key.
 
@@ -78,7 +128,8 @@ class S3Service:
         Returns:
             str: The presigned URL.
         """
-        logger.debug(f"Generating presigned URL for key: {s3_key}")
+        logger.debug("Generating presigned URL for key: %s", s3_key)
+        start = time.perf_counter()
         try:
             response = await s3_client.generate_presigned_url(
                 ClientMethod = 'get_object',
@@ -89,10 +140,121 @@ class S3Service:
                 ExpiresIn = expiration
             )
 
+            S3_PRESIGN.labels('success').inc()
             return response
         except botocore.exceptions.ClientError as e:
-            logger.error(f"An AWS service error occured while generating presigned URL for s3 key {s3_key}: {e}")
+            logger.error("An AWS service error occured while generating presigned URL for s3 key %s: %s", s3_key, e)
         except Exception as e:
-            logger.error(f"An error occured while generating presigned URL for s3 key {s3_key}: {e}")
+            logger.error("An error occured while generating presigned URL for s3 key %s: %s", s3_key, e)
+        finally:
+            S3_PRESIGN_DURATION.observe(time.perf_counter() - start)
+
+        S3_PRESIGN.labels('failure').inc()
+        return None
+
+
+    @timed(SERVICE_CALL_DURATION, 'S3Service', 'upload_thumbnail')
+    async def upload_thumbnail(self, thumbnail_url, s3_key):
+        """
+        Downloads a thumbnail image from a URL and uploads it to S3.
+
+        Args:
+            thumbnail_url (str): The URL of the thumbnail image.
+            s3_key (str): The S3 key for the uploaded image.
+
+        Raises:
+            ThumbnailUploadError: If the thumbnail could not be downloaded or uploaded.
+        """
+        async with aiohttp.ClientSession() as session, await self.get_client() as s3_client:
+            await self._upload_thumbnail(session, s3_client, thumbnail_url, s3_key)
+
+
+    @timed(SERVICE_CALL_DURATION, 'S3Service', 'upload_thumbnails')
+    async def upload_thumbnails(self, thumbnails, concurrency=32):
+        """
+        Downloads and uploads many thumbnails concurrently over a shared HTTP session and S3 client.
+
+        Args:
+            thumbnails (list): A list of (thumbnail_url, s3_key) tuples.
+            concurrency (int): The maximum number of thumbnails transferred at once.
 
-        return None
\ No newline at end of file
+        Returns:
+            list: None for each uploaded thumbnail, or the ThumbnailUploadError that occurred, in input order.
+        """
+        logger.debug("Uploading %s thumbnails", len(thumbnails))
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def upload(session, s3_client, thumbnail_url, s3_key):
+            async with semaphore:
+                await self._upload_thumbnail(session, s3_client, thumbnail_url, s3_key)
+
+        async with aiohttp.ClientSession() as session, await self.get_client() as s3_client:
+            return await asyncio.gather(
+                *(upload(session, s3_client, thumbnail_url, s3_key) for thumbnail_url, s3_key in thumbnails),
+                return_exceptions=True
+            )
+
+
+    async def _upload_thumbnail(self, session, s3_client, thumbnail_url, s3_key):
+        """
+        Downloads a thumbnail image from a URL and uploads it to S3 using the given clients,
+        along with a WebP rendition for every size in RENDITION_WIDTHS.
+
+        Args:
+            session (aiohttp.ClientSession): The asynchronous HTTP session.
+            s3_client: The S3 client.
+            thumbnail_url (str): The URL of the thumbnail image.
+            s3_key (str): The S3 key for the uploaded image.
+
+        Raises:
+            ThumbnailUploadError: If the thumbnail could not be downloaded or uploaded.
+        """
+        logger.debug("Uploading thumbnail from %s to key: %s", thumbnail_url, s3_key)
+        try:
+            async with session.get(thumbnail_url) as response:
+                if response.status != 200:
+                    raise ThumbnailUploadError(f"Failed to download image from {thumbnail_url}. Status: {response.status}")
+                image_data = await response.read()
+                content_type = response.content_type
+
+            # Decode and re-encode the image off the event loop
+            loop = asyncio.get_running_loop()
+            renditions = await loop.run_in_executor(self.get_image_pool(), create_renditions, image_data)
+
+            objects = [(s3_key, image_data, content_type)] + [
+                (generate_rendition_key(s3_key, size), rendition, RENDITION_CONTENT_TYPE)
+                for size, rendition in renditions.items()
+            ]
+            await asyncio.gather(*(
+                s3_client.put_object(Bucket=self._bucket_name, Key=key, Body=body, ContentType=body_type)
+                for key, body, body_type in objects
+            ))
+        except aiohttp.ClientError as e:
+            raise ThumbnailUploadError(f"HTTP client error occurred while downloading {thumbnail_url}: {e}") from e
+        except botocore.exceptions.ClientError as e:
+            raise ThumbnailUploadError(f"An AWS service error occurred while uploading s3 key {s3_key}: {e}") from e
+        except OSError as e:
+            raise ThumbnailUploadError(f"Failed to process image from {thumbnail_url}: {e}") from e
+
+
+    @timed(SERVICE_CALL_DURATION, 'S3Service', 'delete_thumbnail')
+    async def delete_thumbnail(self, s3_key):
+        """
+        Deletes a thumbnail and its renditions from S3.
+
+        Args:
+            s3_key (str): The S3 key of the thumbnail.
+
+        Raises:
+            S3ServiceError: If the thumbnail could not be deleted.
+        """
+        logger.debug("Deleting thumbnail with key: %s", s3_key)
+        try:
+            keys = [s3_key] + [generate_rendition_key(s3_key, size) for size in RENDITION_WIDTHS]
+            async with await self.get_client() as s3_client:
+                await s3_client.delete_objects(
+                    Bucket=self._bucket_name,
+                    Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True}
+                )
+        except botocore.exceptions.ClientError as e:
+            raise S3ServiceError(f"An AWS service error occurred while deleting s3 key {s3_key}: {e}") from e
@@ -0,0 +1,362 @@
+import heapq
+import re
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+from collections import OrderedDict, defaultdict
+from utils.logger import logger
+
+# Sorts after any character a token can contain, so (prefix + SENTINEL) bounds the range of a prefix
+SENTINEL = '\U0010ffff'
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def normalize_tokens(text):
+    """
+    Splits text into lowercase tokens without accents, e.g. 'Frank Herbert's Dune' -> ['frank', 'herbert', 's', 'dune'].
+    """
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(character for character in text if not unicodedata.combining(character))
+    return TOKEN_PATTERN.findall(text.casefold())
+
+
+class SuggestIndex:
+    """
+    An in-memory prefix index over the title and author tokens of every book, for search-as-you-type.
+
+    The distinct tokens are kept in a sorted list, so the tokens starting with a prefix are one contiguous range
+    found with two binary searches. Each token has a posting list of its books, best ranked first, so the best
+    books of a prefix are found by merging the heads of the range's posting lists until enough are found: a lookup
+    reads about `limit` postings, not every book in the range. Prefixes shorter than min_prefix_length are not
+    answered, as their ranges span much of the vocabulary.
+
+    Answers for recent prefixes are cached. A write only evicts the answers it changes, i.e. those that hold the
+    book or that the book now enters, so short prefixes keep hitting the cache under write traffic.
+
+    Each process holds its own index. refresh() applies the writes of every other process and script from the
+    'updated_at' field, as the indexer does, and start_refreshing() calls it periodically.
+    """
+
+    # Fields read from the books collection to build and refresh the index
+    FIELDS = ('isbn_13', 'title', 'author', 'rating', 'updated_at')
+
+    def __init__(self, cache_size=1024, min_prefix_length=2, max_scan=10000):
+        """
+        Args:
+            cache_size (int): The number of recent prefixes whose answers are cached.
+            min_prefix_length (int): The minimum length of the longest token of a prefix.
+            max_scan (int): The maximum number of books checked against the other tokens of a multi-token prefix.
+        """
+        logger.info("Initializing SuggestIndex")
+        self._tokens = []
+        # Token -> [(rank, isbn_13)], best ranked first
+        self._postings = {}
+        # ISBN-13 -> (summary, tokens, rank)
+        self._books = {}
+        self._lock = threading.RLock()
+        self._cache = OrderedDict()
+        # Longest token of a cached prefix -> the cache keys of the prefixes
+        self._cache_keys = defaultdict(set)
+        self._cache_size = cache_size
+        self._min_prefix_length = min_prefix_length
+        self._max_scan = max_scan
+        # (updated_at, _id) of the last book read from the collection
+        self._mark = None
+
+
+    @property
+    def min_prefix_length(self):
+        return self._min_prefix_length
+
+
+    def build(self, books):
+        """
+        Replaces the index with the given books.
+
+        Args:
+            books (iterable): Books with at least 'isbn_13', 'title' and 'author', and 'updated_at' and '_id'
+                if the index is refreshed from their collection.
+        """
+        indexed, postings, mark = {}, defaultdict(list), None
+        for book in books:
+            summary, tokens = self._summarize(book)
+            rank = self._rank(summary)
+            indexed[book['isbn_13']] = (summary, tokens, rank)
+            for token in tokens:
+                postings[token].append((rank, book['isbn_13']))
+            mark = self._advance(mark, book)
+        for token_postings in postings.values():
+            token_postings.sort()
+
+        with self._lock:
+            self._tokens, self._postings, self._books = sorted(postings), dict(postings), indexed
+            self._mark = mark
+            self.clear_cache()
+        logger.info("Built suggest index with %s tokens for %s books", len(postings), len(indexed))
+
+
+    def update(self, books):
+        """
+        Adds or replaces books in the index.
+
+        Args:
+            books (list): Books with at least 'isbn_13', 'title' and 'author'.
+        """
+        with self._lock:
+            for book in books:
+                old = self._remove(book['isbn_13'])
+                summary, tokens = self._summarize(book)
+                new = (summary, tokens, self._rank(summary))
+                self._books[book['isbn_13']] = new
+                for token in tokens:
+                    token_postings = self._postings.get(token)
+                    if token_postings is None:
+                        token_postings = self._postings[token] = []
+                        insort(self._tokens, token)
+                    insort(token_postings, (new[2], book['isbn_13']))
+                self._invalidate(book['isbn_13'], old, new)
+
+
+    def remove(self, isbns):
+        """
+        Removes books from the index.
+
+        Args:
+            isbns (list): The ISBN-13s of the books.
+        """
+        with self._lock:
+            for isbn_13 in isbns:
+                old = self._remove(isbn_13)
+                if old is not None:
+                    self._invalidate(isbn_13, old, None)
+
+
+    def refresh(self, collection, batch_size=1000):
+        """
+        Applies the writes made to the collection since the index was built or last refreshed, by any process.
+
+        Written books are read in batches by their 'updated_at', with ties broken by _id. Deletes leave no trace
+        there, so if the collection holds fewer books than the index afterwards, its ISBN-13s are read from the
+        isbn_13 index and the books it no longer holds are removed.
+
+        Args:
+            collection: The books collection the index was built from.
+            batch_size (int): The number of books read at once.
+
+        Returns:
+            int: The number of books updated or removed.
+        """
+        changed = 0
+        projection = dict.fromkeys(self.FIELDS, 1)
+        while True:
+            query = {}
+            if self._mark is not None:
+                updated_at, last_id = self._mark
+                query = {'updated_at': {'$gt': updated_at}}
+                if last_id is not None:
+                    query = {'$or': [query, {'updated_at': updated_at, '_id': {'$gt': last_id}}]}
+            books = list(collection.find(query, projection).sort([('updated_at', 1), ('_id', 1)]).limit(batch_size))
+            if books:
+                self.update(books)
+                for book in books:
+                    self._mark = self._advance(self._mark, book)
+                changed += len(books)
+            if len(books) < batch_size:
+                break
+
+        if collection.count_documents({}) < len(self):
+            stored = {book['isbn_13'] for book in collection.find({}, {'isbn_13': 1, '_id': 0}).hint([('isbn_13', 1)])}
+            with self._lock:
+                deleted = [isbn_13 for isbn_13 in self._books if isbn_13 not in stored]
+            self.remove(deleted)
+            changed += len(deleted)
+
+        if changed:
+            logger.debug("Refreshed suggest index with %s changed books", changed)
+        return changed
+
+
+    def start_refreshing(self, collection, interval):
+        """
+        Refreshes the index from the collection every `interval` seconds in a daemon thread.
+
+        Returns:
+            threading.Event: Set it to stop refreshing.
+        """
+        stop_event = threading.Event()
+
+        def run():
+            while not stop_event.wait(interval):
+                try:
+                    self.refresh(collection)
+                except Exception as e:
+                    logger.error("Failed to refresh the suggest index: %s", e)
+
+        threading.Thread(target=run, name='suggest-refresh', daemon=True).start()
+        return stop_event
+
+
+    def suggest(self, prefix, limit=10):
+        """
+        Finds the best rated books with a title or author token starting with every token of a prefix.
+        The last token is usually incomplete, e.g. 'frank her'.
+
+        Args:
+            prefix (str): The text typed so far.
+            limit (int): The maximum number of suggestions.
+
+        Returns:
+            list: Dicts with the ISBN-13, title, author and rating of each book, best rated first.
+                Empty if the longest token of the prefix is shorter than min_prefix_length.
+        """
+        tokens = normalize_tokens(prefix)
+        if not tokens:
+            return []
+        # Merge the range of the longest token, as it is usually the most selective, and check the others per book
+        ranged = max(tokens, key=len)
+        if len(ranged) < self._min_prefix_length:
+            return []
+        others = list(tokens)
+        others.remove(ranged)
+        key = (tuple(tokens), limit)
+
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return cached
+
+            start = bisect_left(self._tokens, ranged)
+            end = bisect_left(self._tokens, ranged + SENTINEL, start)
+            suggestions, seen = [], set()
+            for _, isbn_13 in heapq.merge(*(self._postings[token] for token in self._tokens[start:end])):
+                # A book is in the posting list of each of its tokens in the range, e.g. 'star' and 'stars'
+                if isbn_13 in seen:
+                    continue
+                seen.add(isbn_13)
+                summary, book_tokens, _ = self._books[isbn_13]
+                if all(any(token.startswith(other) for token in book_tokens) for other in others):
+                    suggestions.append(summary)
+                    if len(suggestions) == limit:
+                        break
+                elif len(seen) >= self._max_scan:
+                    break
+
+            self._cache[key] = suggestions
+            self._cache_keys[ranged].add(key)
+            while len(self._cache) > self._cache_size:
+                evicted, _ = self._cache.popitem(last=False)
+                self._forget(evicted)
+        return suggestions
+
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+            self._cache_keys.clear()
+
+
+    def __len__(self):
+        return len(self._books)
+
+
+    def _remove(self, isbn_13):
+        """
+        Removes a book from the token list and its posting lists, and returns its entry, or None if not indexed.
+        """
+        indexed = self._books.pop(isbn_13, None)
+        if indexed is None:
+            return None
+        _, tokens, rank = indexed
+        for token in tokens:
+            token_postings = self._postings[token]
+            position = bisect_left(token_postings, (rank, isbn_13))
+            if position < len(token_postings) and token_postings[position] == (rank, isbn_13):
+                del token_postings[position]
+            if not token_postings:
+                del self._postings[token]
+                del self._tokens[bisect_left(self._tokens, token)]
+        return indexed
+
+
+    def _invalidate(self, isbn_13, old, new):
+        """
+        Evicts the cached answers a write changes: those holding the book, and those the new version enters.
+
+        Args:
+            isbn_13 (str): The ISBN-13 of the written book.
+            old (tuple): The book's entry before the write, or None if it was not indexed.
+            new (tuple): The book's entry after the write, or None if it was removed.
+        """
+        # A cached prefix can only match a book if its longest token is a prefix of one of the book's tokens
+        keys = set()
+        for entry in (old, new):
+            if entry is None:
+                continue
+            for token in entry[1]:
+                for length in range(self._min_prefix_length, len(token) + 1):
+                    keys.update(self._cache_keys.get(token[:length], ()))
+
+        for key in keys:
+            cached = self._cache.get(key)
+            if cached is None:
+                continue
+            query_tokens, limit = key
+            if any(summary['isbn_13'] == isbn_13 for summary in cached):
+                evict = True
+            elif new is not None and all(any(token.startswith(other) for token in new[1]) for other in query_tokens):
+                evict = len(cached) < limit or new[2] < self._rank(cached[-1])
+            else:
+                evict = False
+            if evict:
+                del self._cache[key]
+                self._forget(key)
+
+
+    def _forget(self, key):
+        """
+        Drops an evicted cache key from the keys by longest token.
+        """
+        ranged = max(key[0], key=len)
+        keys = self._cache_keys.get(ranged)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._cache_keys[ranged]
+
+
+    @staticmethod
+    def _advance(mark, book):
+        """
+        Returns the later of a mark and the (updated_at, _id) of a book.
+        """
+        updated_at = book.get('updated_at')
+        if updated_at is None:
+            return mark
+        if mark is None or updated_at > mark[0]:
+            return updated_at, book.get('_id')
+        if updated_at == mark[0] and book.get('_id') is not None and (mark[1] is None or book['_id'] > mark[1]):
+            return updated_at, book['_id']
+        return mark
+
+
+    @staticmethod
+    def _summarize(book):
+        """
+        Returns what a suggestion shows of a book, and the book's distinct title and author tokens.
+        """
+        summary = {
+            'isbn_13': book['isbn_13'],
+            'title': book.get('title'),
+            'author': book.get('author'),
+            'rating': book.get('rating')
+        }
+        tokens = tuple(sorted(set(normalize_tokens(book.get('title')) + normalize_tokens(book.get('author')))))
+        return summary, tokens
+
+
+    @staticmethod
+    def _rank(summary):
+        # Best rated first, unrated last, then alphabetically, then by ISBN-13 so every book has a distinct rank
+        rating = summary['rating']
+        return -(rating if rating is not None else -1), summary['title'] or '', summary['isbn_13']
@@ -0,0 +1,364 @@
+import copy
+import threading
+import time
+import numpy as np
+from pinecone import Pinecone
+from ..exceptions import VectorEmbeddingError, VectorUpsertError, VectorServiceError
+from ..models.weighted_embedding_model import WeightedEmbeddingModel
+from .local_vector_index import LocalVectorIndex
+from utils.logger import logger
+from utils.metrics import SERVICE_CALL_DURATION, VECTOR_QUERY_DURATION, timed
+from flask import current_app
+
+
+def create_vector_index(config, shared_index=None):
+    """
+    Creates the vector index for the configured backend.
+
+    Args:
+        config (dict): The app config, or the config of a catalogue. VECTOR_BACKEND selects 'pinecone' (default)
+            or 'local'. PINECONE_NAMESPACE, if set, scopes a Pinecone index to one namespace.
+        shared_index: An index whose Pinecone connection is reused instead of connecting to PINECONE_INDEX_HOST,
+            e.g. the index of another catalogue. Ignored by the local backend.
+
+    Returns:
+        The Pinecone index, or a LocalVectorIndex.
+    """
+    backend = config.get('VECTOR_BACKEND') or 'pinecone'
+    logger.info("Using %s vector index", backend)
+    if backend == 'local':
+        return LocalVectorIndex(path=config.get('LOCAL_VECTOR_INDEX_PATH'))
+    if backend == 'pinecone':
+        pinecone_index = shared_index.index if isinstance(shared_index, NamespacedIndex) else shared_index
+        if pinecone_index is None:
+            pc = Pinecone(api_key=config['PINECONE_API_KEY'])
+            pinecone_index = pc.Index(host=config['PINECONE_INDEX_HOST'])
+        namespace = config.get('PINECONE_NAMESPACE')
+        return NamespacedIndex(pinecone_index, namespace) if namespace else pinecone_index
+    raise ValueError(f"Unknown vector backend: {backend}")
+
+
+class NamespacedIndex:
+    """
+    Scopes a Pinecone index to one namespace, so catalogues share the index and its connection pool.
+    Mirrors the subset of the Index API used by the app.
+    """
+
+    def __init__(self, index, namespace):
+        """
+        Args:
+            index: The Pinecone index.
+            namespace (str): The namespace every call is made in.
+        """
+        self.index = index
+        self.namespace = namespace
+
+
+    def upsert(self, vectors):
+        return self.index.upsert(vectors=vectors, namespace=self.namespace)
+
+
+    def delete(self, ids=None, delete_all=False):
+        if delete_all:
+            return self.index.delete(delete_all=True, namespace=self.namespace)
+        return self.index.delete(ids=ids, namespace=self.namespace)
+
+
+    def fetch(self, ids):
+        return self.index.fetch(ids=ids, namespace=self.namespace)
+
+
+    def query(self, vector, top_k=10, include_values=False, **kwargs):
+        return self.index.query(vector=vector, top_k=top_k, include_values=include_values, namespace=self.namespace, **kwargs)
+
+
+    def list(self, prefix='', limit=100):
+        return self.index.list(prefix=prefix or None, limit=limit, namespace=self.namespace)
+
+
+    def describe_index_stats(self):
+        """
+        Returns the number of vectors in the namespace and their dimension.
+        """
+        stats = self.index.describe_index_stats()
+        namespace = stats.get('namespaces', {}).get(self.namespace) or {}
+        return {'dimension': stats['dimension'], 'total_vector_count': namespace.get('vector_count', 0)}
+
+
+class VectorService:
+    """
+    VectorService is a class that keeps the vector index in sync with book data.
+    The embedding model is only loaded the first time a book actually needs to be embedded.
+
+    In the 'single' retrieval mode every book is stored as one weighted vector. In the 'multi' mode the normalized
+    vectors of a subset of fields are stored concatenated, and the field weights are applied to the query instead,
+    so they can be changed per request without re-embedding the catalogue.
+    """
+
+    def __init__(self, index=None, model=None, upsert_batch_size=100, mode='single', field_weights=None, multi_vector_fields=None):
+        """
+        Creates an instance of VectorService and connects to the configured vector index.
+        The app config is only read for the arguments that are not passed in.
+
+        Args:
+            index: An index to use instead of the configured one.
+            model (WeightedEmbeddingModel): A model to use instead of lazily loading the configured one.
+                It should have been created with the same field weights.
+            upsert_batch_size (int): The maximum number of vectors sent in one upsert request.
+            mode (str): 'single' or 'multi'.
+            field_weights (dict): The field weights. Defaults to WeightedEmbeddingModel.FIELD_WEIGHTS.
+            multi_vector_fields (list): The fields stored in the 'multi' mode. Defaults to WeightedEmbeddingModel.MULTI_VECTOR_FIELDS.
+        """
+        logger.info("Initializing VectorService in %s retrieval mode", mode)
+        if mode not in ('single', 'multi'):
+            raise ValueError(f"Unknown retrieval mode: {mode}")
+
+        self._index = index if index is not None else create_vector_index(current_app.config)
+
+        self._model = model
+        self._model_name = None if model is not None else current_app.config['HF_MODEL_NAME']
+        self._model_lock = threading.Lock()
+        self._upsert_batch_size = upsert_batch_size
+
+        self._mode = mode
+        self._field_weights = WeightedEmbeddingModel.validate_weights(field_weights or WeightedEmbeddingModel.FIELD_WEIGHTS)
+        self._multi_vector_fields = list(multi_vector_fields or WeightedEmbeddingModel.MULTI_VECTOR_FIELDS)
+        unknown = set(self._multi_vector_fields) - set(WeightedEmbeddingModel.FIELD_WEIGHTS)
+        if unknown:
+            raise ValueError(f"Unknown multi-vector fields: {', '.join(sorted(unknown))}")
+
+
+    def get_model(self):
+        """
+        Returns the embedding model, loading it on first use.
+        """
+        with self._model_lock:
+            if self._model is None:
+                self._model = WeightedEmbeddingModel(model_name=self._model_name, weights=self._field_weights)
+        return self._model
+
+
+    def set_model(self, model):
+        """
+        Replaces the embedding model, e.g. with a stand-in for benchmarks.
+
+        Args:
+            model (WeightedEmbeddingModel): The model to embed books and queries with.
+        """
+        with self._model_lock:
+            self._model = model
+
+
+    def for_index(self, index):
+        """
+        Returns a VectorService for another index, e.g. of another catalogue, with the same settings.
+        The embedding model is shared: it is loaded once, by whichever service needs it first.
+
+        Args:
+            index: The vector index.
+
+        Returns:
+            VectorService: The service for the index.
+        """
+        service = copy.copy(self)
+        service._index = index
+        # Delegate to this service, so a model loaded or replaced later is shared too
+        service.get_model = self.get_model
+        service.set_model = self.set_model
+        return service
+
+
+    @property
+    def index(self):
+        """
+        Returns the underlying vector index.
+        """
+        return self._index
+
+
+    def needs_reindex(self, old_book, new_book):
+        """
+        Checks whether an update to a book changes its embedding.
+
+        Args:
+            old_book (dict): The stored version of the book.
+            new_book (dict): The updated version of the book.
+
+        Returns:
+            list: The weighted fields that changed. Empty if the stored vector is still valid.
+        """
+        embedded_fields = self._multi_vector_fields if self._mode == 'multi' else self._field_weights
+        return [field for field in WeightedEmbeddingModel.changed_fields(old_book, new_book) if field in embedded_fields]
+
+
+    def validate_query_weights(self, weights):
+        """
+        Checks field weights passed with a search request.
+
+        Args:
+            weights (dict): The weight of each field.
+
+        Raises:
+            ValueError: If the retrieval mode is not 'multi', or a field is unknown or not stored.
+        """
+        if self._mode != 'multi':
+            raise ValueError("Field weights can only be set per request in the multi-vector retrieval mode")
+        WeightedEmbeddingModel.validate_weights(weights)
+        not_stored = [field for field, weight in weights.items() if weight and field not in self._multi_vector_fields]
+        if not_stored:
+            raise ValueError(f"Fields not stored for multi-vector retrieval: {', '.join(not_stored)}. Stored fields: {', '.join(self._multi_vector_fields)}")
+
+
+    @timed(SERVICE_CALL_DURATION, 'VectorService', 'upsert_books')
+    def upsert_books(self, books):
+        """
+        Embeds a list of books in a single model call and upserts their vectors into the index in batches.
+
+        Args:
+            books (list): A list of book dictionaries.
+
+        Raises:
+            VectorEmbeddingError: If the books could not be embedded.
+            VectorUpsertError: If the vectors could not be upserted.
+        """
+        if not books:
+            return
+
+        logger.debug("Embedding and upserting %s books", len(books))
+        try:
+            if self._mode == 'multi':
+                embeddings = self.get_model().embed_multi(books, self._multi_vector_fields)
+            else:
+                embeddings = self.get_model().embed(books)
+        except Exception as e:
+            raise VectorEmbeddingError(f"Failed to embed {len(books)} books: {e}") from e
+
+        vectors = [(book['isbn_13'], embedding) for book, embedding in zip(books, embeddings)]
+        for start in range(0, len(vectors), self._upsert_batch_size):
+            batch = vectors[start:start + self._upsert_batch_size]
+            try:
+                self._index.upsert(vectors=batch)
+            except Exception as e:
+                raise VectorUpsertError(f"Failed to upsert {len(batch)} vectors ({start} of {len(vectors)} already upserted): {e}") from e
+
+
+    @timed(SERVICE_CALL_DURATION, 'VectorService', 'search')
+    def search(self, query, top_k=10, weights=None):
+        """
+        Finds the books whose vectors are most similar to a free-text query.
+
+        Args:
+            query (str): The search query.
+            top_k (int): The number of matches to return.
+            weights (dict): Field weights for this query, in the 'multi' mode only. Defaults to the configured weights.
+
+        Returns:
+            list: (isbn_13, score) tuples, most similar first. In the 'multi' mode the score is the weighted
+                average of the per-field cosine similarities.
+
+        Raises:
+            ValueError: If the weights are invalid for the retrieval mode.
+            VectorEmbeddingError: If the query could not be embedded.
+            VectorServiceError: If the index could not be queried.
+        """
+        if weights:
+            self.validate_query_weights(weights)
+
+        try:
+            vector = self.get_model().embed_query(query)
+        except Exception as e:
+            raise VectorEmbeddingError(f"Failed to embed query: {e}") from e
+
+        scale = 1
+        if self._mode == 'multi':
+            vector, scale = self._multi_vector_query(vector, weights or self._field_weights)
+
+        start = time.perf_counter()
+        try:
+            response = self._index.query(vector=vector, top_k=top_k)
+        except Exception as e:
+            raise VectorServiceError(f"Failed to query the vector index: {e}") from e
+        finally:
+            VECTOR_QUERY_DURATION.observe(time.perf_counter() - start)
+        return [(match['id'], match['score'] * scale) for match in response['matches']]
+
+
+    @timed(SERVICE_CALL_DURATION, 'VectorService', 'similar')
+    def similar(self, isbn_13, top_k=10):
+        """
+        Finds the books whose vectors are most similar to a book's stored vector. Nothing is embedded.
+        In the 'multi' mode every stored field counts equally, like in the precomputed neighbours.
+
+        Args:
+            isbn_13 (str): The ISBN-13 of the book.
+            top_k (int): The number of similar books to return.
+
+        Returns:
+            list: (isbn_13, score) tuples, most similar first, without the book itself.
+            None: If the book has no stored vector.
+
+        Raises:
+            VectorServiceError: If the index could not be queried.
+        """
+        try:
+            response = self._index.fetch(ids=[isbn_13])
+        except Exception as e:
+            raise VectorServiceError(f"Failed to fetch the vector of {isbn_13}: {e}") from e
+        stored = response['vectors'].get(isbn_13)
+        if stored is None:
+            return None
+
+        start = time.perf_counter()
+        try:
+            # One extra match, as the book is its own closest match
+            response = self._index.query(vector=stored['values'], top_k=top_k + 1)
+        except Exception as e:
+            raise VectorServiceError(f"Failed to query the vector index: {e}") from e
+        finally:
+            VECTOR_QUERY_DURATION.observe(time.perf_counter() - start)
+        return [(match['id'], match['score']) for match in response['matches'] if match['id'] != isbn_13][:top_k]
+
+
+    def _multi_vector_query(self, vector, weights):
+        """
+        Repeats a normalized query vector once per stored field, scaled by the field's weight.
+
+        Args:
+            vector (list): The query vector.
+            weights (dict): The field weights. Stored fields that are left out get a weight of 0.
+
+        Returns:
+            tuple: The query vector for the multi-vector index, and the factor that turns the index's cosine
+                score into the weighted average of the per-field cosine similarities.
+        """
+        query = np.asarray(vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1
+        field_weights = np.array([weights.get(field, 0) for field in self._multi_vector_fields], dtype=np.float32)
+        if not field_weights.any():
+            # None of the configured weights are on stored fields
+            field_weights[:] = 1
+
+        # The index normalizes both sides: stored vectors have norm sqrt(num_fields), the query norm ||weights||
+        scale = np.sqrt(len(field_weights)) * np.linalg.norm(field_weights) / field_weights.sum()
+        return (field_weights[:, None] * query).ravel().tolist(), float(scale)
+
+
+    @timed(SERVICE_CALL_DURATION, 'VectorService', 'delete_books')
+    def delete_books(self, isbns):
+        """
+        Deletes the vectors of a list of books from the index.
+
+        Args:
+            isbns (list): The ISBN-13s of the books to delete.
+
+        Raises:
+            VectorServiceError: If the vectors could not be deleted.
+        """
+        if not isbns:
+            return
+
+        logger.debug("Deleting %s vectors", len(isbns))
+        try:
+            self._index.delete(ids=list(isbns))
+        except Exception as e:
+            raise VectorServiceError(f"Failed to delete {len(isbns)} vectors: {e}") from e
@@ -0,0 +1,166 @@
+from collections import Counter
+from utils.helpers import RENDITION_SEPARATOR, THUMBNAIL_PREFIX, generate_rendition_key
+from utils.images import RENDITION_WIDTHS
+from utils.logger import logger
+
+# Gaps found by the audit, as (kind, description)
+GAP_KINDS = {
+    'missing_thumbnail': "books without a thumbnail in S3",
+    'missing_renditions': "books with a thumbnail but not all of its renditions",
+    'missing_vector': "books without a vector",
+    'orphaned_thumbnail': "thumbnails in S3 without a book",
+    'orphaned_vector': "vectors without a book"
+}
+
+
+class ConsistencyAuditor:
+    """
+    ConsistencyAuditor checks that every book in MongoDB has a thumbnail in S3 and a vector in the index,
+    and that S3 and the index hold nothing for books that do not exist.
+
+    The three stores are read as ISBN-13 streams in sorted order: MongoDB through an index-only projection on
+    the unique isbn_13 index, S3 through the paginated listing of the catalogue's thumbnail prefix, and the index through
+    its paginated id listing. The streams are merge-joined, so memory does not grow with the catalogue.
+    """
+
+    def __init__(self, db, s3_client, bucket_name, index, page_size=1000, thumbnail_prefix=THUMBNAIL_PREFIX):
+        """
+        Initializes the ConsistencyAuditor.
+
+        Args:
+            db: The MongoDB database containing the books collection.
+            s3_client: A boto3 S3 client.
+            bucket_name (str): The bucket holding the thumbnails.
+            index: The vector index (Pinecone, or a LocalVectorIndex). Must have a paginated list method.
+            page_size (int): The number of ids read per page from each store.
+            thumbnail_prefix (str): The S3 prefix the catalogue's thumbnails are stored under.
+        """
+        self._db = db
+        self._s3 = s3_client
+        self._bucket_name = bucket_name
+        self._index = index
+        self._page_size = page_size
+        self._thumbnail_prefix = thumbnail_prefix
+
+
+    def run(self, on_gap=None, check_s3=True, check_vectors=True):
+        """
+        Merge-joins the stores and reports every gap.
+
+        Args:
+            on_gap (callable): Called with (kind, isbn_13) for every gap, in ISBN-13 order.
+            check_s3 (bool): Flag to audit the thumbnails.
+            check_vectors (bool): Flag to audit the vectors.
+
+        Returns:
+            Counter: The number of books in MongoDB ('books') and the number of gaps of each kind.
+        """
+        streams = {'mongodb': self._mongo_isbns()}
+        if check_s3:
+            streams['s3'] = self._s3_isbns()
+        if check_vectors:
+            streams['vectors'] = self._vector_isbns()
+
+        counts = Counter()
+        for isbn_13, found in merge_join(streams):
+            book = 'mongodb' in found
+            counts['books'] += book
+            gaps = []
+            if check_s3:
+                if book and 's3' not in found:
+                    gaps.append('missing_thumbnail')
+                elif book and not found['s3']:
+                    gaps.append('missing_renditions')
+                elif not book and 's3' in found:
+                    gaps.append('orphaned_thumbnail')
+            if check_vectors:
+                if book and 'vectors' not in found:
+                    gaps.append('missing_vector')
+                elif not book and 'vectors' in found:
+                    gaps.append('orphaned_vector')
+
+            for kind in gaps:
+                counts[kind] += 1
+                if on_gap is not None:
+                    on_gap(kind, isbn_13)
+
+        logger.info("Audited %s books: %s", counts['books'], {kind: counts[kind] for kind in GAP_KINDS})
+        return counts
+
+
+    def _mongo_isbns(self):
+        """
+        Yields the ISBN-13 of every book in sorted order. Only the index is read, as no other field is projected.
+        """
+        cursor = self._db.books.find({}, {'isbn_13': 1, '_id': 0}) \
+            .sort('isbn_13', 1).hint([('isbn_13', 1)]).batch_size(self._page_size)
+        for book in cursor:
+            yield book['isbn_13'], None
+
+
+    def _s3_isbns(self):
+        """
+        Yields the ISBN-13 of every thumbnail in sorted order, and whether the original and all renditions exist.
+        The keys of a book are listed consecutively, as ISBN-13s have the same length.
+        """
+        expected = {''} | {generate_rendition_key('', size)[1:] for size in RENDITION_WIDTHS}
+        current, found = None, set()
+        paginator = self._s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self._bucket_name, Prefix=self._thumbnail_prefix,
+                                       PaginationConfig={'PageSize': self._page_size}):
+            for item in page.get('Contents', []):
+                isbn_13, _, suffix = item['Key'][len(self._thumbnail_prefix):].partition(RENDITION_SEPARATOR)
+                if isbn_13 != current:
+                    if current is not None:
+                        yield current, expected <= found
+                    current, found = isbn_13, set()
+                found.add(suffix)
+        if current is not None:
+            yield current, expected <= found
+
+
+    def _vector_isbns(self):
+        """
+        Yields the id of every vector in sorted order.
+        """
+        for ids in self._index.list(limit=self._page_size):
+            for id in ids:
+                yield id, None
+
+
+def merge_join(streams):
+    """
+    Merge-joins sorted streams of (key, value) pairs, holding one pair per stream in memory.
+
+    Args:
+        streams (dict): Iterators of (key, value) pairs in strictly increasing key order, by name.
+
+    Yields:
+        tuple: Every key in sorted order, and the values of the streams it was found in, by stream name.
+
+    Raises:
+        ValueError: If a stream is not sorted, as the join would report false gaps.
+    """
+    heads = {}
+    for name, stream in streams.items():
+        stream = iter(stream)
+        head = next(stream, None)
+        if head is not None:
+            heads[name] = (head, stream)
+
+    while heads:
+        key = min(head[0] for head, _ in heads.values())
+        found = {}
+        for name in list(heads):
+            (head_key, value), stream = heads[name]
+            if head_key != key:
+                continue
+            found[name] = value
+            following = next(stream, None)
+            if following is None:
+                del heads[name]
+            elif following[0] <= key:
+                raise ValueError(f"The {name} stream is not sorted: {following[0]!r} follows {key!r}")
+            else:
+                heads[name] = (following, stream)
+        yield key, found
@@ -0,0 +1,317 @@
+import threading
+import time
+from datetime import datetime, timezone
+from pymongo import ReplaceOne
+from pymongo.errors import PyMongoError
+from ..models.weighted_embedding_model import WeightedEmbeddingModel
+from utils.logger import logger
+
+class BookIndexer:
+    """
+    BookIndexer is a long-running worker that keeps the vector index in sync with the books collection.
+    It tails MongoDB change events, coalesces bursts of changes per book into batches, embeds and upserts
+    (or deletes) them, and then invalidates any registered read caches.
+
+    Change streams require MongoDB to run as a replica set. For a standalone mongod (e.g. in tests) the
+    indexer can instead poll the 'updated_at' field, which does not observe deletes.
+
+    When idle, the indexer also applies the repairs queued in the index_repairs collection, e.g. by the
+    consistency auditor for books whose vector is missing or orphaned.
+
+    A batch that still fails after max_retries is split in halves until the books that fail on their own are
+    found. They are written to the index_dead_letters collection with their error, and the checkpoint moves
+    past them, so one bad book does not stall the index. Dead letters can be replayed with enqueue_repairs.
+    """
+
+    STATE_ID = 'books'
+
+    def __init__(self, db, vector_service, batch_size=256, max_wait=1.0, poll_interval=1.0, invalidators=None,
+                 max_retries=5):
+        """
+        Initializes the BookIndexer.
+
+        Args:
+            db: The MongoDB database containing the books collection.
+            vector_service (VectorService): The service used to embed books and update the vector index.
+            batch_size (int): The maximum number of books to embed in one batch.
+            max_wait (float): The maximum number of seconds a change waits before its batch is flushed.
+            poll_interval (float): The number of seconds between polls when change streams are not used.
+            invalidators (list): Callables that receive the list of changed ISBN-13s after every flush.
+            max_retries (int): The number of retries of a failing batch before it is split.
+        """
+        self._db = db
+        self._vectors = vector_service
+        self._batch_size = batch_size
+        self._max_wait = max_wait
+        self._poll_interval = poll_interval
+        self._invalidators = list(invalidators or [])
+        self._max_retries = max_retries
+        self._source_fields = WeightedEmbeddingModel.source_fields()
+
+
+    def run(self, use_change_stream=True, stop_event=None):
+        """
+        Processes changes until stop_event is set.
+
+        Args:
+            use_change_stream (bool): Flag to tail a change stream instead of polling 'updated_at'.
+            stop_event (threading.Event): Event that stops the indexer once set.
+        """
+        stop_event = stop_event or threading.Event()
+        logger.info("Starting indexer using %s", 'change streams' if use_change_stream else 'polling')
+        events = self._watch(stop_event) if use_change_stream else self._poll(stop_event)
+
+        # Pending changes keyed by ISBN-13, so repeated changes to a book within a batch are only applied once
+        pending = {}
+        checkpoint = None
+        deadline = None
+
+        # Sources yield None when idle, so a partial batch is still flushed once it is old enough
+        for event in events:
+            if event is not None:
+                (op, isbn_13, book), checkpoint = event
+                previous_op = pending.get(isbn_13, (None, None))[0]
+                if op == 'touch' and previous_op in ('upsert', 'delete'):
+                    op = previous_op
+                pending[isbn_13] = (op, book)
+                deadline = deadline or time.monotonic() + self._max_wait
+            elif not pending:
+                # Repairs are flushed right away, as they were already waiting in the queue
+                for op, isbn_13, book in self._claim_repairs():
+                    pending[isbn_13] = (op, book)
+                    deadline = time.monotonic()
+
+            if pending and (len(pending) >= self._batch_size or time.monotonic() >= deadline):
+                self._flush(pending, checkpoint, stop_event)
+                pending, deadline = {}, None
+
+        if pending:
+            self._flush(pending, checkpoint, stop_event)
+        logger.info("Indexer stopped")
+
+
+    def _watch(self, stop_event):
+        """
+        Yields changes from a change stream on the books collection, resuming after the stored token.
+        """
+        # Pre-images let delete events carry the ISBN-13 of the deleted book (MongoDB 6.0+)
+        try:
+            self._db.command('collMod', 'books', changeStreamPreAndPostImages={'enabled': True})
+        except PyMongoError as e:
+            logger.warning("Could not enable change stream pre-images, deletes will not be propagated: %s", e)
+
+        state = self._db.indexer_state.find_one({'_id': self.STATE_ID}) or {}
+        resume_token = state.get('resume_token')
+        if resume_token:
+            logger.info("Resuming change stream from stored token")
+
+        with self._db.books.watch(
+            full_document='updateLookup',
+            full_document_before_change='whenAvailable',
+            resume_after=resume_token,
+            max_await_time_ms=int(self._max_wait * 1000)
+        ) as stream:
+            while not stop_event.is_set():
+                change = stream.try_next()
+                if change is None:
+                    yield None
+                    continue
+
+                parsed = self._parse_change(change)
+                if parsed:
+                    yield parsed, {'resume_token': stream.resume_token}
+
+
+    def _poll(self, stop_event):
+        """
+        Yields books whose 'updated_at' is newer than the stored high-water mark.
+        """
+        state = self._db.indexer_state.find_one({'_id': self.STATE_ID}) or {}
+        mark = state.get('updated_at_mark', datetime(1970, 1, 1))
+        last_id = state.get('last_id')
+
+        while not stop_event.is_set():
+            # Books written in the same millisecond share an 'updated_at', so ties are broken by _id
+            query = {'updated_at': {'$gt': mark}}
+            if last_id is not None:
+                query = {'$or': [query, {'updated_at': mark, '_id': {'$gt': last_id}}]}
+
+            cursor = self._db.books.find(query).sort([('updated_at', 1), ('_id', 1)]).limit(self._batch_size)
+            found = False
+            for book in cursor:
+                found = True
+                mark, last_id = book['updated_at'], book['_id']
+                yield ('upsert', book['isbn_13'], book), {'updated_at_mark': mark, 'last_id': last_id}
+
+            if not found:
+                yield None
+                stop_event.wait(self._poll_interval)
+
+
+    def _parse_change(self, change):
+        """
+        Converts a change event into an (operation, isbn_13, book) tuple.
+
+        Returns:
+            tuple: The operation ('upsert', 'touch' or 'delete'), the ISBN-13 and the book, or None to skip the event.
+        """
+        operation = change['operationType']
+
+        if operation in ('insert', 'replace', 'update'):
+            book = change.get('fullDocument')
+            if not book:
+                # The book was deleted before the lookup; the delete event will follow
+                return None
+
+            # Updates that do not touch a weighted field only need cache invalidation
+            if operation == 'update':
+                description = change.get('updateDescription', {})
+                changed = set(description.get('updatedFields', {})) | set(description.get('removedFields', []))
+                if not {field.split('.')[0] for field in changed} & self._source_fields:
+                    return 'touch', book['isbn_13'], book
+
+            return 'upsert', book['isbn_13'], book
+
+        if operation == 'delete':
+            book = change.get('fullDocumentBeforeChange')
+            if not book:
+                logger.warning("Cannot propagate delete of %s: pre-images are not enabled on the books collection", change['documentKey']['_id'])
+                return None
+            return 'delete', book['isbn_13'], None
+
+        logger.warning("Ignoring '%s' change event", operation)
+        return None
+
+
+    def _claim_repairs(self):
+        """
+        Reads a batch of queued repairs.
+
+        Returns:
+            list: (operation, isbn_13, book) tuples. Upserts of books that no longer exist become deletes.
+        """
+        try:
+            repairs = list(self._db.index_repairs.find().limit(self._batch_size))
+            upserts = [repair['_id'] for repair in repairs if repair['op'] == 'upsert']
+            books = {book['isbn_13']: book for book in self._db.books.find({'isbn_13': {'$in': upserts}})} if upserts else {}
+        except PyMongoError as e:
+            logger.warning("Failed to read queued index repairs: %s", e)
+            return []
+
+        if repairs:
+            logger.info("Applying %s queued index repairs", len(repairs))
+        return [
+            ('upsert', repair['_id'], books[repair['_id']]) if repair['_id'] in books else ('delete', repair['_id'], None)
+            for repair in repairs
+        ]
+
+
+    @staticmethod
+    def enqueue_repairs(db, repairs):
+        """
+        Queues repairs for the indexer. A book's latest repair replaces any earlier one.
+
+        Args:
+            db: The MongoDB database containing the books collection.
+            repairs (list): (operation, isbn_13, reason) tuples, where the operation is 'upsert' or 'delete'.
+        """
+        if not repairs:
+            return
+        now = datetime.now(timezone.utc)
+        db.index_repairs.bulk_write([
+            ReplaceOne({'_id': isbn_13}, {'op': op, 'reason': reason, 'enqueued_at': now}, upsert=True)
+            for op, isbn_13, reason in repairs
+        ], ordered=False)
+
+
+    def _flush(self, pending, checkpoint, stop_event):
+        """
+        Applies a batch of changes and stores the checkpoint. Changes that keep failing are dead-lettered.
+        """
+        logger.info("Flushing %s changes", len(pending))
+        failed = self._apply(pending, self._max_retries, stop_event)
+        if failed is None:
+            # Do not store the checkpoint, so the batch is reprocessed on restart
+            return
+        if failed:
+            self._dead_letter(failed)
+
+        for invalidate in self._invalidators:
+            try:
+                invalidate(list(pending))
+            except Exception as e:
+                logger.exception("Cache invalidation failed: %s", e)
+
+        try:
+            self._db.index_repairs.delete_many({'_id': {'$in': list(pending)}})
+            # A batch of only repairs has no checkpoint
+            if checkpoint is not None:
+                self._db.indexer_state.update_one({'_id': self.STATE_ID}, {'$set': checkpoint}, upsert=True)
+        except PyMongoError as e:
+            logger.exception("Failed to store indexer checkpoint: %s", e)
+
+
+    def _apply(self, changes, retries, stop_event):
+        """
+        Applies changes, retrying with backoff. If they still fail, they are split in halves that are applied once
+        each, as the failure is then likely caused by a few books, e.g. an input the model cannot embed.
+
+        Args:
+            changes (dict): (operation, book) pairs keyed by ISBN-13.
+            retries (int): The number of retries before splitting.
+            stop_event (threading.Event): Event that stops the retries once set.
+
+        Returns:
+            dict: The (operation, book, error) of each change that failed on its own, keyed by ISBN-13.
+                None if the indexer was stopped.
+        """
+        upserts = [book for op, book in changes.values() if op == 'upsert']
+        deletes = [isbn_13 for isbn_13, (op, _) in changes.items() if op == 'delete']
+
+        delay = 1
+        for attempt in range(retries + 1):
+            try:
+                self._vectors.upsert_books(upserts)
+                self._vectors.delete_books(deletes)
+                return {}
+            except Exception as e:
+                error = e
+                if attempt == retries:
+                    break
+                logger.exception("Failed to apply indexer batch, retrying in %s seconds: %s", delay, e)
+                if stop_event.wait(delay):
+                    return None
+                delay = min(delay * 2, 60)
+
+        if len(changes) == 1:
+            isbn_13, (op, book) = next(iter(changes.items()))
+            return {isbn_13: (op, book, error)}
+
+        logger.warning("Indexer batch of %s changes failed after %s retries, splitting it: %s", len(changes), retries, error)
+        items = list(changes.items())
+        failed = {}
+        for half in (dict(items[:len(items) // 2]), dict(items[len(items) // 2:])):
+            half_failed = self._apply(half, 0, stop_event)
+            if half_failed is None:
+                return None
+            failed.update(half_failed)
+        return failed
+
+
+    def _dead_letter(self, failed):
+        """
+        Records the changes that failed on their own in the index_dead_letters collection.
+
+        Args:
+            failed (dict): The (operation, book, error) of each failed change, keyed by ISBN-13.
+        """
+        for isbn_13, (op, _, error) in failed.items():
+            logger.error("Dead-lettering %s of %s: %s", op, isbn_13, error)
+        now = datetime.now(timezone.utc)
+        try:
+            self._db.index_dead_letters.bulk_write([
+                ReplaceOne({'_id': isbn_13}, {'op': op, 'error': repr(error), 'failed_at': now}, upsert=True)
+                for isbn_13, (op, _, error) in failed.items()
+            ], ordered=False)
+        except PyMongoError as e:
+            logger.exception("Failed to store indexer dead letters: %s", e)
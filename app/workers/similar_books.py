@@ -0,0 +1,227 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import numpy as np
+from pymongo import DeleteOne, ReplaceOne
+from utils.logger import logger
+
+class SimilarBooksJob:
+    """
+    SimilarBooksJob precomputes the nearest neighbours of every book in a LocalVectorIndex and stores them in the
+    similar_books collection, so a "more like this" lookup is a single read by _id.
+
+    Scores are computed with blocked matrix multiplication: row blocks of the vector matrix are multiplied with
+    the whole matrix on a thread pool, as numpy releases the GIL in matmul and the top-N partition. The block
+    size is bounded by a memory budget per worker.
+
+    Runs are incremental. Each stored document keeps a hash of the vector it was computed from, so only books
+    whose vector changed, books that lost a neighbour (changed or deleted), and books a changed book now ranks
+    among the neighbours of are updated.
+    """
+
+    def __init__(self, db, index, top_n=50, workers=None, block_bytes=64 * 1024 * 1024, full_threshold=0.25,
+                 write_batch_size=1000):
+        """
+        Initializes the SimilarBooksJob.
+
+        Args:
+            db: The MongoDB database to store the similar_books collection in.
+            index (LocalVectorIndex): The index to read the vectors from.
+            top_n (int): The number of neighbours stored per book.
+            workers (int): The number of threads multiplying blocks. Defaults to the number of CPUs.
+            block_bytes (int): The memory budget for the score matrix of one block.
+            full_threshold (float): The fraction of changed vectors above which every book is recomputed.
+            write_batch_size (int): The maximum number of documents written in one bulk write.
+        """
+        self._db = db
+        self._index = index
+        self._top_n = top_n
+        self._workers = workers or os.cpu_count() or 1
+        self._block_bytes = block_bytes
+        self._full_threshold = full_threshold
+        self._write_batch_size = write_batch_size
+
+
+    def run(self, full=False):
+        """
+        Brings the stored neighbours up to date with the index.
+
+        Args:
+            full (bool): Flag to recompute every book, ignoring the stored vector hashes.
+
+        Returns:
+            dict: The number of recomputed, merged and deleted documents.
+        """
+        self._db.similar_books.create_index([('neighbours.isbn_13', 1)])
+        ids, vectors = self._index.snapshot()
+        hashes = [hashlib.blake2b(vector.tobytes(), digest_size=8).hexdigest() for vector in vectors]
+        positions = {isbn_13: position for position, isbn_13 in enumerate(ids)}
+
+        stored = {
+            doc['_id']: (doc.get('vector_hash'), doc.get('kth_score'))
+            for doc in self._db.similar_books.find({}, {'vector_hash': 1, 'kth_score': 1})
+        }
+        deleted = [isbn_13 for isbn_13 in stored if isbn_13 not in positions]
+        changed = [position for position, isbn_13 in enumerate(ids) if stored.get(isbn_13, (None,))[0] != hashes[position]]
+
+        full = full or len(changed) > self._full_threshold * len(ids)
+        if full:
+            logger.info("Recomputing the neighbours of all %s books", len(ids))
+            recompute, merge = np.arange(len(ids)), {}
+        else:
+            # Books that lost a neighbour cannot be merged, as the next best neighbour is unknown
+            removed = [ids[position] for position in changed if ids[position] in stored] + deleted
+            lost = set(changed)
+            for start in range(0, len(removed), self._write_batch_size):
+                chunk = removed[start:start + self._write_batch_size]
+                for doc in self._db.similar_books.find({'neighbours.isbn_13': {'$in': chunk}}, {'_id': 1}):
+                    if doc['_id'] in positions:
+                        lost.add(positions[doc['_id']])
+            recompute = np.array(sorted(lost), dtype=int)
+            merge = self._entering_neighbours(ids, vectors, changed, stored, lost)
+            logger.info("Updating neighbours: %s changed vectors, %s deleted, %s to recompute, %s to merge",
+                        len(changed), len(deleted), len(recompute), len(merge))
+
+        recomputed = self._recompute(ids, vectors, hashes, recompute)
+        merged = self._merge(ids, hashes, merge)
+        self._write([DeleteOne({'_id': isbn_13}) for isbn_13 in deleted])
+        return {'recomputed': recomputed, 'merged': merged, 'deleted': len(deleted)}
+
+
+    def _top_neighbours(self, vectors, rows):
+        """
+        Computes the top-N neighbours of a block of rows against every vector.
+
+        Returns:
+            tuple: The positions and scores of the neighbours of each row, best first.
+        """
+        scores = vectors[rows] @ vectors.T
+        # A book is not its own neighbour
+        scores[np.arange(len(rows)), rows] = -np.inf
+        k = min(self._top_n, len(vectors) - 1)
+        if k <= 0:
+            return np.zeros((len(rows), 0), dtype=int), np.zeros((len(rows), 0), dtype=np.float32)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+    def _recompute(self, ids, vectors, hashes, rows):
+        """
+        Computes and stores the neighbours of the given rows, one block per task.
+
+        Returns:
+            int: The number of stored documents.
+        """
+        if not len(rows):
+            return 0
+        block_size = max(1, self._block_bytes // (4 * len(ids)))
+        blocks = [rows[start:start + block_size] for start in range(0, len(rows), block_size)]
+        now = datetime.now(timezone.utc)
+
+        # BLAS would otherwise start its own threads in every worker
+        limits = _limit_blas_threads() if self._workers > 1 else None
+        try:
+            with ThreadPoolExecutor(max_workers=self._workers) as executor:
+                # Tasks only return the top-N of their block, so the score matrices are freed as blocks finish
+                for block, (neighbours, scores) in zip(blocks, executor.map(lambda block: self._top_neighbours(vectors, block), blocks)):
+                    self._write([
+                        ReplaceOne({'_id': ids[row]}, self._document(ids, hashes[row], positions, values, now), upsert=True)
+                        for row, positions, values in zip(block, neighbours, scores)
+                    ])
+        finally:
+            if limits is not None:
+                limits.restore_original_limits()
+        return len(rows)
+
+
+    def _entering_neighbours(self, ids, vectors, changed, stored, excluded):
+        """
+        Finds the changed books that now rank among the stored neighbours of other books.
+
+        Returns:
+            dict: The (isbn_13, score) candidates of each row that has any, keyed by row position.
+        """
+        if not changed:
+            return {}
+
+        # The score a candidate must beat for each row. Rows that are recomputed anyway take no candidates
+        thresholds = np.full(len(ids), np.inf, dtype=np.float32)
+        for row, isbn_13 in enumerate(ids):
+            if row not in excluded and isbn_13 in stored:
+                kth_score = stored[isbn_13][1]
+                thresholds[row] = -np.inf if kth_score is None else kth_score
+
+        merge = {}
+        changed = np.array(changed, dtype=int)
+        block_size = max(1, self._block_bytes // (4 * len(changed)))
+        for start in range(0, len(ids), block_size):
+            scores = vectors[start:start + block_size] @ vectors[changed].T
+            # A book is not its own neighbour
+            own = changed - start
+            inside = (own >= 0) & (own < len(scores))
+            scores[own[inside], np.nonzero(inside)[0]] = -np.inf
+            for offset, column in zip(*np.nonzero(scores > thresholds[start:start + len(scores), None])):
+                merge.setdefault(start + offset, []).append((ids[changed[column]], float(scores[offset, column])))
+        return merge
+
+
+    def _merge(self, ids, hashes, merge):
+        """
+        Merges entering neighbours into the stored neighbours of the given rows.
+
+        Returns:
+            int: The number of updated documents.
+        """
+        rows = list(merge)
+        now = datetime.now(timezone.utc)
+        for start in range(0, len(rows), self._write_batch_size):
+            chunk = rows[start:start + self._write_batch_size]
+            docs = {doc['_id']: doc for doc in self._db.similar_books.find({'_id': {'$in': [ids[row] for row in chunk]}})}
+            operations = []
+            for row in chunk:
+                neighbours = {neighbour['isbn_13']: neighbour['score'] for neighbour in docs[ids[row]]['neighbours']}
+                neighbours.update(merge[row])
+                ranked = sorted(neighbours.items(), key=lambda item: -item[1])[:self._top_n]
+                operations.append(ReplaceOne({'_id': ids[row]}, {
+                    'neighbours': [{'isbn_13': isbn_13, 'score': score} for isbn_13, score in ranked],
+                    'kth_score': ranked[-1][1] if len(ranked) >= self._top_n else None,
+                    'vector_hash': hashes[row],
+                    'computed_at': now
+                }))
+            self._write(operations)
+        return len(rows)
+
+
+    def _document(self, ids, vector_hash, positions, scores, now):
+        """
+        Returns the similar_books document of a book.
+        'kth_score' is the lowest stored score when the list is full, which a book must beat to enter it.
+        """
+        return {
+            'neighbours': [{'isbn_13': ids[position], 'score': float(score)} for position, score in zip(positions, scores)],
+            'kth_score': float(scores[-1]) if len(scores) >= self._top_n else None,
+            'vector_hash': vector_hash,
+            'computed_at': now
+        }
+
+
+    def _write(self, operations):
+        for start in range(0, len(operations), self._write_batch_size):
+            self._db.similar_books.bulk_write(operations[start:start + self._write_batch_size], ordered=False)
+
+
+def _limit_blas_threads():
+    """
+    Limits BLAS to one thread if threadpoolctl is installed.
+
+    Returns:
+        The limiter to unregister afterwards, or None.
+    """
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return None
+    return threadpool_limits(1)
@@ -0,0 +1,363 @@
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime, timezone
+import numpy as np
+from bson import ObjectId, json_util
+from utils.logger import logger
+
+FORMAT_VERSION = 1
+
+BOOKS_FILE = 'books.parquet'
+EMBEDDINGS_FILE = 'embeddings.bin'
+EMBEDDING_IDS_FILE = 'embedding_ids.txt'
+MANIFEST_FILE = 'manifest.json'
+
+# BookIndexer.STATE_ID, not imported so snapshots do not load the embedding model's dependencies
+INDEXER_STATE_ID = 'books'
+
+# Embeddings are stored as a raw little-endian block, so they can be memory-mapped on import
+VECTOR_DTYPES = {'float32': '<f4', 'float16': '<f2'}
+
+# Book fields stored as typed columns. Any other field, or a value not of its column's type (e.g. a
+# published_year stored as '1999'), is kept in the JSON 'extra' column.
+BOOK_COLUMNS = {
+    '_id': 'string',
+    'isbn_13': 'string',
+    'title': 'string',
+    'author': 'string',
+    'description': 'string',
+    'category': 'string',
+    'format': 'string',
+    'length': 'string',
+    'published_year': 'int64',
+    'rating': 'float64',
+    'thumbnail': 'string',
+    'updated_at': 'timestamp'
+}
+
+
+class SnapshotError(Exception):
+    """
+    Raised when a snapshot is incomplete, corrupt, or of an unsupported version.
+    """
+
+
+def export_snapshot(db, index, path, vector_dtype='float32', batch_size=10000, metadata=None):
+    """
+    Writes a versioned snapshot of the books collection and the vector index to a directory.
+
+    The snapshot holds:
+    - books.parquet: the book metadata, one row group per batch;
+    - embeddings.bin: every vector as one contiguous (count, dimension) float32 or float16 block;
+    - embedding_ids.txt: the id of every row of the block, one per line;
+    - manifest.json: the format version, counts, vector dtype and dimension, the given metadata (e.g. the
+      embedding model and retrieval mode) and the SHA-256 of every file.
+    The snapshot is written to a temporary directory that is renamed once complete, so a failed export never
+    leaves a snapshot that looks valid.
+
+    Args:
+        db: The MongoDB database containing the books collection.
+        index: The vector index (a LocalVectorIndex, or Pinecone with a paginated list method).
+        path (str): The directory to write the snapshot to. Must not exist.
+        vector_dtype (str): 'float32', or 'float16' to halve the size of the embeddings.
+        batch_size (int): The number of books, and of vectors fetched from a remote index, per batch.
+        metadata (dict): Extra fields recorded in the manifest.
+
+    Returns:
+        dict: The manifest.
+
+    Raises:
+        ValueError: If vector_dtype is not supported.
+        FileExistsError: If path already exists.
+    """
+    if vector_dtype not in VECTOR_DTYPES:
+        raise ValueError(f"Unsupported vector dtype: {vector_dtype}")
+    if os.path.exists(path):
+        raise FileExistsError(f"Snapshot directory already exists: {path}")
+    pa, pq = _import_pyarrow()
+
+    tmp_path = f"{path.rstrip(os.sep)}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    try:
+        schema = _books_schema(pa)
+        book_count = 0
+        with pq.ParquetWriter(os.path.join(tmp_path, BOOKS_FILE), schema, compression='zstd') as writer:
+            for books in _batches(db.books.find({}).sort('isbn_13', 1).batch_size(batch_size), batch_size):
+                writer.write_table(pa.Table.from_pylist([_to_row(book) for book in books], schema=schema))
+                book_count += len(books)
+        logger.info("Exported %s books", book_count)
+
+        vector_count, dimension = 0, None
+        with open(os.path.join(tmp_path, EMBEDDINGS_FILE), 'wb') as embeddings, \
+                open(os.path.join(tmp_path, EMBEDDING_IDS_FILE), 'w') as embedding_ids:
+            for ids, vectors in _vector_batches(index, batch_size):
+                if dimension is None:
+                    dimension = vectors.shape[1]
+                elif vectors.shape[1] != dimension:
+                    raise SnapshotError(f"Vector dimension {vectors.shape[1]} does not match {dimension}")
+                embeddings.write(np.ascontiguousarray(vectors, dtype=VECTOR_DTYPES[vector_dtype]).tobytes())
+                embedding_ids.writelines(f"{id}\n" for id in ids)
+                vector_count += len(ids)
+        logger.info("Exported %s vectors of dimension %s as %s", vector_count, dimension, vector_dtype)
+
+        manifest = {
+            'format_version': FORMAT_VERSION,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'book_count': book_count,
+            'vectors': {'dtype': vector_dtype, 'dimension': dimension or 0, 'count': vector_count},
+            'metadata': metadata or {},
+            'files': {
+                name: {'sha256': _sha256(os.path.join(tmp_path, name)), 'bytes': os.path.getsize(os.path.join(tmp_path, name))}
+                for name in (BOOKS_FILE, EMBEDDINGS_FILE, EMBEDDING_IDS_FILE)
+            }
+        }
+        with open(os.path.join(tmp_path, MANIFEST_FILE), 'w') as file:
+            json.dump(manifest, file, indent=4)
+        os.replace(tmp_path, path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    return manifest
+
+
+def verify_snapshot(path):
+    """
+    Checks that a snapshot is complete and that no file was modified since it was exported.
+
+    Args:
+        path (str): The snapshot directory.
+
+    Returns:
+        dict: The manifest.
+
+    Raises:
+        SnapshotError: If the manifest is missing or of an unsupported version, or a file is missing, has the
+            wrong size or checksum, or does not hold the number of vectors in the manifest.
+    """
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        raise SnapshotError(f"No snapshot manifest in {path}")
+    with open(manifest_path, 'r') as file:
+        manifest = json.load(file)
+    if manifest.get('format_version') != FORMAT_VERSION:
+        raise SnapshotError(f"Unsupported snapshot format version {manifest.get('format_version')}, expected {FORMAT_VERSION}")
+
+    for name, expected in manifest['files'].items():
+        file_path = os.path.join(path, name)
+        if not os.path.exists(file_path):
+            raise SnapshotError(f"Snapshot file {name} is missing")
+        # The size is checked first, as it is cheap and catches truncated copies
+        if os.path.getsize(file_path) != expected['bytes']:
+            raise SnapshotError(f"Snapshot file {name} has {os.path.getsize(file_path)} bytes, expected {expected['bytes']}")
+        if _sha256(file_path) != expected['sha256']:
+            raise SnapshotError(f"Snapshot file {name} does not match its checksum")
+
+    vectors = manifest['vectors']
+    expected_bytes = vectors['count'] * vectors['dimension'] * np.dtype(VECTOR_DTYPES[vectors['dtype']]).itemsize
+    if manifest['files'][EMBEDDINGS_FILE]['bytes'] != expected_bytes:
+        raise SnapshotError(f"{EMBEDDINGS_FILE} does not hold {vectors['count']} vectors of dimension {vectors['dimension']}")
+    return manifest
+
+
+def import_snapshot(db, index, path, replace=False, batch_size=10000):
+    """
+    Bulk-loads the books collection and the vector index from a snapshot, without embedding anything.
+
+    The snapshot is verified before anything is written. Books keep their _id, and the indexer's polling mark is
+    moved past the imported books, so the indexer does not re-embed them. A LocalVectorIndex is replaced with a
+    single write; other indexes are upserted in batches.
+
+    Args:
+        db: The MongoDB database to load the books collection into.
+        index: The vector index to load the vectors into.
+        path (str): The snapshot directory.
+        replace (bool): Flag to delete the existing books, similar books and vectors first. Otherwise the books
+            collection and the index must be empty.
+        batch_size (int): The number of books, and of vectors upserted to a remote index, per batch.
+
+    Returns:
+        dict: The manifest.
+
+    Raises:
+        SnapshotError: If the snapshot is invalid, or the target is not empty and replace is not set.
+    """
+    _, pq = _import_pyarrow()
+    manifest = verify_snapshot(path)
+
+    if not replace:
+        if db.books.estimated_document_count():
+            raise SnapshotError("The books collection is not empty, pass replace to overwrite it")
+        if index.describe_index_stats()['total_vector_count']:
+            raise SnapshotError("The vector index is not empty, pass replace to overwrite it")
+
+    # Memory-map the block, so only one batch at a time is converted for a remote index
+    vectors = manifest['vectors']
+    with open(os.path.join(path, EMBEDDING_IDS_FILE), 'r') as file:
+        ids = file.read().splitlines()
+    if len(ids) != vectors['count']:
+        raise SnapshotError(f"{EMBEDDING_IDS_FILE} holds {len(ids)} ids, expected {vectors['count']}")
+    embeddings = np.memmap(os.path.join(path, EMBEDDINGS_FILE), dtype=VECTOR_DTYPES[vectors['dtype']], mode='r',
+                           shape=(vectors['count'], vectors['dimension'])) if vectors['count'] else \
+        np.zeros((0, vectors['dimension']), dtype=np.float32)
+
+    if replace:
+        db.books.delete_many({})
+        db.similar_books.delete_many({})
+
+    mark = None
+    book_count = 0
+    for batch in pq.ParquetFile(os.path.join(path, BOOKS_FILE)).iter_batches(batch_size=batch_size):
+        books = [_from_row(row) for row in batch.to_pylist()]
+        db.books.insert_many(books, ordered=False)
+        book_count += len(books)
+        for book in books:
+            if isinstance(book.get('updated_at'), datetime) and (mark is None or (book['updated_at'], book['_id']) > mark):
+                mark = (book['updated_at'], book['_id'])
+    logger.info("Imported %s books", book_count)
+
+    if hasattr(index, 'restore'):
+        index.restore(ids, np.asarray(embeddings, dtype=np.float32))
+    else:
+        if replace:
+            index.delete(delete_all=True)
+        for start in range(0, len(ids), batch_size):
+            rows = np.asarray(embeddings[start:start + batch_size], dtype=np.float32)
+            index.upsert(vectors=list(zip(ids[start:start + batch_size], rows.tolist())))
+    logger.info("Imported %s vectors", len(ids))
+
+    # A stored change stream token refers to the writes that were just replaced
+    if mark is not None:
+        db.indexer_state.update_one(
+            {'_id': INDEXER_STATE_ID},
+            {'$set': {'updated_at_mark': mark[0], 'last_id': mark[1]}, '$unset': {'resume_token': ''}},
+            upsert=True
+        )
+    return manifest
+
+
+def _import_pyarrow():
+    """
+    Imports pyarrow, which is only needed for snapshots.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Snapshots require pyarrow: pip install pyarrow")
+    return pa, pq
+
+
+def _books_schema(pa):
+    """
+    Returns the Parquet schema of books.parquet.
+    """
+    types = {
+        'string': pa.string(),
+        'int64': pa.int64(),
+        'float64': pa.float64(),
+        'timestamp': pa.timestamp('ms', tz='UTC')
+    }
+    return pa.schema([(name, types[kind]) for name, kind in BOOK_COLUMNS.items()] + [('extra', pa.string())])
+
+
+def _to_row(book):
+    """
+    Converts a book document to a row of books.parquet. Values that do not fit their column go to 'extra' as is,
+    so the book is restored exactly.
+    """
+    row = dict.fromkeys(BOOK_COLUMNS)
+    extra = {}
+    for name, value in book.items():
+        if name == '_id' and isinstance(value, ObjectId):
+            row[name] = str(value)
+        elif name == '_id' and isinstance(value, str) and not ObjectId.is_valid(value):
+            row[name] = value
+        elif name != '_id' and name in BOOK_COLUMNS and _fits(value, BOOK_COLUMNS[name]):
+            row[name] = value
+        else:
+            extra[name] = value
+    # MongoDB returns naive datetimes in UTC
+    if isinstance(row['updated_at'], datetime) and row['updated_at'].tzinfo is None:
+        row['updated_at'] = row['updated_at'].replace(tzinfo=timezone.utc)
+    row['extra'] = json_util.dumps(extra) if extra else None
+    return row
+
+
+def _fits(value, kind):
+    """
+    Returns whether a value can be stored in a column of the given kind without changing its type.
+    """
+    if value is None:
+        return True
+    if kind == 'string':
+        return isinstance(value, str)
+    if kind == 'int64':
+        # bool is a subclass of int
+        return isinstance(value, int) and not isinstance(value, bool) and -2 ** 63 <= value < 2 ** 63
+    if kind == 'float64':
+        return isinstance(value, float)
+    if kind == 'timestamp':
+        return isinstance(value, datetime)
+    return False
+
+
+def _from_row(row):
+    """
+    Converts a row of books.parquet back to a book document. Missing fields are left out instead of stored as null.
+    """
+    extra = row.pop('extra')
+    book = {name: value for name, value in row.items() if value is not None}
+    # An _id that is not an ObjectId or a plain string is in 'extra'
+    if '_id' in book and ObjectId.is_valid(book['_id']):
+        book['_id'] = ObjectId(book['_id'])
+    if extra:
+        book.update(json_util.loads(extra))
+    return book
+
+
+def _vector_batches(index, batch_size):
+    """
+    Yields the ids and vectors of the index in batches, as (ids, (count, dimension) matrix) pairs.
+    """
+    if hasattr(index, 'snapshot'):
+        ids, vectors = index.snapshot()
+        for start in range(0, len(ids), batch_size):
+            yield ids[start:start + batch_size], vectors[start:start + batch_size]
+        return
+
+    for ids in _batches((id for page in index.list(limit=min(batch_size, 100)) for id in page), batch_size):
+        # Pinecone limits the number of ids per fetch
+        fetched = {}
+        for start in range(0, len(ids), 100):
+            fetched.update(index.fetch(ids=ids[start:start + 100])['vectors'])
+        ids = [id for id in ids if id in fetched]
+        if ids:
+            yield ids, np.asarray([fetched[id]['values'] for id in ids], dtype=np.float32)
+
+
+def _batches(iterable, size):
+    """
+    Yields lists of up to size items.
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _sha256(path, chunk_size=1024 * 1024):
+    """
+    Returns the SHA-256 hex digest of a file, read in chunks.
+    """
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
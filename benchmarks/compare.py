@@ -0,0 +1,69 @@
+import argparse
+import json
+
+# Metrics where a lower value is better; for the others (throughput) higher is better
+LOWER_IS_BETTER = {'p50_ms', 'p95_ms', 'p99_ms', 'mean_ms', 'max_ms', 'errors'}
+DEFAULT_METRICS = ['p50_ms', 'p95_ms', 'p99_ms', 'throughput']
+
+
+def compare_results(baseline_path, candidate_path, metrics=None, threshold=0.05):
+    """
+    Compares two benchmark results files and prints the relative change of every metric.
+
+    Args:
+        baseline_path (str): The results file to compare against.
+        candidate_path (str): The results file of the change being evaluated.
+        metrics (list): The metrics to compare.
+        threshold (float): Relative changes smaller than this are reported as unchanged.
+
+    Returns:
+        list: The names of the benchmarks that regressed beyond the threshold.
+    """
+    metrics = metrics or DEFAULT_METRICS
+    with open(baseline_path, 'r') as file:
+        baseline = json.load(file)
+    with open(candidate_path, 'r') as file:
+        candidate = json.load(file)
+
+    print(f"Baseline:  {baseline['metadata'].get('git_commit')} ({baseline['metadata'].get('timestamp')})")
+    print(f"Candidate: {candidate['metadata'].get('git_commit')} ({candidate['metadata'].get('timestamp')})")
+    for key in ('num_books', 'mongo', 's3', 'model', 'cpu_count'):
+        if baseline['metadata'].get(key) != candidate['metadata'].get(key):
+            print(f"Warning: runs differ in {key}: {baseline['metadata'].get(key)} vs {candidate['metadata'].get(key)}")
+
+    regressions = []
+    for name in sorted(set(baseline['benchmarks']) | set(candidate['benchmarks'])):
+        before, after = baseline['benchmarks'].get(name), candidate['benchmarks'].get(name)
+        if before is None or after is None:
+            print(f"{name:44} {'only in baseline' if after is None else 'only in candidate'}")
+            continue
+
+        changes = []
+        regressed = False
+        for metric in metrics:
+            old, new = before.get(metric), after.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = change > threshold if metric in LOWER_IS_BETTER else change < -threshold
+            regressed = regressed or worse
+            changes.append(f"{metric}={new:g} ({change:+.1%}{' !' if worse else ''})")
+
+        if regressed:
+            regressions.append(name)
+        print(f"{name:44} {'  '.join(changes)}")
+
+    print(f"{len(regressions)} regressions beyond {threshold:.0%}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare two benchmark results files.")
+    parser.add_argument('baseline', help="Results file to compare against")
+    parser.add_argument('candidate', help="Results file of the change being evaluated")
+    parser.add_argument('--metrics', nargs='+', default=DEFAULT_METRICS, help="Metrics to compare")
+    parser.add_argument('--threshold', type=float, default=0.05, help="Relative change reported as a regression")
+
+    args = parser.parse_args()
+    regressions = compare_results(args.baseline, args.candidate, metrics=args.metrics, threshold=args.threshold)
+    raise SystemExit(1 if regressions else 0)
@@ -0,0 +1,377 @@
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import time
+from datetime import datetime, timezone
+from itertools import product
+from multiprocessing import Pool
+import numpy as np
+from tqdm import tqdm
+from app.models.weighted_embedding_model import WeightedEmbeddingModel
+from utils.helpers import load_books, parse_field_weights
+from .load import summarize
+from .retrieval import QUANTIZATIONS, QuantizedIndex, bytes_per_vector, ndcg_at_k, normalize, recall_at_k
+from .run_benchmarks import DEFAULT_OUTPUT_DIR, git_commit
+
+DEFAULT_CACHE_DIR = 'data/.eval_cache'
+STAND_IN_MODEL = 'stand-in'
+
+# Weight vectors evaluated when none are given
+DEFAULT_WEIGHTS = {
+    'default': dict(WeightedEmbeddingModel.FIELD_WEIGHTS),
+    'uniform': {field: 1 for field in WeightedEmbeddingModel.FIELD_WEIGHTS},
+    'text_only': {'title': 2, 'author': 1, 'description': 4}
+}
+
+# Set in each worker process by _init_worker
+_worker_state = {}
+
+
+def evaluate_retrieval(books, queries, models, weights, quantizations, ann, ks=(1, 5, 10), workers=None,
+                       cache_dir=DEFAULT_CACHE_DIR, seed=0):
+    """
+    Evaluates the retrieval quality and latency of every combination of model, field weights, quantization and
+    ANN parameters on a labelled query set.
+
+    The per-field embeddings of the catalogue and the query embeddings are computed once per model and cached on
+    disk, so weights, quantization and ANN parameters can be swept without re-embedding anything. The
+    configurations are evaluated in parallel, each worker memory-mapping the cached embeddings.
+
+    Args:
+        books (list): The catalogue.
+        queries (list): The labelled queries, as {'query': str, 'relevant': [isbn_13, ...] or {isbn_13: grade}}.
+        models (list): The HF model names to evaluate, or 'stand-in' for the hashing stand-in.
+        weights (dict): Named field weight vectors. Fields that are left out get a weight of 0.
+        quantizations (list): The storage formats to evaluate: 'float32', 'float16' and/or 'int8'.
+        ann (list): (nlist, nprobe) pairs. (None, None) is exact search.
+        ks (tuple): The cutoffs to report recall at. nDCG is reported at the largest one.
+        workers (int): The number of processes to use. Defaults to the number of cores.
+        cache_dir (str): The directory the embeddings are cached in.
+        seed (int): The seed for the IVF clustering.
+
+    Returns:
+        list: The configuration and metrics of every evaluated combination.
+    """
+    isbns = [book['isbn_13'] for book in books]
+    labels = [
+        query['relevant'] if isinstance(query['relevant'], dict) else {isbn_13: 1 for isbn_13 in query['relevant']}
+        for query in queries
+    ]
+
+    cache = EmbeddingCache(cache_dir)
+    embeddings = {model_name: cache.embed(model_name, books, [query['query'] for query in queries]) for model_name in models}
+
+    configurations = [
+        {'model': model_name, 'weights': name, 'field_weights': weights[name], 'quantization': level, 'nlist': nlist, 'nprobe': nprobe}
+        for model_name, name, level, (nlist, nprobe) in product(models, weights, quantizations, ann)
+    ]
+
+    with Pool(processes=workers, initializer=_init_worker, initargs=(isbns, labels, embeddings, max(ks), ks, seed)) as pool:
+        results = list(tqdm(pool.imap(evaluate_configuration, configurations), total=len(configurations), desc="Evaluating configurations"))
+
+    for result in results:
+        result['embed_query_ms'] = embeddings[result['model']]['embed_query_ms']
+    return results
+
+
+def _init_worker(isbns, labels, embeddings, top_k, ks, seed):
+    """
+    Stores the shared evaluation inputs in a worker process.
+    """
+    # Workers run side by side, so each one gets a single BLAS thread to keep latencies comparable
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(1)
+    except ImportError:
+        pass
+
+    _worker_state.update(isbns=isbns, labels=labels, embeddings=embeddings, top_k=top_k, ks=ks, seed=seed)
+
+
+def evaluate_configuration(configuration):
+    """
+    Builds the index for one configuration and runs every labelled query against it.
+
+    Args:
+        configuration (dict): The model, field weights, quantization and ANN parameters.
+
+    Returns:
+        dict: The configuration with its mean recall@k and nDCG, search latency, storage size and build time.
+    """
+    isbns, labels, ks = _worker_state['isbns'], _worker_state['labels'], _worker_state['ks']
+    paths = _worker_state['embeddings'][configuration['model']]
+
+    # Dimensions: (books, num_fields, embedding_dim)
+    field_embeddings = np.load(paths['fields'], mmap_mode='r')
+    weights = np.array([configuration['field_weights'].get(field, 0) for field in WeightedEmbeddingModel.FIELD_WEIGHTS], dtype=np.float32)
+    weights /= weights.sum()
+
+    start = time.perf_counter()
+    vectors = normalize(np.einsum('bfd,f->bd', field_embeddings, weights)).astype(np.float32)
+    index = QuantizedIndex(vectors, configuration['quantization'], nlist=configuration['nlist'], seed=_worker_state['seed'])
+    build_seconds = time.perf_counter() - start
+
+    query_vectors = normalize(np.load(paths['queries']).astype(np.float32))
+    recalls, ndcgs, latencies = {k: [] for k in ks}, [], []
+    for query, relevant in zip(query_vectors, labels):
+        start = time.perf_counter()
+        positions = index.search(query, top_k=_worker_state['top_k'], nprobe=configuration['nprobe'] or 1)
+        latencies.append(time.perf_counter() - start)
+
+        ranked = [isbns[position] for position in positions]
+        for k in ks:
+            recalls[k].append(recall_at_k(ranked, relevant, k))
+        ndcgs.append(ndcg_at_k(ranked, relevant, max(ks)))
+
+    dimension = vectors.shape[1]
+    latency = summarize(latencies, sum(latencies))
+    return {
+        **configuration,
+        'name': configuration_name(configuration),
+        **{f"recall@{k}": round(float(np.mean(recalls[k])), 4) for k in ks},
+        f"ndcg@{max(ks)}": round(float(np.mean(ndcgs)), 4),
+        'search_p50_ms': latency['p50_ms'],
+        'search_p99_ms': latency['p99_ms'],
+        'dimension': dimension,
+        'bytes_per_vector': bytes_per_vector(dimension, configuration['quantization']),
+        'build_seconds': round(build_seconds, 3)
+    }
+
+
+def configuration_name(configuration):
+    ann = f"ivf{configuration['nlist']}x{configuration['nprobe']}" if configuration['nlist'] else 'exact'
+    return f"{configuration['model']}/{configuration['weights']}/{configuration['quantization']}/{ann}"
+
+
+class EmbeddingCache:
+    """
+    An on-disk cache of the per-field catalogue embeddings and query embeddings of each model.
+    Entries are keyed by the model and the exact texts that were encoded, so a changed catalogue is re-embedded.
+    """
+
+    def __init__(self, cache_dir):
+        """
+        Args:
+            cache_dir (str): The directory to store the embeddings in.
+        """
+        self._cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+
+    def embed(self, model_name, books, queries, chunk_size=1000):
+        """
+        Returns the cached embeddings of a catalogue and query set, computing the missing ones.
+
+        Args:
+            model_name (str): The HF model name, or 'stand-in'.
+            books (list): The catalogue.
+            queries (list): The query texts.
+            chunk_size (int): The number of books embedded at once.
+
+        Returns:
+            dict: The paths of the 'fields' (books, num_fields, dim) and 'queries' (queries, dim) .npy files,
+                and the median query embedding latency in milliseconds.
+        """
+        field_texts = [WeightedEmbeddingModel.field_text(book, field) for book in books for field in WeightedEmbeddingModel.FIELD_WEIGHTS]
+        fields_path = self._path(model_name, 'fields', field_texts)
+        queries_path = self._path(model_name, 'queries', queries)
+        metadata_path = f"{queries_path[:-len('.npy')]}.json"
+
+        if not os.path.exists(fields_path) or not os.path.exists(queries_path) or not os.path.exists(metadata_path):
+            model = load_model(model_name)
+
+            if not os.path.exists(fields_path):
+                chunks = [books[i:i + chunk_size] for i in range(0, len(books), chunk_size)]
+                field_embeddings = np.concatenate([
+                    model.embed_fields(chunk, WeightedEmbeddingModel.FIELD_WEIGHTS) for chunk in tqdm(chunks, desc=f"Embedding catalogue with {model_name}", unit="chunk")
+                ]).astype(np.float32)
+                self._save(fields_path, field_embeddings)
+
+            # Queries are embedded one at a time, as they are when served
+            latencies, query_embeddings = [], []
+            for query in queries:
+                start = time.perf_counter()
+                query_embeddings.append(model.embed_query(query))
+                latencies.append(time.perf_counter() - start)
+            self._save(queries_path, np.array(query_embeddings, dtype=np.float32))
+            with open(metadata_path, 'w') as file:
+                json.dump({'model': model_name, 'embed_query_ms': summarize(latencies, sum(latencies)).get('p50_ms')}, file)
+
+        with open(metadata_path, 'r') as file:
+            embed_query_ms = json.load(file)['embed_query_ms']
+        return {'fields': fields_path, 'queries': queries_path, 'embed_query_ms': embed_query_ms}
+
+
+    def _path(self, model_name, kind, texts):
+        digest = hashlib.sha256('\0'.join([model_name, *texts]).encode()).hexdigest()[:16]
+        return os.path.join(self._cache_dir, f"{model_name.replace('/', '_')}-{kind}-{digest}.npy")
+
+
+    @staticmethod
+    def _save(path, array):
+        """
+        Atomically writes an array, so an interrupted run never leaves a truncated cache entry.
+        """
+        tmp_path = f"{path}.tmp.npy"
+        np.save(tmp_path, array)
+        os.replace(tmp_path, path)
+
+
+def load_model(model_name):
+    """
+    Loads the embedding model for a model name.
+    """
+    if model_name == STAND_IN_MODEL:
+        from .stand_ins import StandInEmbeddingModel
+        return StandInEmbeddingModel()
+    return WeightedEmbeddingModel(model_name=model_name)
+
+
+def generate_known_item_queries(books, num_queries, seed=0, num_words=6):
+    """
+    Creates a labelled query set without manual judgements: each query is a run of words from one book's
+    description, and that book is the only relevant result. Good for comparing configurations against each
+    other, but not a substitute for real queries.
+
+    Args:
+        books (list): The catalogue.
+        num_queries (int): The number of queries to create.
+        seed (int): The seed for choosing the books and the words.
+        num_words (int): The number of words per query.
+
+    Returns:
+        list: The labelled queries.
+    """
+    rng = random.Random(seed)
+    queries = []
+    for book in rng.sample(books, min(num_queries, len(books))):
+        words = book['description'].split()
+        start = rng.randrange(max(1, len(words) - num_words))
+        queries.append({'query': ' '.join(words[start:start + num_words]), 'relevant': [book['isbn_13']]})
+    return queries
+
+
+def select_cheapest(results, metric, target):
+    """
+    Picks the configuration with the smallest vectors, then the fastest search, that meets a quality target.
+
+    Args:
+        results (list): The evaluated configurations.
+        metric (str): The metric the target applies to, e.g. 'recall@10'.
+        target (float): The minimum value of the metric.
+
+    Returns:
+        dict: The selected configuration, or None if no configuration meets the target.
+    """
+    candidates = [result for result in results if result[metric] >= target]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda result: (result['bytes_per_vector'], result['search_p50_ms'] + result['embed_query_ms']))
+
+
+def parse_weights(spec):
+    """
+    Parses a named weight vector given as 'name=title:2,author:2,description:4'.
+    """
+    name, _, fields = spec.partition('=')
+    try:
+        return name, WeightedEmbeddingModel.validate_weights(parse_field_weights(fields) or {})
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f"Invalid weights '{spec}': {e}")
+
+
+def parse_ann(spec):
+    """
+    Parses 'exact' or an IVF configuration given as 'ivf:<nlist>:<nprobe>'.
+    """
+    if spec == 'exact':
+        return None, None
+    try:
+        kind, nlist, nprobe = spec.split(':')
+        if kind != 'ivf':
+            raise ValueError
+        return int(nlist), int(nprobe)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"ANN parameters must be 'exact' or 'ivf:<nlist>:<nprobe>', got '{spec}'")
+
+
+def parse_target(spec):
+    """
+    Parses a quality target given as '<metric>=<value>', e.g. 'recall@10=0.9'.
+    """
+    metric, _, value = spec.partition('=')
+    try:
+        return metric, float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Target must be '<metric>=<value>', got '{spec}'")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Evaluate retrieval quality and latency of embedding configurations.")
+    parser.add_argument('--books-file', default='data/books.json', help="Catalogue (JSON or NDJSON)")
+    parser.add_argument('--queries-file', help="Labelled queries (JSON or NDJSON) with 'query' and 'relevant' ISBN-13s or {isbn_13: grade}")
+    parser.add_argument('--generate-queries', type=int, default=200, help="Number of known-item queries to generate if no queries file is given")
+    parser.add_argument('--models', nargs='+', default=[os.getenv('HF_MODEL_NAME') or STAND_IN_MODEL], help="HF model names, or 'stand-in'")
+    parser.add_argument('--weights', nargs='+', type=parse_weights, help="Weight vectors as 'name=title:2,author:2,description:4' (default: a few presets)")
+    parser.add_argument('--quantization', nargs='+', choices=list(QUANTIZATIONS), default=['float32'], help="Vector storage formats")
+    parser.add_argument('--ann', nargs='+', type=parse_ann, default=[(None, None)], help="'exact' or 'ivf:<nlist>:<nprobe>'")
+    parser.add_argument('--k', nargs='+', type=int, default=[1, 5, 10], help="Cutoffs for recall@k; nDCG uses the largest")
+    parser.add_argument('--target', type=parse_target, help="Quality target such as 'recall@10=0.9', to pick the cheapest configuration meeting it")
+    parser.add_argument('--workers', type=int, help="Number of processes (default: number of cores)")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help="Directory to cache embeddings in")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for generated queries and IVF clustering")
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR, help="Directory to write the results to")
+
+    args = parser.parse_args()
+
+    books = load_books(args.books_file)
+    queries = load_books(args.queries_file) if args.queries_file else generate_known_item_queries(books, args.generate_queries, seed=args.seed)
+    ks = sorted(set(args.k))
+
+    start = time.time()
+    results = evaluate_retrieval(
+        books,
+        queries,
+        args.models,
+        dict(args.weights) if args.weights else DEFAULT_WEIGHTS,
+        args.quantization,
+        args.ann,
+        ks=ks,
+        workers=args.workers,
+        cache_dir=args.cache_dir,
+        seed=args.seed
+    )
+
+    primary = f"recall@{ks[-1]}"
+    for result in sorted(results, key=lambda result: -result[primary]):
+        print(f"{result['name']:56} {primary}={result[primary]:.3f} ndcg@{ks[-1]}={result[f'ndcg@{ks[-1]}']:.3f} "
+              f"search p50={result['search_p50_ms']}ms embed p50={result['embed_query_ms']}ms {result['bytes_per_vector']} B/vector")
+
+    selected = None
+    if args.target:
+        metric, target = args.target
+        selected = select_cheapest(results, metric, target)
+        print(f"Cheapest configuration with {metric} >= {target}: {selected['name'] if selected else 'none'}")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    path = os.path.join(args.output_dir, f"retrieval-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}.json")
+    with open(path, 'w') as file:
+        json.dump({
+            'metadata': {
+                'timestamp': datetime.now(timezone.utc).isoformat(),
+                'git_commit': git_commit(),
+                'python': platform.python_version(),
+                'cpu_count': os.cpu_count(),
+                'num_books': len(books),
+                'num_queries': len(queries),
+                'queries': args.queries_file or f"{len(queries)} generated known-item queries",
+                'target': args.target and {'metric': args.target[0], 'value': args.target[1]}
+            },
+            'selected': selected and selected['name'],
+            'results': results
+        }, file, indent=4)
+    print(f"Results written to {path}")
+    print(f'Time elapsed: {time.time() - start} seconds')
@@ -0,0 +1,112 @@
+import asyncio
+import threading
+import time
+import aiohttp
+import numpy as np
+from werkzeug.serving import make_server
+
+
+class AppServer:
+    """
+    Serves a Flask app over HTTP from a background thread, so requests go through the full WSGI stack.
+    """
+
+    def __init__(self, app, host='127.0.0.1', port=0):
+        """
+        Args:
+            app (Flask): The app to serve.
+            host (str): The interface to bind to.
+            port (int): The port to bind to. A free port is picked if 0.
+        """
+        self._server = make_server(host, port, app, threaded=True)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+
+    @property
+    def url(self):
+        return f"http://{self._server.host}:{self._server.port}"
+
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._thread.join()
+
+
+async def run_scenario(base_url, make_request, num_requests, concurrency, warmup=10):
+    """
+    Sends requests from a fixed number of concurrent workers and measures the latency of each one.
+
+    Args:
+        base_url (str): The URL the app is served on.
+        make_request (callable): Returns the (method, path, json body) of the i-th request.
+        num_requests (int): The number of measured requests.
+        concurrency (int): The number of requests in flight at once.
+        warmup (int): The number of unmeasured requests sent first.
+
+    Returns:
+        dict: The latency percentiles in milliseconds, throughput in requests per second and error count.
+    """
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(base_url, connector=connector) as session:
+
+        async def send(i):
+            method, path, body = make_request(i)
+            start = time.perf_counter()
+            async with session.request(method, path, json=body) as response:
+                await response.read()
+                return time.perf_counter() - start, response.status < 400
+
+        for i in range(warmup):
+            await send(i)
+
+        latencies, errors = [], 0
+        next_request = iter(range(num_requests))
+
+        async def worker():
+            nonlocal errors
+            for i in next_request:
+                try:
+                    latency, ok = await send(i)
+                except aiohttp.ClientError:
+                    errors += 1
+                    continue
+                latencies.append(latency)
+                errors += not ok
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {**summarize(latencies, elapsed), 'errors': errors, 'concurrency': concurrency}
+
+
+def summarize(latencies, elapsed):
+    """
+    Summarizes a list of latencies in seconds.
+
+    Args:
+        latencies (list): The latency of every completed operation.
+        elapsed (float): The wall-clock time all of them took.
+
+    Returns:
+        dict: The count, p50/p95/p99/mean/max latency in milliseconds, and operations per second.
+    """
+    if not latencies:
+        return {'count': 0}
+
+    milliseconds = np.asarray(latencies) * 1000
+    p50, p95, p99 = np.percentile(milliseconds, [50, 95, 99])
+    return {
+        'count': len(latencies),
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'p99_ms': round(float(p99), 3),
+        'mean_ms': round(float(milliseconds.mean()), 3),
+        'max_ms': round(float(milliseconds.max()), 3),
+        'throughput': round(len(latencies) / elapsed, 2) if elapsed else None
+    }
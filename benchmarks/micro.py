@@ -0,0 +1,60 @@
+import asyncio
+import contextlib
+import io
+import os
+import time
+from .load import summarize
+
+
+def measure(function, repeat=5, warmup=1, setup=None):
+    """
+    Times repeated calls of a function.
+
+    Args:
+        function (callable): The function to time. Coroutine functions are run to completion on a fresh event loop.
+        repeat (int): The number of measured calls.
+        warmup (int): The number of unmeasured calls made first.
+        setup (callable): Called before every call, outside of the measurement (e.g. to clear a cache).
+
+    Returns:
+        dict: The latency summary of the calls.
+    """
+    def call():
+        result = function()
+        if asyncio.iscoroutine(result):
+            asyncio.run(result)
+
+    for _ in range(warmup):
+        if setup:
+            setup()
+        call()
+
+    latencies = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - start)
+    return summarize(latencies, sum(latencies))
+
+
+@contextlib.contextmanager
+def quiet(**environ):
+    """
+    Runs a script with extra environment variables, discarding what it prints.
+
+    Args:
+        **environ: The environment variables to set for the duration of the block.
+    """
+    previous = {key: os.environ.get(key) for key in environ}
+    os.environ.update({key: str(value) for key, value in environ.items()})
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+    finally:
+        for key, value in previous.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
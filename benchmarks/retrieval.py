@@ -0,0 +1,150 @@
+import math
+import numpy as np
+
+# Storage formats for document vectors, and their size per dimension in bytes
+QUANTIZATIONS = {'float32': 4, 'float16': 2, 'int8': 1}
+
+
+def normalize(vectors):
+    """
+    L2-normalizes the rows of a matrix, leaving zero rows untouched.
+    """
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def quantize(vectors, level):
+    """
+    Converts float32 vectors to a storage format.
+
+    Args:
+        vectors (np.ndarray): The normalized vectors, of shape (count, dimension).
+        level (str): 'float32', 'float16' or 'int8'. int8 uses a symmetric scale per vector.
+
+    Returns:
+        tuple: The stored codes, and the float32 scale of each vector (None unless int8).
+    """
+    if level == 'float32':
+        return vectors.astype(np.float32), None
+    if level == 'float16':
+        return vectors.astype(np.float16), None
+    if level == 'int8':
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1
+        codes = np.round(vectors / scales[:, None]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    raise ValueError(f"Unknown quantization: {level}")
+
+
+def bytes_per_vector(dimension, level):
+    """
+    Returns the storage size of one vector, including the int8 scale.
+    """
+    return dimension * QUANTIZATIONS[level] + (4 if level == 'int8' else 0)
+
+
+class QuantizedIndex:
+    """
+    An in-memory index over quantized vectors. With nlist set it is an IVF index: vectors are clustered with
+    spherical k-means and a query only scores the vectors of the nprobe closest clusters.
+    """
+
+    def __init__(self, vectors, level='float32', nlist=None, seed=0, iterations=10):
+        """
+        Args:
+            vectors (np.ndarray): The normalized float32 vectors, of shape (count, dimension).
+            level (str): The storage format of the vectors.
+            nlist (int): The number of IVF clusters. Every query scores every vector if not set.
+            seed (int): The seed for the k-means initialization.
+            iterations (int): The number of k-means iterations.
+        """
+        self._codes, self._scales = quantize(vectors, level)
+        self._lists = None
+        if nlist:
+            self._centroids, assignments = self._kmeans(vectors, min(nlist, len(vectors)), seed, iterations)
+            order = np.argsort(assignments, kind='stable')
+            bounds = np.searchsorted(assignments[order], np.arange(len(self._centroids) + 1))
+            self._lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(self._centroids))]
+
+
+    def search(self, query, top_k=10, nprobe=1):
+        """
+        Finds the positions of the vectors with the highest dot product with a normalized query.
+
+        Args:
+            query (np.ndarray): The normalized query vector.
+            top_k (int): The number of matches to return.
+            nprobe (int): The number of IVF clusters to score. Ignored for exact search.
+
+        Returns:
+            np.ndarray: The positions of the matches, best first.
+        """
+        if self._lists is None:
+            candidates = None
+            codes = self._codes
+        else:
+            closest = np.argpartition(-(self._centroids @ query), min(nprobe, len(self._lists)) - 1)[:nprobe]
+            candidates = np.concatenate([self._lists[i] for i in closest])
+            codes = self._codes[candidates]
+
+        # Codes are widened to float32 for scoring, as numpy has no low-precision dot products
+        scores = codes @ query.astype(np.float32)
+        if self._scales is not None:
+            scores = scores * (self._scales if candidates is None else self._scales[candidates])
+
+        k = min(top_k, len(scores))
+        if k == 0:
+            return np.array([], dtype=int)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return top if candidates is None else candidates[top]
+
+
+    @staticmethod
+    def _kmeans(vectors, nlist, seed, iterations):
+        """
+        Clusters normalized vectors by cosine similarity.
+
+        Returns:
+            tuple: The normalized centroids and the cluster of each vector.
+        """
+        rng = np.random.default_rng(seed)
+        centroids = vectors[rng.choice(len(vectors), size=nlist, replace=False)]
+        for _ in range(iterations):
+            assignments = np.argmax(vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, vectors)
+            # Empty clusters keep their previous centroid
+            empty = ~sums.any(axis=1)
+            sums[empty] = centroids[empty]
+            centroids = normalize(sums)
+        return centroids, np.argmax(vectors @ centroids.T, axis=1)
+
+
+def recall_at_k(ranked, relevant, k):
+    """
+    Returns the fraction of the relevant ids found in the top k.
+
+    Args:
+        ranked (list): The retrieved ids, best first.
+        relevant (dict): The graded relevance of each relevant id.
+        k (int): The cutoff.
+    """
+    if not relevant:
+        return 0.0
+    return len(set(ranked[:k]) & relevant.keys()) / len(relevant)
+
+
+def ndcg_at_k(ranked, relevant, k):
+    """
+    Returns the normalized discounted cumulative gain of the top k.
+
+    Args:
+        ranked (list): The retrieved ids, best first.
+        relevant (dict): The graded relevance of each relevant id.
+        k (int): The cutoff.
+    """
+    dcg = sum(relevant.get(id, 0) / math.log2(rank + 2) for rank, id in enumerate(ranked[:k]))
+    ideal = sum(gain / math.log2(rank + 2) for rank, gain in enumerate(sorted(relevant.values(), reverse=True)[:k]))
+    return dcg / ideal if ideal else 0.0
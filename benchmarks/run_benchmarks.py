@@ -0,0 +1,293 @@
+import argparse
+import asyncio
+import functools
+import http.server
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from io import BytesIO
+import numpy as np
+from .load import AppServer, run_scenario
+from .micro import measure, quiet
+from .stand_ins import StandInEmbeddingModel, create_benchmark_app, seed_catalogue
+
+DEFAULT_OUTPUT_DIR = 'benchmarks/results'
+SCENARIOS = ['list_books', 'get_book', 'update_book', 'search', 'suggest']
+EMBED_BATCH_SIZES = [1, 16, 64, 256]
+
+
+def run_benchmarks(args):
+    """
+    Brings up the app against local stand-ins, runs the load scenarios and micro-benchmarks, and writes the results.
+
+    Args:
+        args (argparse.Namespace): The parsed command line arguments.
+
+    Returns:
+        str: The path to the results JSON file.
+    """
+    # Request logs would dominate the output and the timings
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    os.environ.setdefault('TQDM_DISABLE', '1')
+
+    model = StandInEmbeddingModel() if not args.model else None
+    app, services = create_benchmark_app(mongo_uri=args.mongo_uri, s3_endpoint=args.s3_endpoint, model=model)
+    if model is None:
+        from app.models.weighted_embedding_model import WeightedEmbeddingModel
+        with app.app_context():
+            model = WeightedEmbeddingModel(model_name=args.model)
+        services['vectors'].set_model(model)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        books_file = args.books_file or generate_catalogue(work_dir, args)
+        from utils.helpers import load_books
+        books = load_books(books_file)
+        print(f"Seeding {len(books)} books")
+        seed_catalogue(app, services['vectors'], books, services['suggest'])
+
+        results = {}
+        if not args.skip_load:
+            results.update(run_load_benchmarks(app, books, args))
+        if not args.skip_micro:
+            results.update(run_micro_benchmarks(app, services, model, books, books_file, work_dir, args))
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    timestamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    path = os.path.join(args.output_dir, f"{timestamp}{'-' + args.label if args.label else ''}.json")
+    with open(path, 'w') as file:
+        json.dump({'metadata': collect_metadata(args, len(books)), 'benchmarks': results}, file, indent=4)
+    print(f"Results written to {path}")
+    return path
+
+
+def generate_catalogue(work_dir, args):
+    """
+    Generates a deterministic synthetic catalogue, so runs on different machines load the same books.
+
+    Returns:
+        str: The path to the NDJSON file.
+    """
+    from scripts.generate_synthetic_data import generate_synthetic_data
+    output_dir = os.path.join(work_dir, 'catalogue')
+    with quiet():
+        generate_synthetic_data(output_dir, args.num_books, seed=args.seed, shard_size=args.num_books,
+                                workers=1, thumbnails=bool(args.s3_endpoint))
+    return os.path.join(output_dir, 'books-00000.ndjson')
+
+
+def run_load_benchmarks(app, books, args):
+    """
+    Drives every scenario over HTTP at every concurrency level.
+
+    Returns:
+        dict: The latency summary of each scenario, keyed by 'load/<scenario>/c<concurrency>'.
+    """
+    rng = random.Random(args.seed)
+    isbns = [book['isbn_13'] for book in books]
+    pages = max(1, len(books) // args.page_size)
+    words = [word for book in books[:1000] for word in book['title'].split()]
+
+    requests = {
+        'list_books': lambda i: ('GET', f"/api/v1/books?page={rng.randint(1, pages)}&limit={args.page_size}", None),
+        'get_book': lambda i: ('GET', f"/api/v1/book/{rng.choice(isbns)}", None),
+        # Rating is not embedded, so this measures the write path without the model
+        'update_book': lambda i: ('PATCH', f"/api/v1/book/{rng.choice(isbns)}", {'rating': rng.randint(2, 10) / 2}),
+        'search': lambda i: ('GET', f"/api/v1/search?q={' '.join(rng.sample(words, 3))}&limit=10", None),
+        # Prefixes of one to four letters, as typed
+        'suggest': lambda i: ('GET', f"/api/v1/suggest?prefix={rng.choice(words)[:rng.randint(1, 4)]}", None)
+    }
+
+    results = {}
+    with AppServer(app) as server:
+        for scenario in args.scenarios:
+            for concurrency in args.concurrency:
+                stats = asyncio.run(run_scenario(server.url, requests[scenario], args.requests, concurrency))
+                results[f"load/{scenario}/c{concurrency}"] = stats
+                print(f"{scenario:12} c={concurrency:<3} p50={stats.get('p50_ms')}ms p99={stats.get('p99_ms')}ms "
+                      f"{stats.get('throughput')} req/s ({stats['errors']} errors)")
+    return results
+
+
+def run_micro_benchmarks(app, services, model, books, books_file, work_dir, args):
+    """
+    Times the embedding model, the presign path, the vector index, image processing and the scripts' loaders.
+
+    Returns:
+        dict: The latency summary of each benchmark, keyed by 'micro/<name>'.
+    """
+    results = {}
+
+    def record(name, stats):
+        results[f"micro/{name}"] = stats
+        print(f"{name:32} p50={stats.get('p50_ms')}ms mean={stats.get('mean_ms')}ms")
+
+    # WeightedEmbeddingModel.embed, with the field cache cleared (cold) and filled (warm)
+    for batch_size in EMBED_BATCH_SIZES:
+        batch = books[:batch_size]
+        record(f"embed/batch{batch_size}/cold", measure(lambda: model.embed(batch), repeat=args.repeat, setup=model.clear_cache))
+        record(f"embed/batch{batch_size}/warm", measure(lambda: model.embed(batch), repeat=args.repeat))
+    record("embed_query", measure(lambda: model.embed_query(books[0]['title']), repeat=args.repeat))
+
+    # Presign path
+    s3_service = services['s3']
+    keys = [book['thumbnail'] for book in app.db.books.find({}, {'thumbnail': 1}).limit(args.page_size)]
+    record("presign/single", measure(lambda: s3_service.fetch_presigned_url(keys[0]), repeat=args.repeat))
+    record(f"presign/batch{len(keys)}", measure(lambda: s3_service.fetch_presigned_urls(keys), repeat=args.repeat))
+
+    # Vector index query
+    index = services['vectors'].index
+    query = model.embed_query(books[0]['description'])
+    record("vector_index/query_top10", measure(lambda: index.query(vector=query, top_k=10), repeat=args.repeat))
+
+    # Suggest index, with the prefix cache cleared for every lookup
+    suggest_index = services['suggest']
+    prefixes = [word[:3] for word in books[0]['title'].split() if len(word) >= 2] or ['th']
+    record("suggest/prefix", measure(lambda: [suggest_index.suggest(prefix) for prefix in prefixes], repeat=args.repeat,
+                                     setup=suggest_index.clear_cache))
+
+    # Thumbnail renditions
+    from utils.images import create_renditions
+    image_data = sample_image()
+    record("create_renditions", measure(lambda: create_renditions(image_data), repeat=args.repeat))
+
+    # Loaders in scripts/
+    from utils.helpers import load_books
+    record("scripts/load_books", measure(lambda: load_books(books_file), repeat=args.repeat))
+
+    from scripts.generate_synthetic_data import generate_synthetic_data
+    with quiet():
+        stats = measure(
+            lambda: generate_synthetic_data(os.path.join(work_dir, 'generated'), len(books), seed=args.seed,
+                                            shard_size=len(books), workers=1),
+            repeat=1, warmup=0
+        )
+    record("scripts/generate_synthetic_data", stats)
+
+    from scripts.upload_to_pinecone import upload_data as upload_to_pinecone
+    with quiet(VECTOR_BACKEND='local', LOCAL_VECTOR_INDEX_PATH=os.path.join(work_dir, 'vectors.npz')):
+        stats = measure(lambda: upload_to_pinecone(books_file, model=model), repeat=1, setup=model.clear_cache)
+    record("scripts/upload_to_pinecone", stats)
+
+    if args.mongo_uri:
+        from pymongo import MongoClient
+        from scripts.upload_to_mongo import upload_data as upload_to_mongo
+        database = 'scifi_catalog_benchmark_loader'
+        with MongoClient(args.mongo_uri) as client, quiet(MONGO_URI=args.mongo_uri, MONGO_DB=database):
+            stats = measure(lambda: upload_to_mongo(books_file), repeat=1, setup=lambda: client.drop_database(database))
+            client.drop_database(database)
+        record("scripts/upload_to_mongo", stats)
+
+    if args.s3_endpoint:
+        record("scripts/upload_to_s3", benchmark_upload_to_s3(books_file, work_dir, args))
+
+    return results
+
+
+def benchmark_upload_to_s3(books_file, work_dir, args):
+    """
+    Times scripts/upload_to_s3.py against an S3 emulator, serving the synthetic thumbnails over local HTTP.
+    The first run uploads everything; the second run is timed too, and is expected to find everything unchanged.
+    """
+    import boto3
+    from scripts.upload_to_s3 import upload_data as upload_to_s3
+    from .stand_ins import BenchmarkConfig
+
+    s3_client = boto3.client(
+        's3',
+        endpoint_url=args.s3_endpoint,
+        region_name=BenchmarkConfig.AWS_REGION,
+        aws_access_key_id=BenchmarkConfig.AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=BenchmarkConfig.AWS_SECRET_ACCESS_KEY
+    )
+    try:
+        s3_client.create_bucket(Bucket=BenchmarkConfig.AWS_BUCKET_NAME)
+    except s3_client.exceptions.BucketAlreadyOwnedByYou:
+        pass
+
+    handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=os.path.dirname(books_file))
+    handler.log_message = lambda *args: None
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 8000), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with quiet(
+            AWS_ENDPOINT_URL=args.s3_endpoint,
+            AWS_BUCKET_NAME=BenchmarkConfig.AWS_BUCKET_NAME,
+            AWS_REGION=BenchmarkConfig.AWS_REGION,
+            AWS_ACCESS_KEY_ID=BenchmarkConfig.AWS_ACCESS_KEY_ID,
+            AWS_SECRET_ACCESS_KEY=BenchmarkConfig.AWS_SECRET_ACCESS_KEY
+        ):
+            manifest_path = os.path.join(work_dir, 'thumbnail_manifest.json')
+            return measure(lambda: upload_to_s3(books_file, manifest_path=manifest_path), repeat=2, warmup=0)
+    finally:
+        server.shutdown()
+
+
+def sample_image():
+    """
+    Returns a JPEG the size of a typical book cover.
+    """
+    from PIL import Image
+    pixels = np.random.default_rng(0).integers(0, 256, size=(600, 400, 3), dtype=np.uint8)
+    buffer = BytesIO()
+    Image.fromarray(pixels).save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def collect_metadata(args, num_books):
+    """
+    Describes the run, so results from different commits and machines can be told apart.
+    """
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'label': args.label,
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'num_books': num_books,
+        'mongo': 'mongod' if args.mongo_uri else 'mongomock',
+        's3': 'emulator' if args.s3_endpoint else 'local signing',
+        'model': args.model or 'stand-in',
+        'requests': args.requests,
+        'seed': args.seed
+    }
+
+
+def git_commit():
+    """
+    Returns the commit the benchmarks ran on, or None outside of a git checkout.
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the API and ingest paths against local stand-ins.")
+    parser.add_argument('--num-books', type=int, default=2000, help="Number of synthetic books to seed")
+    parser.add_argument('--books-file', help="Seed from a book JSON/NDJSON file instead of a synthetic catalogue")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the catalogue and the request mix")
+    parser.add_argument('--mongo-uri', help="URI of a local mongod (default: in-memory mongomock)")
+    parser.add_argument('--s3-endpoint', help="URL of a local S3 emulator (default: presigned URLs are only signed)")
+    parser.add_argument('--model', help="HF model to embed with (default: a hashing stand-in, so the app is measured rather than the model)")
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS, help="Load scenarios to run")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32], help="Concurrency levels")
+    parser.add_argument('--requests', type=int, default=500, help="Measured requests per scenario and concurrency level")
+    parser.add_argument('--page-size', type=int, default=20, help="Page size for GET /books and the presign batch")
+    parser.add_argument('--repeat', type=int, default=20, help="Measured calls per micro-benchmark")
+    parser.add_argument('--skip-load', action='store_true', help="Skip the load scenarios")
+    parser.add_argument('--skip-micro', action='store_true', help="Skip the micro-benchmarks")
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR, help="Directory to write the results to")
+    parser.add_argument('--label', help="Label added to the results file name")
+
+    start = time.time()
+    run_benchmarks(parser.parse_args())
+    print(f'Time elapsed: {time.time() - start} seconds')
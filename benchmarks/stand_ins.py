@@ -0,0 +1,128 @@
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timezone
+import numpy as np
+from app import create_app
+from app.config import Config
+from app.models.weighted_embedding_model import WeightedEmbeddingModel
+from utils.helpers import generate_s3_key
+
+
+class BenchmarkConfig(Config):
+    """
+    Configuration for running the app against local stand-ins instead of the hosted services.
+    """
+    MONGO_URI = 'mongodb://localhost:27017'
+    MONGO_DB = 'scifi_catalog_benchmark'
+
+    # Presigned URLs are signed locally, so dummy credentials are enough unless an S3 emulator is used
+    AWS_BUCKET_NAME = 'benchmark-thumbnails'
+    AWS_REGION = 'us-east-1'
+    AWS_ACCESS_KEY_ID = 'benchmark'
+    AWS_SECRET_ACCESS_KEY = 'benchmark'
+    AWS_ENDPOINT_URL = None
+
+    # In-memory local vector index
+    VECTOR_BACKEND = 'local'
+    LOCAL_VECTOR_INDEX_PATH = None
+
+    INDEX_ON_WRITE = True
+
+
+class HashingEncoder:
+    """
+    A stand-in for SentenceTransformer that maps every text to a fixed pseudo-random unit vector.
+    It costs almost nothing, so API benchmarks measure the app rather than the model.
+    """
+
+    def __init__(self, dimension=384):
+        self.dimension = dimension
+
+
+    def encode(self, sentences, device=None, batch_size=32, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else sentences
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+        for i, text in enumerate(texts):
+            vector = np.random.default_rng(zlib.crc32(text.encode())).standard_normal(self.dimension)
+            embeddings[i] = vector / np.linalg.norm(vector)
+        return embeddings[0] if single else embeddings
+
+
+class StandInEmbeddingModel(WeightedEmbeddingModel):
+    """
+    A WeightedEmbeddingModel backed by the HashingEncoder instead of a SentenceTransformer.
+    Weighting, caching and batching are the real implementation.
+    """
+
+    def __init__(self, dimension=384, batch_size=64, cache_size=10000, weights=None):
+        self._device = 'cpu'
+        self._model = HashingEncoder(dimension)
+        self._batch_size = batch_size
+
+        self._cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+        self._weights = self.validate_weights(weights or self.FIELD_WEIGHTS)
+        self._normalize_weights()
+
+
+def create_benchmark_app(mongo_uri=None, s3_endpoint=None, model=None):
+    """
+    Creates the app against local stand-ins.
+
+    Args:
+        mongo_uri (str): The URI of a local mongod. An in-memory mongomock client is used if not set.
+        s3_endpoint (str): The URL of a local S3 emulator. Presigned URLs are only signed locally if not set.
+        model (WeightedEmbeddingModel): The model used to embed books and queries. Defaults to HF_MODEL_NAME.
+
+    Returns:
+        tuple: The Flask app and a dict of the blueprint's 'books', 'vectors', 's3' and 'suggest' services.
+    """
+    config = type('Config', (BenchmarkConfig,), {
+        'MONGO_URI': mongo_uri or BenchmarkConfig.MONGO_URI,
+        'AWS_ENDPOINT_URL': s3_endpoint
+    })
+
+    mongo_client = None
+    if not mongo_uri:
+        try:
+            import mongomock
+        except ImportError:
+            raise SystemExit("Running without --mongo-uri requires mongomock: pip install -r requirements-bench.txt")
+        mongo_client = mongomock.MongoClient()
+
+    app = create_app(config, mongo_client=mongo_client)
+
+    from app.api import books
+    if model is not None:
+        books.vector_service.set_model(model)
+    return app, {
+        'books': books.book_service,
+        'vectors': books.vector_service,
+        's3': books.s3_service,
+        'suggest': books.suggest_index
+    }
+
+
+def seed_catalogue(app, vector_service, books, suggest_index=None):
+    """
+    Loads books into the database and the vector index, the same way the scripts do.
+
+    Args:
+        app (Flask): The benchmark app.
+        vector_service (VectorService): The blueprint's VectorService.
+        books (list): The books to load.
+        suggest_index (SuggestIndex): The blueprint's SuggestIndex, rebuilt from the loaded books if passed.
+    """
+    now = datetime.now(timezone.utc)
+    documents = [{**book, 'thumbnail': generate_s3_key(book), 'updated_at': now} for book in books]
+
+    app.db.books.delete_many({})
+    app.db.books.insert_many(documents)
+    vector_service.index.delete(delete_all=True)
+    vector_service.upsert_books(documents)
+    if suggest_index is not None:
+        suggest_index.build(documents)
@@ -10,7 +10,9 @@ if __name__ == '__main__':
     # Setup logger
     setup_logger(
         log_level=getattr(logging, os.getenv('LOG_LEVEL')),
-        log_file=os.getenv('LOG_FILE')
+        log_file=os.getenv('LOG_FILE'),
+        log_format=os.getenv('LOG_FORMAT', 'text'),
+        debug_sample_rate=float(os.getenv('LOG_DEBUG_SAMPLE_RATE', 1.0))
     )
 
     app = create_app(Config)
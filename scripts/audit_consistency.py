@@ -0,0 +1,144 @@
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
+import time
+import boto3
+from pymongo import MongoClient
+from app.catalogues import catalogue_config
+from app.config import Config
+from app.services.vector_service import create_vector_index
+from app.workers.consistency_auditor import GAP_KINDS, ConsistencyAuditor
+from app.workers.indexer import BookIndexer
+from scripts.upload_to_s3 import DEFAULT_MANIFEST_PATH, ThumbnailManifest
+from utils.logger import setup_logger, logging
+import os
+
+# The indexer operation that repairs each kind of vector gap
+VECTOR_REPAIRS = {'missing_vector': 'upsert', 'orphaned_vector': 'delete'}
+THUMBNAIL_REPAIRS = ('missing_thumbnail', 'missing_renditions')
+
+
+def audit_consistency(check_s3=True, check_vectors=True, output_dir=None, repair=False, batch_size=1000,
+                      manifest_path=DEFAULT_MANIFEST_PATH, catalogue=None):
+    """
+    Checks that MongoDB, S3 and the vector index hold the same books, and optionally queues repairs.
+
+    Repairs are written in batches as the audit runs:
+    - missing and orphaned vectors are queued in index_repairs, for the indexer to embed or delete;
+    - books of the default catalogue with missing thumbnails or renditions are removed from the thumbnail
+      manifest, so the next upload_to_s3.py run uploads them again.
+    Orphaned thumbnails are only reported. The output file can be passed to erase_data.py --s3 --isbn-file.
+
+    Args:
+        check_s3 (bool): Flag to audit the thumbnails.
+        check_vectors (bool): Flag to audit the vectors.
+        output_dir (str): A directory to write the ISBN-13s of each kind of gap to, one file per kind.
+        repair (bool): Flag to queue repairs.
+        batch_size (int): The number of repairs written at once.
+        manifest_path (str): The thumbnail manifest of upload_to_s3.py.
+        catalogue (str): The catalogue. Defaults to DEFAULT_CATALOGUE.
+
+    Returns:
+        Counter: The number of books and the number of gaps of each kind.
+    """
+    config = catalogue_config({key: getattr(Config, key) for key in dir(Config) if key.isupper()}, catalogue)
+    client = MongoClient(config['MONGO_URI'])
+    db = client[config['MONGO_DB']]
+    s3_client = boto3.client(
+        's3',
+        region_name=config['AWS_REGION'],
+        aws_access_key_id=config['AWS_ACCESS_KEY_ID'],
+        aws_secret_access_key=config['AWS_SECRET_ACCESS_KEY'],
+        endpoint_url=config['AWS_ENDPOINT_URL']
+    )
+
+    files = {}
+    vector_repairs = []
+    thumbnail_repairs = []
+    # upload_to_s3.py uploads the thumbnails of the default catalogue, so only its manifest entries are repaired
+    is_default = config['CATALOGUE'] == config['DEFAULT_CATALOGUE']
+    manifest = ThumbnailManifest(manifest_path) if repair and check_s3 and is_default and os.path.exists(manifest_path) else None
+    queued = forgotten = 0
+
+    def on_gap(kind, isbn_13):
+        nonlocal queued, forgotten
+        if output_dir:
+            if kind not in files:
+                files[kind] = open(os.path.join(output_dir, f"{kind}.txt"), 'w')
+            files[kind].write(f"{isbn_13}\n")
+        if not repair:
+            return
+        if kind in VECTOR_REPAIRS:
+            vector_repairs.append((VECTOR_REPAIRS[kind], isbn_13, kind))
+            if len(vector_repairs) >= batch_size:
+                BookIndexer.enqueue_repairs(db, vector_repairs)
+                queued += len(vector_repairs)
+                vector_repairs.clear()
+        elif kind in THUMBNAIL_REPAIRS and manifest is not None:
+            thumbnail_repairs.append(isbn_13)
+            if len(thumbnail_repairs) >= batch_size:
+                forgotten += manifest.remove(thumbnail_repairs)
+                thumbnail_repairs.clear()
+
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    try:
+        auditor = ConsistencyAuditor(db, s3_client, config['AWS_BUCKET_NAME'], create_vector_index(config),
+                                     thumbnail_prefix=config['THUMBNAIL_PREFIX'])
+        counts = auditor.run(on_gap=on_gap, check_s3=check_s3, check_vectors=check_vectors)
+
+        if vector_repairs:
+            BookIndexer.enqueue_repairs(db, vector_repairs)
+            queued += len(vector_repairs)
+        if manifest is not None:
+            forgotten += manifest.remove(thumbnail_repairs)
+            manifest.save()
+    finally:
+        for file in files.values():
+            file.close()
+        client.close()
+
+    print(f"Audited {counts['books']} books.")
+    for kind, description in GAP_KINDS.items():
+        if counts[kind]:
+            print(f"  {counts[kind]} {description}" + (f" ({os.path.join(output_dir, kind + '.txt')})" if output_dir else ""))
+    if repair:
+        print(f"Queued {queued} vector repairs for the indexer.")
+        if manifest is not None:
+            print(f"Removed {forgotten} books from the thumbnail manifest. "
+                  f"Run upload_to_s3.py to upload their thumbnails.")
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check that MongoDB, S3 and the vector index hold the same books.")
+    parser.add_argument('--skip-s3', action='store_true', help="Do not audit the thumbnails")
+    parser.add_argument('--skip-vectors', action='store_true', help="Do not audit the vectors")
+    parser.add_argument('--output-dir', help="Directory to write the ISBN-13s of each kind of gap to")
+    parser.add_argument('--repair', action='store_true',
+                        help="Queue vector repairs for the indexer and drop missing thumbnails from the manifest")
+    parser.add_argument('--batch-size', type=int, default=1000, help="Number of repairs written at once")
+    parser.add_argument('--manifest', default=DEFAULT_MANIFEST_PATH, help="Thumbnail manifest of upload_to_s3.py")
+    parser.add_argument('--catalogue', help="Catalogue to audit (default: DEFAULT_CATALOGUE)")
+
+    args = parser.parse_args()
+
+    setup_logger(
+        log_level=getattr(logging, os.getenv('LOG_LEVEL', 'INFO')),
+        log_file=os.getenv('LOG_FILE', 'logs/audit.log'),
+        log_format=os.getenv('LOG_FORMAT', 'text'),
+        debug_sample_rate=float(os.getenv('LOG_DEBUG_SAMPLE_RATE', 1.0))
+    )
+
+    start = time.time()
+    audit_consistency(
+        check_s3=not args.skip_s3,
+        check_vectors=not args.skip_vectors,
+        output_dir=args.output_dir,
+        repair=args.repair,
+        batch_size=args.batch_size,
+        manifest_path=args.manifest,
+        catalogue=args.catalogue
+    )
+    print(f"Time elapsed: {time.time() - start:.1f} seconds")
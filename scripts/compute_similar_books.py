@@ -0,0 +1,64 @@
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
+import time
+from pymongo import MongoClient
+from app.catalogues import catalogue_config
+from app.config import Config
+from app.services.local_vector_index import LocalVectorIndex
+from app.workers.similar_books import SimilarBooksJob
+from utils.logger import setup_logger, logging
+import os
+
+
+def compute_similar_books(full=False, top_n=None, workers=None, catalogue=None):
+    """
+    Precomputes the neighbours of every book in the local vector index and stores them in MongoDB.
+    Only the books affected by vectors that changed since the previous run are updated, unless full is set.
+
+    Args:
+        full (bool): Flag to recompute every book.
+        top_n (int): The number of neighbours stored per book.
+        workers (int): The number of threads computing neighbours.
+        catalogue (str): The catalogue. Defaults to DEFAULT_CATALOGUE.
+
+    Returns:
+        dict: The number of recomputed, merged and deleted documents.
+    """
+    config = catalogue_config({key: getattr(Config, key) for key in dir(Config) if key.isupper()}, catalogue)
+    if config['VECTOR_BACKEND'] != 'local':
+        raise SystemExit("Precomputing similar books requires VECTOR_BACKEND=local")
+
+    client = MongoClient(config['MONGO_URI'])
+    try:
+        job = SimilarBooksJob(
+            client[config['MONGO_DB']],
+            LocalVectorIndex(path=config['LOCAL_VECTOR_INDEX_PATH']),
+            top_n=top_n or config['SIMILAR_BOOKS_TOP_N'],
+            workers=workers
+        )
+        return job.run(full=full)
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Precompute the most similar books of every book.")
+    parser.add_argument('--full', action='store_true', help="Recompute every book instead of only the changed ones")
+    parser.add_argument('--top-n', type=int, help="Number of neighbours stored per book")
+    parser.add_argument('--workers', type=int, help="Number of threads computing neighbours (default: CPU count)")
+    parser.add_argument('--catalogue', help="Catalogue to compute the similar books of (default: DEFAULT_CATALOGUE)")
+
+    args = parser.parse_args()
+
+    setup_logger(
+        log_level=getattr(logging, os.getenv('LOG_LEVEL', 'INFO')),
+        log_file=os.getenv('LOG_FILE', 'logs/similar_books.log'),
+        log_format=os.getenv('LOG_FORMAT', 'text'),
+        debug_sample_rate=float(os.getenv('LOG_DEBUG_SAMPLE_RATE', 1.0))
+    )
+
+    start = time.time()
+    counts = compute_similar_books(full=args.full, top_n=args.top_n, workers=args.workers, catalogue=args.catalogue)
+    print(f"Recomputed {counts['recomputed']}, merged {counts['merged']}, deleted {counts['deleted']} in {time.time() - start:.1f} seconds")
@@ -1,125 +1,362 @@
-import time
 from dotenv import load_dotenv
+load_dotenv()
+
+import time
 import asyncio
-import boto3
-import botocore.exceptions
+import json
+import aioboto3
+from concurrent.futures import ThreadPoolExecutor
 from pymongo import MongoClient
-from pymongo.errors import BulkWriteError
-from pinecone import Pinecone
-from pinecone.exceptions import (
-    PineconeException,
-    NotFoundException
-)
+from pinecone.exceptions import NotFoundException
 import os
 import argparse
+from app.catalogues import catalogue_config
+from app.config import Config
+from app.services.local_vector_index import LocalVectorIndex
+from app.services.vector_service import create_vector_index
+from scripts.upload_to_s3 import DEFAULT_MANIFEST_PATH, ThumbnailManifest
+from utils.helpers import RENDITION_SEPARATOR, THUMBNAIL_PREFIX, generate_rendition_key, generate_s3_key
+from utils.images import RENDITION_WIDTHS
+
+# S3 deletes at most 1000 keys per request
+S3_DELETE_BATCH_SIZE = 1000
 
-async def erase_data(s3=False, mongodb=False, pinecone=False):
+
+async def erase_data(s3=False, mongodb=False, pinecone=False, isbns=None, category=None, mongo_filter=None,
+                     dry_run=False, s3_concurrency=8, vector_batch_size=1000, manifest_path=DEFAULT_MANIFEST_PATH,
+                     catalogue=None):
     """
-    Delete book data from S3, MongoDB, and Pinecone asynchronously.
-    We are using threads instead of true asynchronous, because most of the operations are single API calls.
+    Delete book data from S3, MongoDB, and the vector index asynchronously.
+    Without a selector every book is deleted. With one, the selected ISBN-13s are resolved once up front and the
+    same books are deleted from every store, so books written while the erase runs are left alone.
 
     Args:
-        s3 (bool): Flag to erase data from S3.
-        mongodb (bool): Flag to erase data from MongoDB.
-        pinecone (bool): Flag to erase data from Pinecone.
+        s3 (bool): Flag to erase thumbnails from S3.
+        mongodb (bool): Flag to erase books from MongoDB.
+        pinecone (bool): Flag to erase vectors from the vector index (Pinecone, or the local index if VECTOR_BACKEND=local).
+        isbns (list): The ISBN-13s of the books to erase.
+        category (str): Erase the books of this category.
+        mongo_filter (dict): Erase the books matching this MongoDB filter.
+        dry_run (bool): Flag to only count what would be deleted.
+        s3_concurrency (int): The maximum number of S3 delete requests in flight.
+        vector_batch_size (int): The maximum number of vector ids per delete request.
+        manifest_path (str): The thumbnail manifest of upload_to_s3.py. Erased thumbnails are removed from it.
+        catalogue (str): The catalogue. Defaults to DEFAULT_CATALOGUE.
+
+    Returns:
+        dict: The number of deleted (or, in a dry run, matching) items per service, or None if it failed.
     """
-    load_dotenv()
 
     if not s3 and not mongodb and not pinecone:
         print("No services specified for erasing book data.")
-        return
+        return {}
+
+    if sum(selector is not None for selector in (isbns, category, mongo_filter)) > 1:
+        raise ValueError("Only one of isbns, category and mongo_filter can be given")
+    if category is not None:
+        mongo_filter = {'category': category}
+    if mongo_filter is not None:
+        isbns = await asyncio.to_thread(select_isbns, mongo_filter, catalogue)
+    if isbns is not None:
+        isbns = list(dict.fromkeys(isbns))
+        print(f"Selected {len(isbns)} books.")
+        if not isbns:
+            return {}
 
     # Create async tasks
     tasks = []
     services = []
 
     if s3:
-        tasks.append(asyncio.to_thread(erase_s3_data))
+        tasks.append(erase_s3_data(isbns, dry_run=dry_run, concurrency=s3_concurrency, manifest_path=manifest_path,
+                                   catalogue=catalogue))
         services.append("S3")
     if mongodb:
-        tasks.append(asyncio.to_thread(erase_mongodb_data))
+        tasks.append(asyncio.to_thread(erase_mongodb_data, isbns, dry_run=dry_run, catalogue=catalogue))
         services.append("MongoDB")
     if pinecone:
-        tasks.append(asyncio.to_thread(erase_pinecone_data))
-        services.append("Pinecone")
+        tasks.append(asyncio.to_thread(erase_vector_data, isbns, dry_run=dry_run, batch_size=vector_batch_size,
+                                       catalogue=catalogue))
+        services.append("Vector index")
 
     # Execute tasks and gather results
     results = await asyncio.gather(*tasks, return_exceptions=True)
-    failed_services, success_count = [], 0
+    failed_services, success_count, counts = [], 0, {}
 
     # Figure out which services failed
     for (result, service) in zip(results, services):
         if isinstance(result, Exception):
             failed_services.append(service)
+            counts[service] = None
             print(f"{service} failed to delete book data: {result}")
         else:
             success_count += 1
-            print(f"{service} book data deletion succeded!")
+            counts[service] = result
+            if dry_run:
+                print(f"{service}: {result} items would be deleted.")
+            else:
+                print(f"{service} book data deletion succeeded: {result} items deleted.")
 
     # Display message based on successes
-    if success_count == len(services):
+    if dry_run:
+        print("Dry run, nothing was deleted.")
+    elif success_count == len(services):
         print("✅ Book data deleted in specified services!")
     elif success_count > 0:
         print(f"⚠️ The following services failed: {', '.join(failed_services)}")
     else:
         print(f"❌ Failed to delete book data in all services.")
+    return counts
+
 
+def get_config(catalogue=None):
+    """
+    Returns the config of a catalogue. Defaults to DEFAULT_CATALOGUE.
+    """
+    return catalogue_config({key: getattr(Config, key) for key in dir(Config) if key.isupper()}, catalogue)
+
+
+def get_mongodb(catalogue=None):
+    """
+    Connects to the MongoDB database of a catalogue. Defaults to DEFAULT_CATALOGUE.
+    """
+    config = get_config(catalogue)
+    client = MongoClient(config['MONGO_URI'])
+    return client[config['MONGO_DB']]
 
-def erase_s3_data():
+
+def select_isbns(mongo_filter, catalogue=None):
     """
-    Completely empty s3 bucket by deleting all objects.
+    Resolves a MongoDB filter to the ISBN-13s of the matching books.
+
+    Args:
+        mongo_filter (dict): The filter on the books collection.
+        catalogue (str): The catalogue. Defaults to DEFAULT_CATALOGUE.
+
+    Returns:
+        list: The ISBN-13s of the matching books.
+    """
+    cursor = get_mongodb(catalogue)['books'].find(mongo_filter, {'isbn_13': 1, '_id': 0})
+    return [book['isbn_13'] for book in cursor]
+
+
+def load_isbns(file_path):
+    """
+    Reads ISBN-13s from a file with one per line. Blank lines and lines starting with '#' are skipped.
+
+    Args:
+        file_path (str): The path to the file.
+
+    Returns:
+        list: The ISBN-13s.
+    """
+    with open(file_path, 'r') as file:
+        return [line.strip() for line in file if line.strip() and not line.lstrip().startswith('#')]
+
+
+async def erase_s3_data(isbns=None, dry_run=False, concurrency=8, manifest_path=DEFAULT_MANIFEST_PATH, catalogue=None):
+    """
+    Delete thumbnails and their renditions from S3 in batches of 1000 keys, with several batches in flight.
+    Without ISBN-13s, every key under the catalogue's thumbnail prefix is deleted while the bucket is still being listed.
+
+    Args:
+        isbns (list): The ISBN-13s of the books whose thumbnails are deleted. Every thumbnail is deleted if None.
+        dry_run (bool): Flag to only count the stored keys that would be deleted.
+        concurrency (int): The maximum number of delete requests in flight.
+        manifest_path (str): The thumbnail manifest to remove the deleted books from, if it exists.
+        catalogue (str): The catalogue. Defaults to DEFAULT_CATALOGUE.
+
+    Returns:
+        int: The number of deleted (or, in a dry run, stored) keys. Deletes of selected books count every
+            requested key, as S3 does not report which keys existed.
+
+    Raises:
+        RuntimeError: If some keys could not be deleted.
     """
     # Retrieve AWS credentials for client
-    bucket_name = os.getenv('AWS_BUCKET_NAME')
-    region = os.getenv('AWS_REGION')
-    access_key_id = os.getenv('AWS_ACCESS_KEY_ID')
-    secret_access_key = os.getenv('AWS_SECRET_ACCESS_KEY')
- 
-    # Create client for S3
-    s3_resource = boto3.resource('s3', region_name=region, aws_access_key_id=access_key_id, aws_secret_access_key=secret_access_key)
-    # Retrieve bucket and delete all objects
-    bucket = s3_resource.Bucket(bucket_name)
-    bucket.objects.filter(Prefix='thumbnails/').delete()
-
-
-def erase_mongodb_data():
-    """
-    Completely empty MongoDB by deleting all documents in the collection.
-    """
-    # Load MongoDB info
-    mongo_uri = os.getenv("MONGO_URI")
-    client = MongoClient(mongo_uri)
-    db = client[os.getenv("MONGO_DB")]
+    config = get_config(catalogue)
+    bucket_name = config['AWS_BUCKET_NAME']
+    prefix = config['THUMBNAIL_PREFIX']
+    region = config['AWS_REGION']
+    access_key_id = config['AWS_ACCESS_KEY_ID']
+    secret_access_key = config['AWS_SECRET_ACCESS_KEY']
+    endpoint_url = config['AWS_ENDPOINT_URL']
+
+    selected = set(isbns) if isbns is not None else None
+    deleted, errors, erased_isbns = 0, [], set()
+
+    async with aioboto3.Session().client(
+        's3',
+        region_name=region,
+        aws_access_key_id=access_key_id,
+        aws_secret_access_key=secret_access_key,
+        endpoint_url=endpoint_url
+    ) as s3_client:
+
+        async def list_keys():
+            # The keys of selected books are known, so only a dry run or a full erase needs the listing
+            if selected is not None and not dry_run:
+                for isbn_13 in isbns:
+                    s3_key = generate_s3_key({'isbn_13': isbn_13}, prefix)
+                    yield s3_key
+                    for size in RENDITION_WIDTHS:
+                        yield generate_rendition_key(s3_key, size)
+                return
+            paginator = s3_client.get_paginator('list_objects_v2')
+            async for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+                for item in page.get('Contents', []):
+                    if selected is None or thumbnail_isbn(item['Key'], prefix) in selected:
+                        yield item['Key']
+
+        if dry_run:
+            return sum([1 async for _ in list_keys()])
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def delete_batch(keys):
+            nonlocal deleted
+            try:
+                response = await s3_client.delete_objects(
+                    Bucket=bucket_name,
+                    Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True}
+                )
+                # Quiet mode only reports the keys that failed
+                failed = {error['Key'] for error in response.get('Errors', [])}
+                errors.extend(f"{error['Key']}: {error.get('Message')}" for error in response.get('Errors', []))
+                deleted += len(keys) - len(failed)
+                erased_isbns.update(thumbnail_isbn(key, prefix) for key in keys if key not in failed)
+            except Exception as e:
+                errors.append(f"{len(keys)} keys: {e}")
+            finally:
+                semaphore.release()
+
+        tasks, batch = [], []
+        async for key in list_keys():
+            batch.append(key)
+            if len(batch) == S3_DELETE_BATCH_SIZE:
+                # Bounds the batches in flight, which also pauses the listing
+                await semaphore.acquire()
+                tasks.append(asyncio.create_task(delete_batch(batch)))
+                batch = []
+        if batch:
+            await semaphore.acquire()
+            tasks.append(asyncio.create_task(delete_batch(batch)))
+        await asyncio.gather(*tasks)
+
+    # Deleted thumbnails must be uploaded again by the next upload_to_s3.py run, which writes the default catalogue
+    if prefix == THUMBNAIL_PREFIX and os.path.exists(manifest_path):
+        manifest = ThumbnailManifest(manifest_path)
+        removed = manifest.remove(erased_isbns)
+        manifest.save()
+        print(f"Removed {removed} books from the thumbnail manifest.")
+
+    if errors:
+        raise RuntimeError(f"Failed to delete {len(errors)} S3 keys or batches, e.g. {errors[0]}")
+    return deleted
+
+
+def thumbnail_isbn(s3_key, prefix=THUMBNAIL_PREFIX):
+    """
+    Returns the ISBN-13 of a thumbnail or rendition key, e.g. 'thumbnails/9780000000033_small.webp' -> '9780000000033'.
+    """
+    return s3_key[len(prefix):].split(RENDITION_SEPARATOR, 1)[0]
+
+
+def erase_mongodb_data(isbns=None, dry_run=False, batch_size=1000, catalogue=None):
+    """
+    Delete books from MongoDB, along with their precomputed similar books.
+
+    Args:
+        isbns (list): The ISBN-13s of the books to delete. Every book is deleted if None.
+        dry_run (bool): Flag to only count the books that would be deleted.
+        batch_size (int): The maximum number of ISBN-13s per delete.
+        catalogue (str): The catalogue. Defaults to DEFAULT_CATALOGUE.
+
+    Returns:
+        int: The number of deleted (or, in a dry run, matching) books.
+    """
+    db = get_mongodb(catalogue)
     collection = db['books']
 
-    # Delete all documents
-    result = collection.delete_many({})
-    print(f"Deleted {result.deleted_count} documents.")
+    if isbns is None:
+        if dry_run:
+            return collection.count_documents({})
+        db['similar_books'].delete_many({})
+        return collection.delete_many({}).deleted_count
+
+    count = 0
+    for start in range(0, len(isbns), batch_size):
+        chunk = isbns[start:start + batch_size]
+        if dry_run:
+            count += collection.count_documents({'isbn_13': {'$in': chunk}})
+        else:
+            count += collection.delete_many({'isbn_13': {'$in': chunk}}).deleted_count
+            db['similar_books'].delete_many({'_id': {'$in': chunk}})
+    return count
 
 
-def erase_pinecone_data():
+def erase_vector_data(isbns=None, dry_run=False, batch_size=1000, concurrency=4, catalogue=None):
     """
-    Completely empty Pinecone vector index by deleting all vectors.
+    Delete vectors from the vector index (Pinecone, or the local index if VECTOR_BACKEND=local).
+    Pinecone deletes are sent in batches with several requests in flight.
+
+    Args:
+        isbns (list): The ISBN-13s of the vectors to delete. Every vector is deleted if None.
+        dry_run (bool): Flag to only count the stored vectors that would be deleted.
+        batch_size (int): The maximum number of ids per delete or fetch request.
+        concurrency (int): The maximum number of requests in flight.
+        catalogue (str): The catalogue. Defaults to DEFAULT_CATALOGUE.
+
+    Returns:
+        int: The number of deleted (or, in a dry run, stored) vectors. Deletes of selected vectors count every
+            requested id, as the index does not report which ids existed.
     """
+    index = create_vector_index(get_config(catalogue))
+
+    if isbns is None:
+        count = index.describe_index_stats()['total_vector_count']
+        if not dry_run:
+            try:
+                index.delete(delete_all=True)
+            except NotFoundException:
+                print("No vectors to delete in the vector index.")
+        return count
 
-    # Initialize Pinecone
-    pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-    index = pc.Index(host=os.getenv("PINECONE_INDEX_HOST"))
+    # The local index is written to disk on every delete, so it gets a single one
+    if isinstance(index, LocalVectorIndex):
+        batch_size = max(len(isbns), 1)
+    chunks = [isbns[start:start + batch_size] for start in range(0, len(isbns), batch_size)]
 
-    try:
-        # Delete all vectors
-        result = index.delete(delete_all=True)
-    except NotFoundException as e:
-        print("No vectors to delete in Pinecone index.")
+    def request(chunk):
+        if dry_run:
+            return len(index.fetch(ids=chunk)['vectors'])
+        index.delete(ids=chunk)
+        return len(chunk)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return sum(executor.map(request, chunks))
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Erase book data from specified services.")
     parser.add_argument("--s3", action="store_true", help="Erase S3 data")
     parser.add_argument("--mongodb", action="store_true", help="Erase MongoDB data")
-    parser.add_argument("--pinecone", action="store_true", help="Erase Pinecone data")
+    parser.add_argument("--pinecone", "--vectors", dest="pinecone", action="store_true",
+                        help="Erase vectors from the vector index (Pinecone, or the local index if VECTOR_BACKEND=local)")
     parser.add_argument("--all", action="store_true", help="Erase data from all services")
 
+    selector = parser.add_mutually_exclusive_group()
+    selector.add_argument("--isbn-file", help="Only erase the books listed in this file, one ISBN-13 per line")
+    selector.add_argument("--category", help="Only erase the books of this category")
+    selector.add_argument("--filter", dest="mongo_filter", type=json.loads,
+                          help="Only erase the books matching this MongoDB filter, as JSON, e.g. '{\"rating\": {\"$lt\": 2}}'")
+
+    parser.add_argument("--dry-run", action="store_true", help="Only count what would be deleted")
+    parser.add_argument("--s3-concurrency", type=int, default=8, help="S3 delete requests of 1000 keys in flight")
+    parser.add_argument("--vector-batch-size", type=int, default=1000, help="Vector ids per delete request")
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST_PATH, help="Thumbnail manifest of upload_to_s3.py")
+    parser.add_argument("--catalogue", help="Catalogue to erase (default: DEFAULT_CATALOGUE)")
+
     args = parser.parse_args()
 
     # If --all is specified, set all flags to True
@@ -130,8 +367,16 @@ if __name__ == '__main__':
     asyncio.run(erase_data(
         s3=args.s3,
         mongodb=args.mongodb,
-        pinecone=args.pinecone
+        pinecone=args.pinecone,
+        isbns=load_isbns(args.isbn_file) if args.isbn_file else None,
+        category=args.category,
+        mongo_filter=args.mongo_filter,
+        dry_run=args.dry_run,
+        s3_concurrency=args.s3_concurrency,
+        vector_batch_size=args.vector_batch_size,
+        manifest_path=args.manifest,
+        catalogue=args.catalogue
     ))
     end = time.time()
     time_elapsed = end - start
-    print(f'Time elapsed: {time_elapsed} seconds')
\ No newline at end of file
+    print(f'Time elapsed: {time_elapsed} seconds')
@@ -1,6 +1,7 @@
-import requests
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import threading
+import aiohttp
+import asyncio
+import argparse
+import hashlib
 import json
 import os
 import random
@@ -8,27 +9,73 @@ from itertools import product
 from dotenv import load_dotenv
 from tqdm import tqdm
 import time
-
-def generate_book_data(file_path):
+from app.api.schemas import CATEGORIES, FORMATS, LENGTHS
+
+# Responses with these statuses are retried with backoff
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Google Books only pages a few hundred results deep into a query, so each combination of category, length and
+# format is also searched with each of these seeds to reach a large number of distinct books
+SEED_KEYWORDS = (
+    'space opera', 'time travel', 'robots', 'artificial intelligence', 'aliens', 'first contact', 'dystopia',
+    'utopia', 'post-apocalyptic', 'cyberpunk', 'steampunk', 'military', 'galactic empire', 'colonization',
+    'terraforming', 'mars', 'the moon', 'starship', 'generation ship', 'wormhole', 'parallel universe',
+    'alternate history', 'genetic engineering', 'clones', 'androids', 'cyborgs', 'virtual reality', 'nanotechnology',
+    'biopunk', 'solarpunk', 'climate fiction', 'pandemic', 'invasion', 'galactic war', 'mercenaries', 'pirates',
+    'bounty hunter', 'detective', 'mystery', 'thriller', 'romance', 'humor', 'satire', 'young adult', 'children',
+    'anthology', 'short stories', 'novella', 'classic', 'golden age', 'new wave', 'hard science', 'space exploration',
+    'asteroid', 'comet', 'black hole', 'quantum', 'telepathy', 'superhuman', 'mutants', 'monsters', 'kaiju', 'zombies',
+    'vampires', 'magic', 'dragons', 'sword and planet', 'dying earth', 'far future', 'near future', 'singularity',
+    'uploaded minds', 'immortality', 'cryonics', 'surveillance', 'rebellion', 'revolution', 'empire', 'politics',
+    'religion', 'philosophy', 'ecology', 'ocean', 'underground', 'desert planet', 'ice world', 'jungle', 'lost world',
+    'archaeology', 'ancient aliens', 'ruins', 'artifact', 'contact', 'translation', 'language', 'music', 'art', 'sports'
+)
+SEED_AUTHORS = (
+    'smith', 'johnson', 'williams', 'brown', 'jones', 'miller', 'davis', 'wilson', 'anderson', 'taylor', 'thomas',
+    'moore', 'martin', 'jackson', 'thompson', 'white', 'harris', 'clark', 'lewis', 'robinson', 'walker', 'young',
+    'allen', 'king', 'wright', 'scott', 'green', 'baker', 'adams', 'nelson', 'hill', 'campbell', 'mitchell', 'roberts',
+    'carter', 'phillips', 'evans', 'turner', 'parker', 'collins', 'edwards', 'stewart', 'morris', 'murphy', 'cook',
+    'rogers', 'morgan', 'cooper', 'peterson', 'reed', 'bailey', 'bell', 'kelly', 'howard', 'ward', 'cox', 'richardson',
+    'wood', 'watson', 'brooks', 'bennett', 'gray', 'james', 'hughes', 'price', 'sanders', 'myers', 'long', 'ross',
+    'foster', 'powell', 'jenkins', 'perry', 'russell', 'sullivan', 'butler', 'barnes', 'fisher', 'henderson', 'coleman',
+    'simmons', 'patterson', 'jordan', 'reynolds', 'hamilton', 'graham', 'kim', 'wallace', 'west', 'cole', 'hayes',
+    'chen', 'lee', 'wang', 'liu', 'singh', 'kumar', 'garcia', 'martinez', 'rodriguez', 'lopez', 'hernandez', 'gonzalez'
+)
+SEEDS = SEED_KEYWORDS + tuple(f'inauthor:{name}' for name in SEED_AUTHORS)
+
+
+async def generate_book_data(file_path, api_url=None, max_books=100, max_per_query=None, pages=10, page_size=40,
+                             rate=5.0, concurrency=10, max_retries=5, cache_dir='data/.google_books_cache'):
     """
     Generates book data by querying the Google Books API.
-    Uses concurrent fetching to improve performance and saves the fetched data to a JSON file.
+    Every combination of category, length, and format is searched once per seed of SEEDS (keywords and author
+    surnames), which gives enough distinct queries for 100k+ books. Queries are fetched concurrently under a
+    token-bucket rate limit, paged with startIndex, retried with jittered backoff, and cached on disk. Books are
+    streamed to the output file as they arrive.
 
     Args:
-        file_path (str): The path to the JSON file to write data to.
+        file_path (str): The path to the file to write data to. '.ndjson' files get one book per line, otherwise a JSON array.
+        api_url (str): The URL of the Google Books API. Defaults to GOOGLE_BOOKS_API_URL.
+        max_books (int): The maximum number of books to generate data for.
+        max_per_query (int): The maximum number of books to keep per query. Unlimited if not set.
+        pages (int): The maximum number of result pages to fetch per query.
+        page_size (int): The number of results per page (at most 40).
+        rate (float): The maximum number of requests per second.
+        concurrency (int): The number of queries fetched at once.
+        max_retries (int): The number of retries for rate-limited or failed requests.
+        cache_dir (str): The directory responses are cached in. Caching is disabled if not set.
     """
 
     load_dotenv()
 
     # API settings
-    api_url = os.getenv("GOOGLE_BOOKS_API_URL")
+    api_url = api_url or os.getenv("GOOGLE_BOOKS_API_URL")
 
     # Configurations ----------------------
-    MAX_NUM_BOOKS = 100 # Maximum number of books to generate data for
-    # Data definitions
-    categories = ["Cyberpunk", "Thriller", "Comics", "Mystery", "Action Adventure"]
-    lengths = ["Short Read", "Standard Length", "Long Read"]
-    formats = ["Ebook", "Audiobook", "Paperback"]
+    # Data definitions, shared with the schema so generated books pass validation
+    categories = CATEGORIES
+    lengths = LENGTHS
+    formats = FORMATS
     # Distribution weights for how published years should be assigned for each book
     published_year_bins = {
         'old': {
@@ -48,60 +95,72 @@ def generate_book_data(file_path):
     # Main execution loop
     start = time.time()
 
-    all_books = []
-    combinations = product(categories, lengths, formats)
+    # Seeds vary slowest, so even small runs cover every combination of category, length, and format
+    queries = ((*combination, seed) for seed, combination in product(SEEDS, product(categories, lengths, formats)))
+
+    fetcher = GoogleBooksFetcher(
+        api_url,
+        rate_limiter=TokenBucket(rate=rate, capacity=max(1, int(rate))),
+        cache=ResponseCache(cache_dir) if cache_dir else None,
+        max_retries=max_retries
+    )
 
-    # Used to keep track of previously processed books so there aren't duplicate title-author combos
-    # Lock is used to ensure thread-safe access to shared resources
+    # Used to keep track of previously processed books so there aren't duplicate title-author combos.
+    # All coroutines run on one thread, so no lock is needed.
     processed_books = set()
-    lock = threading.Lock()
-    
-    # Concurrent data fetching
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        # Submit tasks to executor for fetching book data concurrently
-        futures = [executor.submit(fetch_book_data, combo, api_url, published_year_bins, processed_books, lock) for combo in combinations]
-
-        # Process completed futures are they complete
-        for future in tqdm(as_completed(futures), total=len(futures), desc="Generating Book Data"):
-            if len(all_books) >= MAX_NUM_BOOKS:
-                break
-            
-            books = future.result()
-            if books:
-                all_books.extend(books)
+    pbar = tqdm(total=max_books, desc="Generating Book Data")
+
+    async with aiohttp.ClientSession() as session:
+        with BookWriter(file_path) as writer:
+            async def worker():
+                # Each worker takes the next query and pages through its results until it has enough books
+                while writer.count < max_books:
+                    combination = next(queries, None)
+                    if combination is None:
+                        return
+                    async for books in fetch_book_data(session, fetcher, combination, published_year_bins, processed_books,
+                                                       max_per_query, pages, page_size):
+                        for book in books[:max_books - writer.count]:
+                            writer.write(book)
+                            pbar.update(1)
+                        if writer.count >= max_books:
+                            break
+
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            total_books = writer.count
+    pbar.close()
 
     # Calculate elapsed time
     end = time.time()
     time_elapsed = end - start
     print(f'Time elapsed: {time_elapsed} seconds')
 
-    print(f"Total books fetched: {len(all_books)}")
-    # Save book data to file as JSON
-    with open(file_path, 'w') as file:
-        json.dump(all_books, file, indent=4)
+    print(f"Total books fetched: {total_books} ({fetcher.requests} requests, {fetcher.cache_hits} cached responses)")
+
 
-def fetch_book_data(combination, api_url, published_year_bins, processed_books, lock):
+async def fetch_book_data(session, fetcher, combination, published_year_bins, processed_books, max_per_query, pages, page_size):
     """
-    Fetches book data from the Google Books API for a given combination of category, length, and format.
-    
+    Fetches book data from the Google Books API for a given combination of category, length, format, and seed,
+    paging through the results with startIndex.
+
     Args:
-        combination (tuple): A combination of category, length, and format.
-        api_url (str): The URL of the Google Books API.
+        session (aiohttp.ClientSession): The asynchronous HTTP session.
+        fetcher (GoogleBooksFetcher): The fetcher used to query the API.
+        combination (tuple): A combination of category, length, format, and seed.
         published_year_bins (dict): The distribution weights for published years.
         processed_books (set): A set to keep track of processed books to avoid duplicates.
-        lock (threading.Lock): A lock to ensure thread-safe access to shared resources.
-    
-    Returns:
-        list: A list of processed books.
+        max_per_query (int): The maximum number of books to keep for this combination, or None for no limit.
+        pages (int): The maximum number of result pages to fetch.
+        page_size (int): The number of results per page.
+
+    Yields:
+        list: The processed books of each page.
     """
 
-    category, length, book_format = combination
+    category, length, book_format, seed = combination
 
     # Construct search query to search Google Books API
-    query = f'Sci-Fi {category} {length} {book_format}'
-
-    # Fetch data
-    results = query_google_books(query, api_url)
+    query = f'Sci-Fi {category} {length} {book_format} {seed}'
 
     # Additional metadata to be included with the fetched data
     metadata = {
@@ -111,59 +170,245 @@ def fetch_book_data(combination, api_url, published_year_bins, processed_books,
         'published_year_bins': published_year_bins
     }
 
-    # Process fetched data if there is any
-    if results:
-        return process_books(results, metadata, processed_books, lock)
-    else:
-        return []
+    num_books = 0
+    for page in range(pages):
+        # Fetch data
+        results = await fetcher.query(session, query, start_index=page * page_size, max_results=page_size)
+
+        # Process fetched data if there is any
+        if not results or not results.get('items'):
+            return
+
+        remaining = max_per_query - num_books if max_per_query is not None else len(results['items'])
+        books = process_books(results, metadata, processed_books, remaining)
+        num_books += len(books)
+        yield books
 
+        # Stop when this combination is complete or the results are exhausted
+        if (max_per_query is not None and num_books >= max_per_query) or \
+                (page + 1) * page_size >= results.get('totalItems', 0):
+            return
 
-def query_google_books(query, api_url):
+
+class TokenBucket:
     """
-    Queries the Google Books API with a given query string and API URL.
-    
-    Args:
-        query (str): The query string for the Google Books API.
-        api_url (str): The URL of the Google Books API.
-    
-    Returns:
-        dict or None: The JSON response from the API if successful, otherwise None.
+    An asyncio token bucket that limits the rate of requests while allowing short bursts.
     """
 
-    params = {
-        'q': query,
-        'maxResults': 10  # Limit results to top 10
-    }
-    
-    # Make request to Google Books API
-    try:
-        response = requests.get(url=api_url, params=params)
-        response.raise_for_status()  # Raise an exception for bad requests
-        return response.json()
-    except requests.exceptions.HTTPError as err:
-        print(f"HTTP error occurred: {err}")
-        return None
-    except Exception as e:
-        print(f"An error occurred: {err}")
+    def __init__(self, rate, capacity):
+        """
+        Args:
+            rate (float): The number of tokens added per second.
+            capacity (int): The maximum number of tokens, i.e. the largest burst.
+        """
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+
+    async def acquire(self):
+        """
+        Waits until a token is available and takes it.
+        """
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+
+
+class ResponseCache:
+    """
+    A persistent on-disk cache of API responses, so reruns do not fetch the same pages again.
+    """
+
+    def __init__(self, cache_dir):
+        """
+        Args:
+            cache_dir (str): The directory to store responses in.
+        """
+        self._cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+
+    def get(self, url, params):
+        """
+        Returns the cached response for a request, or None if it is not cached.
+        """
+        path = self._path(url, params)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as file:
+            return json.load(file)
+
+
+    def set(self, url, params, response):
+        """
+        Atomically stores the response for a request.
+        """
+        path = self._path(url, params)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump(response, file)
+        os.replace(tmp_path, path)
+
+
+    def _path(self, url, params):
+        key = json.dumps([url, sorted(params.items())])
+        return os.path.join(self._cache_dir, f"{hashlib.sha1(key.encode()).hexdigest()}.json")
+
+
+class GoogleBooksFetcher:
+    """
+    Queries the Google Books API with rate limiting, retries and response caching.
+    """
+
+    def __init__(self, api_url, rate_limiter, cache=None, max_retries=5, base_delay=0.5, max_delay=30):
+        """
+        Args:
+            api_url (str): The URL of the Google Books API.
+            rate_limiter (TokenBucket): The rate limiter shared by all requests.
+            cache (ResponseCache): The response cache, if any.
+            max_retries (int): The number of retries for rate-limited or failed requests.
+            base_delay (float): The initial backoff delay in seconds.
+            max_delay (float): The maximum backoff delay in seconds.
+        """
+        self._api_url = api_url
+        self._rate_limiter = rate_limiter
+        self._cache = cache
+        self._max_retries = max_retries
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self.requests = 0
+        self.cache_hits = 0
+
+
+    async def query(self, session, query, start_index=0, max_results=10):
+        """
+        Queries the Google Books API with a given query string.
+
+        Args:
+            session (aiohttp.ClientSession): The asynchronous HTTP session.
+            query (str): The query string for the Google Books API.
+            start_index (int): The index of the first result to return.
+            max_results (int): The number of results to return.
+
+        Returns:
+            dict or None: The JSON response from the API if successful, otherwise None.
+        """
+        params = {
+            'q': query,
+            'startIndex': start_index,
+            'maxResults': max_results
+        }
+
+        if self._cache:
+            cached = self._cache.get(self._api_url, params)
+            if cached is not None:
+                self.cache_hits += 1
+                return cached
+
+        for attempt in range(self._max_retries + 1):
+            await self._rate_limiter.acquire()
+            self.requests += 1
+            retry_after = None
+
+            # Make request to Google Books API
+            try:
+                async with session.get(url=self._api_url, params=params) as response:
+                    if response.status not in RETRY_STATUSES:
+                        response.raise_for_status()  # Raise an exception for bad requests
+                        results = await response.json()
+                        if self._cache:
+                            self._cache.set(self._api_url, params, results)
+                        return results
+                    retry_after = response.headers.get('Retry-After')
+                    print(f"HTTP {response.status} for query '{query}' (startIndex={start_index})")
+            except aiohttp.ClientResponseError as err:
+                print(f"HTTP error occurred: {err}")
+                return None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                print(f"A connection error occurred: {err}")
+
+            if attempt < self._max_retries:
+                await asyncio.sleep(self._backoff(attempt, retry_after))
+
+        print(f"Giving up on query '{query}' (startIndex={start_index}) after {self._max_retries} retries")
         return None
 
 
-def process_books(books_data, other_metadata, processed_books, lock):
+    def _backoff(self, attempt, retry_after=None):
+        """
+        Returns the delay before the next attempt: the server's Retry-After if given, otherwise full-jitter exponential backoff.
+        """
+        if retry_after and retry_after.isdigit():
+            return int(retry_after)
+        return random.uniform(0, min(self._max_delay, self._base_delay * 2 ** attempt))
+
+
+class BookWriter:
+    """
+    Streams books to a file as they arrive, as NDJSON or as a JSON array.
+    """
+
+    def __init__(self, file_path):
+        """
+        Args:
+            file_path (str): The path to the output file. '.ndjson' files get one book per line, otherwise a JSON array.
+        """
+        self._file_path = file_path
+        self._ndjson = file_path.endswith('.ndjson')
+        self._file = None
+        self.count = 0
+
+
+    def __enter__(self):
+        self._file = open(self._file_path, 'w')
+        if not self._ndjson:
+            self._file.write('[\n')
+        return self
+
+
+    def write(self, book):
+        """
+        Appends a book to the file.
+        """
+        if self._ndjson:
+            self._file.write(json.dumps(book) + '\n')
+        else:
+            separator = ',\n' if self.count else ''
+            self._file.write(separator + json.dumps(book, indent=4))
+        self._file.flush()
+        self.count += 1
+
+
+    def __exit__(self, *exc_info):
+        if not self._ndjson:
+            self._file.write('\n]\n')
+        self._file.close()
+
+
+def process_books(books_data, other_metadata, processed_books, max_books):
     """
     Processes book data from the Google Books API response, adding metadata and ensuring no duplicates.
-    
+
     Args:
         books_data (dict): The JSON response from the Google Books API.
         other_metadata (dict): Additional metadata to be included with each book.
         processed_books (set): A set to keep track of processed books to avoid duplicates.
-        lock (threading.Lock): A lock to ensure thread-safe access to shared resources.
-    
+        max_books (int): The maximum number of books to add from this response.
+
     Returns:
         list: A list of processed book entries.
     """
 
     books = []
-    MAX_NUM_BOOK_PER_COMBO = 2 # Maximum number of books to add for each combination of category, length, and book format
 
     # Check if metadata was passed
     if not other_metadata:
@@ -173,7 +418,7 @@ def process_books(books_data, other_metadata, processed_books, lock):
     # Process each item in response from Google Books API
     for item in books_data.get('items', []):
         # Check if max number of books reached
-        if len(books) >= MAX_NUM_BOOK_PER_COMBO:
+        if len(books) >= max_books:
             break
 
         # Generate published year for book
@@ -193,18 +438,17 @@ def process_books(books_data, other_metadata, processed_books, lock):
         )
         avg_rating = volume_info.get('averageRating', random.randint(1, 5))
 
-        # Ensure data includes an author; skip if missing
+        # Ensure data includes an author and title; skip if missing
         authors = volume_info.get('authors')
-        if not authors:
+        if not authors or not title:
             continue
         author = authors[0]
 
         # Ensure title-author combination has not been processed already; skip if it has
         title_author = f'{title.lower()}_{author.lower()}'
-        with lock:
-            if title_author in processed_books:
-                continue
-            processed_books.add(title_author)
+        if title_author in processed_books:
+            continue
+        processed_books.add(title_author)
 
         # Ensure description, thumbnail, and isbn_13 exist before adding book data
         if description and thumbnail and isbn_13:
@@ -224,4 +468,30 @@ def process_books(books_data, other_metadata, processed_books, lock):
 
 
 if __name__ == '__main__':
-    generate_book_data('data/books.json')
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Generate book data from the Google Books API.")
+    parser.add_argument('--output', default='data/books.json', help="Output file (.json for a JSON array, .ndjson for one book per line)")
+    parser.add_argument('--api-url', help="Google Books API URL (default: GOOGLE_BOOKS_API_URL)")
+    parser.add_argument('--max-books', type=int, default=100, help="Maximum number of books to generate")
+    parser.add_argument('--max-per-query', type=int, help="Maximum number of books per query (default: no limit)")
+    parser.add_argument('--pages', type=int, default=10, help="Maximum number of result pages per query")
+    parser.add_argument('--page-size', type=int, default=40, help="Number of results per page (at most 40)")
+    parser.add_argument('--rate', type=float, default=5.0, help="Maximum requests per second")
+    parser.add_argument('--concurrency', type=int, default=10, help="Number of queries fetched at once")
+    parser.add_argument('--max-retries', type=int, default=5, help="Retries for rate-limited or failed requests")
+    parser.add_argument('--cache-dir', default='data/.google_books_cache', help="Directory to cache responses in")
+    parser.add_argument('--no-cache', action='store_true', help="Do not read or write the response cache")
+
+    args = parser.parse_args()
+
+    asyncio.run(generate_book_data(
+        args.output,
+        api_url=args.api_url,
+        max_books=args.max_books,
+        max_per_query=args.max_per_query,
+        pages=args.pages,
+        page_size=args.page_size,
+        rate=args.rate,
+        concurrency=args.concurrency,
+        max_retries=args.max_retries,
+        cache_dir=None if args.no_cache else args.cache_dir
+    ))
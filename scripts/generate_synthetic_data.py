@@ -0,0 +1,291 @@
+import argparse
+import importlib.util
+import json
+import math
+import os
+import time
+from functools import lru_cache
+from io import BytesIO
+from multiprocessing import Pool
+import numpy as np
+from tqdm import tqdm
+from app.api.schemas import CATEGORIES, FORMATS, LENGTHS
+
+# Distribution weights for how published years should be assigned for each book (same as generate_book_data.py)
+PUBLISHED_YEAR_BINS = {
+    'old': {
+        'years': (1970, 1999),
+        'weight': 1
+    },
+    'recent': {
+        'years': (2000, 2020),
+        'weight': 10
+    },
+    'new': {
+        'years': (2021, 2024),
+        'weight': 5
+    }
+}
+
+# Distribution weights for categories, skewed the same way as the published years
+CATEGORY_WEIGHTS = {category: weight for category, weight in zip(CATEGORIES, [10, 8, 5, 3, 1])}
+
+# Word counts of descriptions are log-normal, fitted on data/books.json (median ~130 words)
+DESCRIPTION_LOG_MEAN = 4.88
+DESCRIPTION_LOG_STD = 0.88
+DESCRIPTION_MIN_WORDS = 10
+DESCRIPTION_MAX_WORDS = 600
+
+# Number of books per author on average. Authors are drawn with a Zipf skew, so a few are very prolific.
+BOOKS_PER_AUTHOR = 8
+
+# Size of the generated vocabulary, drawn with a Zipf skew like natural text
+VOCABULARY_SIZE = 20000
+
+SYLLABLES = [
+    'an', 'ar', 'bel', 'cor', 'da', 'el', 'fen', 'gar', 'hal', 'is', 'jor', 'ka', 'lin', 'mor', 'nex',
+    'or', 'pra', 'quin', 'ra', 'sol', 'tor', 'ul', 'vex', 'wyn', 'xa', 'yor', 'zen', 'tri', 'ion', 'ax'
+]
+
+
+def generate_synthetic_data(output_dir, num_books, seed=0, shard_size=100000, output_format='ndjson',
+                            workers=None, thumbnails=False, thumbnail_base_url='http://localhost:8000/thumbnails'):
+    """
+    Generates a deterministic synthetic book catalogue that conforms to BookSchema, without any network access.
+    The catalogue is split into shards that are generated in parallel. Every shard is seeded from (seed, shard),
+    so the output only depends on the seed and shard size, not on the number of workers.
+
+    Args:
+        output_dir (str): The directory to write the shards to.
+        num_books (int): The number of books to generate.
+        seed (int): The seed of the generator.
+        shard_size (int): The number of books per shard. A worker holds one shard in memory at a time.
+        output_format (str): 'ndjson', or 'parquet' (requires pyarrow).
+        workers (int): The number of processes to use. Defaults to the number of cores.
+        thumbnails (bool): Flag to also write a placeholder thumbnail image per book.
+        thumbnail_base_url (str): The URL the thumbnails directory will be served from.
+    """
+    # Checked up front, as the shards import pyarrow in the worker processes
+    if output_format == 'parquet' and importlib.util.find_spec('pyarrow') is None:
+        raise SystemExit("Writing Parquet requires pyarrow: pip install pyarrow")
+
+    os.makedirs(output_dir, exist_ok=True)
+    if thumbnails:
+        os.makedirs(os.path.join(output_dir, 'thumbnails'), exist_ok=True)
+
+    start = time.time()
+
+    num_shards = math.ceil(num_books / shard_size)
+    shards = [
+        (output_dir, seed, shard, shard * shard_size, min(shard_size, num_books - shard * shard_size), num_books,
+         output_format, thumbnails, thumbnail_base_url)
+        for shard in range(num_shards)
+    ]
+
+    with Pool(processes=workers) as pool:
+        paths = list(tqdm(pool.imap_unordered(generate_shard, shards), total=num_shards, desc="Generating shards"))
+
+    # Record how the catalogue was generated next to the shards
+    with open(os.path.join(output_dir, 'manifest.json'), 'w') as file:
+        json.dump({
+            'num_books': num_books,
+            'seed': seed,
+            'shard_size': shard_size,
+            'format': output_format,
+            'shards': sorted(os.path.basename(path) for path in paths)
+        }, file, indent=4)
+
+    end = time.time()
+    time_elapsed = end - start
+    print(f'Time elapsed: {time_elapsed} seconds')
+    print(f"Generated {num_books} books in {num_shards} shards in {output_dir}")
+
+
+def generate_shard(args):
+    """
+    Generates one shard of books and writes it to disk.
+
+    Args:
+        args (tuple): The output directory, seed, shard number, index of the first book, number of books in
+            the shard, number of books in the catalogue, output format, thumbnails flag and thumbnail base URL.
+
+    Returns:
+        str: The path to the written shard.
+    """
+    output_dir, seed, shard, first_index, num_books, total_books, output_format, thumbnails, thumbnail_base_url = args
+
+    # Shared vocabulary and author pool come from the seed alone, so every shard agrees on them
+    base_rng = np.random.default_rng(seed)
+    vocabulary = make_words(base_rng, VOCABULARY_SIZE)
+    word_weights = zipf_weights(VOCABULARY_SIZE)
+    num_authors = max(1, total_books // BOOKS_PER_AUTHOR)
+    author_weights = zipf_weights(num_authors)
+
+    rng = np.random.default_rng([seed, shard])
+    books = generate_books(rng, first_index, num_books, vocabulary, word_weights, author_weights, thumbnail_base_url)
+
+    if thumbnails:
+        for book in books:
+            write_placeholder_thumbnail(os.path.join(output_dir, 'thumbnails', f"{book['isbn_13']}.jpg"), book['title'])
+
+    path = os.path.join(output_dir, f"books-{shard:05d}.{output_format}")
+    if output_format == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        pq.write_table(pa.Table.from_pylist(books), path)
+    else:
+        with open(path, 'w') as file:
+            for book in books:
+                file.write(json.dumps(book) + '\n')
+    return path
+
+
+def generate_books(rng, first_index, num_books, vocabulary, word_weights, author_weights, thumbnail_base_url):
+    """
+    Generates the books of a shard. Every field is drawn for the whole shard at once.
+
+    Args:
+        rng (np.random.Generator): The shard's random generator.
+        first_index (int): The catalogue index of the first book, which determines its ISBN-13.
+        num_books (int): The number of books to generate.
+        vocabulary (np.ndarray): The words titles and descriptions are made of.
+        word_weights (np.ndarray): The sampling probability of each word.
+        author_weights (np.ndarray): The sampling probability of each author.
+        thumbnail_base_url (str): The URL thumbnails are served from.
+
+    Returns:
+        list: The generated books.
+    """
+    # Categorical fields
+    categories = rng.choice(list(CATEGORY_WEIGHTS), size=num_books, p=normalize(list(CATEGORY_WEIGHTS.values())))
+    formats = rng.choice(FORMATS, size=num_books)
+    lengths = rng.choice(LENGTHS, size=num_books)
+
+    # Published years are drawn from weighted bins
+    bins = [info['years'] for info in PUBLISHED_YEAR_BINS.values()]
+    chosen_bins = rng.choice(len(bins), size=num_books, p=normalize([info['weight'] for info in PUBLISHED_YEAR_BINS.values()]))
+    starts = np.array([years[0] for years in bins])[chosen_bins]
+    ends = np.array([years[1] for years in bins])[chosen_bins]
+    published_years = rng.integers(starts, ends + 1)
+
+    # Ratings are in half-star steps
+    ratings = np.round(rng.uniform(1, 5, size=num_books) * 2) / 2
+
+    # Authors are reused across books
+    authors = rng.choice(len(author_weights), size=num_books, p=author_weights)
+
+    # Text lengths
+    title_lengths = np.minimum(rng.geometric(0.4, size=num_books), 8)
+    description_lengths = np.clip(
+        rng.lognormal(DESCRIPTION_LOG_MEAN, DESCRIPTION_LOG_STD, size=num_books).astype(int),
+        DESCRIPTION_MIN_WORDS,
+        DESCRIPTION_MAX_WORDS
+    )
+    # Words are drawn as vocabulary indices and only joined into strings per book, as an array of every word
+    # of the shard as strings takes about 12 KB per book
+    words = rng.choice(len(vocabulary), size=int(title_lengths.sum() + description_lengths.sum()), p=word_weights)
+    vocabulary = vocabulary.tolist()
+
+    books = []
+    offset = 0
+    for i in range(num_books):
+        title_words = words[offset:offset + title_lengths[i]]
+        offset += title_lengths[i]
+        description_words = words[offset:offset + description_lengths[i]]
+        offset += description_lengths[i]
+
+        isbn_13 = make_isbn_13(first_index + i)
+        books.append({
+            'isbn_13': isbn_13,
+            'title': ' '.join([vocabulary[word] for word in title_words]).title(),
+            'author': make_author_name(int(authors[i])),
+            'description': ' '.join([vocabulary[word] for word in description_words]).capitalize() + '.',
+            'category': str(categories[i]),
+            'format': str(formats[i]),
+            'length': str(lengths[i]),
+            'published_year': int(published_years[i]),
+            'rating': float(ratings[i]),
+            'thumbnail': f"{thumbnail_base_url}/{isbn_13}.jpg"
+        })
+    return books
+
+
+def make_isbn_13(index):
+    """
+    Creates a valid, unique ISBN-13 for a catalogue index.
+    """
+    body = f"978{index:09d}"
+    total = sum(int(digit) * (1 if position % 2 == 0 else 3) for position, digit in enumerate(body))
+    return body + str((10 - total % 10) % 10)
+
+
+def make_words(rng, count):
+    """
+    Creates a vocabulary of pronounceable pseudo-words.
+    """
+    syllable_counts = rng.integers(1, 4, size=count)
+    syllables = rng.choice(SYLLABLES, size=int(syllable_counts.sum()))
+    words, offset = [], 0
+    for syllable_count in syllable_counts:
+        words.append(''.join(syllables[offset:offset + syllable_count]))
+        offset += syllable_count
+    return np.array(words)
+
+
+@lru_cache(maxsize=None)
+def make_author_name(author):
+    """
+    Creates a deterministic name for an author id.
+    """
+    rng = np.random.default_rng([author, 7])
+    first, last = rng.choice(SYLLABLES, size=2), rng.choice(SYLLABLES, size=3)
+    return f"{''.join(first).capitalize()} {''.join(last).capitalize()}"
+
+
+def zipf_weights(count, exponent=1.1):
+    """
+    Returns Zipf sampling probabilities for count items.
+    """
+    return normalize(1 / np.arange(1, count + 1) ** exponent)
+
+
+def normalize(weights):
+    weights = np.asarray(weights, dtype=float)
+    return weights / weights.sum()
+
+
+def write_placeholder_thumbnail(path, title):
+    """
+    Writes a small solid-colour cover image, coloured by the title.
+    """
+    from PIL import Image
+    color = tuple(int.from_bytes(title.encode()[:64], 'little') >> shift & 0xFF for shift in (0, 8, 16))
+    buffer = BytesIO()
+    Image.new('RGB', (128, 192), color).save(buffer, format='JPEG', quality=70)
+    with open(path, 'wb') as file:
+        file.write(buffer.getvalue())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate a synthetic book catalogue for scale testing.")
+    parser.add_argument('--output-dir', default='data/synthetic', help="Directory to write the shards to")
+    parser.add_argument('--num-books', type=int, default=1000000, help="Number of books to generate")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the generator")
+    parser.add_argument('--shard-size', type=int, default=100000, help="Number of books per shard")
+    parser.add_argument('--format', choices=['ndjson', 'parquet'], default='ndjson', help="Output format")
+    parser.add_argument('--workers', type=int, help="Number of processes (default: number of cores)")
+    parser.add_argument('--thumbnails', action='store_true', help="Also write a placeholder thumbnail per book")
+    parser.add_argument('--thumbnail-base-url', default='http://localhost:8000/thumbnails', help="URL the thumbnails will be served from")
+
+    args = parser.parse_args()
+
+    generate_synthetic_data(
+        args.output_dir,
+        args.num_books,
+        seed=args.seed,
+        shard_size=args.shard_size,
+        output_format=args.format,
+        workers=args.workers,
+        thumbnails=args.thumbnails,
+        thumbnail_base_url=args.thumbnail_base_url
+    )
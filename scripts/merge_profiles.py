@@ -0,0 +1,126 @@
+import argparse
+import glob
+import html
+import os
+import zlib
+from collections import Counter
+from utils.profiling import read_collapsed, write_collapsed
+
+SVG_WIDTH = 1200
+FRAME_HEIGHT = 16
+FONT_SIZE = 11
+
+
+def merge_profiles(profile_dir='profiles', output_dir=None, routes=None, min_width=0.5):
+    """
+    Merges the per-request profiles of every route into one collapsed file and one flame graph per route.
+
+    Args:
+        profile_dir (str): The PROFILING_DIR the app writes to, with one sub-directory per route.
+        output_dir (str): The directory for the merged files. Defaults to profile_dir.
+        routes (list): The route directories to merge. Every route is merged if not passed.
+        min_width (float): Frames narrower than this many pixels are left out of the flame graph.
+
+    Returns:
+        dict: The number of profiled requests of every merged route.
+    """
+    output_dir = output_dir or profile_dir
+    merged = {}
+    for route_dir in sorted(glob.glob(os.path.join(profile_dir, '*', ''))):
+        route = os.path.basename(os.path.normpath(route_dir))
+        if routes and route not in routes:
+            continue
+        paths = sorted(glob.glob(os.path.join(route_dir, '*.folded')))
+        if not paths:
+            continue
+
+        stacks = Counter()
+        for path in paths:
+            read_collapsed(path, stacks)
+
+        write_collapsed(stacks, os.path.join(output_dir, f"{route}.folded"))
+        with open(os.path.join(output_dir, f"{route}.svg"), 'w') as file:
+            file.write(render_flame_graph(stacks, f"{route} ({len(paths)} requests)", min_width))
+        merged[route] = len(paths)
+        print(f"{route}: {len(paths)} requests, {sum(stacks.values())} samples")
+    return merged
+
+
+def render_flame_graph(stacks, title, min_width=0.5):
+    """
+    Renders collapsed stacks as a self-contained SVG flame graph. The root is at the bottom, the width of a frame
+    is its share of the samples, and hovering a frame shows its sample count.
+
+    Args:
+        stacks (dict): The number of samples of every collapsed stack.
+        title (str): The title drawn above the graph.
+        min_width (float): Frames narrower than this many pixels are left out.
+
+    Returns:
+        str: The SVG document.
+    """
+    # Merge the stacks into a tree of {name: [samples, children]}
+    root = [0, {}]
+    for stack, count in stacks.items():
+        root[0] += count
+        node = root
+        for name in stack.split(';'):
+            node = node[1].setdefault(name, [0, {}])
+            node[0] += count
+
+    total = root[0] or 1
+    scale = (SVG_WIDTH - 20) / total
+    frames = []
+    depth = 0
+
+    def layout(children, x, level):
+        nonlocal depth
+        for name, (count, grandchildren) in sorted(children.items()):
+            width = count * scale
+            if width >= min_width:
+                frames.append((name, count, x, level, width))
+                depth = max(depth, level + 1)
+                layout(grandchildren, x, level + 1)
+            x += width
+
+    layout(root[1], 10.0, 0)
+
+    height = (depth + 3) * FRAME_HEIGHT
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{SVG_WIDTH}" height="{height}" '
+        f'font-family="monospace" font-size="{FONT_SIZE}">',
+        '<rect width="100%" height="100%" fill="#f8f8f8"/>',
+        f'<text x="{SVG_WIDTH / 2}" y="{FRAME_HEIGHT}" text-anchor="middle" font-size="{FONT_SIZE + 3}">'
+        f'{html.escape(title)}</text>'
+    ]
+    for name, count, x, level, width in frames:
+        y = height - (level + 1) * FRAME_HEIGHT
+        # The colour depends only on the name, so a function has the same colour in every graph
+        hue = zlib.crc32(name.encode()) % 60
+        label = html.escape(name)
+        # Roughly 0.6em per monospace character
+        visible = int(width / (FONT_SIZE * 0.6))
+        if len(name) <= visible:
+            text = label
+        else:
+            text = html.escape(name[:visible - 2]) + '..' if visible > 3 else ''
+        parts.append(
+            f'<g><title>{label} ({count} samples, {count / total:.2%})</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{width:.1f}" height="{FRAME_HEIGHT - 1}" '
+            f'fill="hsl({hue}, 85%, 60%)" rx="2"/>'
+            f'<text x="{x + 3:.1f}" y="{y + FRAME_HEIGHT - 4}">{text}</text></g>'
+        )
+    parts.append('</svg>')
+    return '\n'.join(parts)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Merge request profiles into one flame graph per route.")
+    parser.add_argument('profile_dir', nargs='?', default='profiles', help="Directory the app writes profiles to")
+    parser.add_argument('--output-dir', help="Directory for the merged .folded and .svg files (default: profile_dir)")
+    parser.add_argument('--route', action='append', dest='routes',
+                        help="Route directory to merge, e.g. GET_api_v1_search (repeatable; default: all)")
+    parser.add_argument('--min-width', type=float, default=0.5, help="Minimum frame width in pixels")
+
+    args = parser.parse_args()
+    merge_profiles(args.profile_dir, output_dir=args.output_dir, routes=args.routes, min_width=args.min_width)
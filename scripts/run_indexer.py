@@ -0,0 +1,98 @@
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
+import signal
+import threading
+from pymongo import MongoClient
+from app.catalogues import catalogue_config, catalogue_ids
+from app.config import Config
+from app.models.weighted_embedding_model import WeightedEmbeddingModel
+from app.services.vector_service import VectorService, create_vector_index
+from app.workers.indexer import BookIndexer
+from utils.logger import setup_logger, logging
+import os
+
+
+def run_indexer(use_change_stream=True, batch_size=None, max_wait=None, catalogues=None):
+    """
+    Runs the indexer until it receives SIGINT or SIGTERM.
+    Each catalogue is indexed by its own thread, and they share the MongoDB client and the embedding model.
+
+    Args:
+        use_change_stream (bool): Flag to tail a change stream instead of polling 'updated_at'.
+        batch_size (int): The maximum number of books to embed in one batch.
+        max_wait (float): The maximum number of seconds a change waits before its batch is flushed.
+        catalogues (list): The ids of the catalogues to index. Defaults to every catalogue.
+    """
+    config = {key: getattr(Config, key) for key in dir(Config) if key.isupper()}
+
+    client = MongoClient(config['MONGO_URI'])
+    vector_service = VectorService(
+        index=create_vector_index(catalogue_config(config)),
+        model=WeightedEmbeddingModel(model_name=config['HF_MODEL_NAME'], weights=config['FIELD_WEIGHTS']),
+        upsert_batch_size=config['VECTOR_UPSERT_BATCH_SIZE'],
+        mode=config['RETRIEVAL_MODE'],
+        field_weights=config['FIELD_WEIGHTS'],
+        multi_vector_fields=config['MULTI_VECTOR_FIELDS']
+    )
+
+    indexers = []
+    for catalogue_id in catalogues or catalogue_ids(config):
+        catalogue = catalogue_config(config, catalogue_id)
+        catalogue_vectors = vector_service if catalogue_id == config['DEFAULT_CATALOGUE'] else \
+            vector_service.for_index(create_vector_index(catalogue, shared_index=vector_service.index))
+        indexers.append(BookIndexer(
+            client[catalogue['MONGO_DB']],
+            catalogue_vectors,
+            batch_size=batch_size or config['INDEXER_BATCH_SIZE'],
+            max_wait=max_wait or config['INDEXER_MAX_WAIT_SECONDS'],
+            poll_interval=config['INDEXER_POLL_INTERVAL_SECONDS'],
+            max_retries=config['INDEXER_MAX_RETRIES']
+        ))
+
+    # Stop gracefully so the current batches are flushed and checkpointed
+    stop_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+
+    threads = [
+        threading.Thread(target=indexer.run, kwargs={'use_change_stream': use_change_stream, 'stop_event': stop_event})
+        for indexer in indexers
+    ]
+    try:
+        for thread in threads:
+            thread.start()
+        # Signals are only delivered to the main thread, so it waits with a timeout instead of blocking in join
+        while not stop_event.wait(1.0) and any(thread.is_alive() for thread in threads):
+            pass
+    finally:
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+        client.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Keep the vector index in sync with MongoDB.")
+    parser.add_argument('--poll', action='store_true', help="Poll the 'updated_at' field instead of using change streams")
+    parser.add_argument('--batch-size', type=int, help="Maximum number of books to embed per batch")
+    parser.add_argument('--max-wait', type=float, help="Maximum seconds a change waits before being flushed")
+    parser.add_argument('--catalogue', action='append', dest='catalogues',
+                        help="Catalogue to index, can be repeated (default: every catalogue)")
+
+    args = parser.parse_args()
+
+    setup_logger(
+        log_level=getattr(logging, os.getenv('LOG_LEVEL', 'INFO')),
+        log_file=os.getenv('LOG_FILE', 'logs/indexer.log'),
+        log_format=os.getenv('LOG_FORMAT', 'text'),
+        debug_sample_rate=float(os.getenv('LOG_DEBUG_SAMPLE_RATE', 1.0))
+    )
+
+    run_indexer(
+        use_change_stream=not args.poll,
+        batch_size=args.batch_size,
+        max_wait=args.max_wait,
+        catalogues=args.catalogues
+    )
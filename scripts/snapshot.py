@@ -0,0 +1,118 @@
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
+import json
+import time
+from pymongo import MongoClient
+from app.catalogues import catalogue_config
+from app.config import Config
+from app.services.vector_service import create_vector_index
+from app.workers.snapshot import export_snapshot, import_snapshot
+from utils.logger import setup_logger, logging
+import os
+
+# Settings that determine what the stored vectors mean. A snapshot is only usable with the same settings.
+VECTOR_SETTINGS = ('HF_MODEL_NAME', 'RETRIEVAL_MODE', 'FIELD_WEIGHTS', 'MULTI_VECTOR_FIELDS')
+
+
+def export_data(path, vector_dtype='float32', batch_size=10000, catalogue=None):
+    """
+    Exports the books collection and the vector index to a snapshot directory.
+
+    Args:
+        path (str): The directory to write the snapshot to. Must not exist.
+        vector_dtype (str): 'float32' or 'float16'.
+        batch_size (int): The number of books per Parquet row group.
+        catalogue (str): The catalogue. Defaults to DEFAULT_CATALOGUE.
+
+    Returns:
+        dict: The snapshot manifest.
+    """
+    config = catalogue_config({key: getattr(Config, key) for key in dir(Config) if key.isupper()}, catalogue)
+    client = MongoClient(config['MONGO_URI'])
+    try:
+        return export_snapshot(
+            client[config['MONGO_DB']],
+            create_vector_index(config),
+            path,
+            vector_dtype=vector_dtype,
+            batch_size=batch_size,
+            metadata={key: config.get(key) for key in VECTOR_SETTINGS}
+        )
+    finally:
+        client.close()
+
+
+def import_data(path, replace=False, force=False, batch_size=10000, catalogue=None):
+    """
+    Loads the books collection and the vector index from a snapshot directory, without embedding anything.
+
+    Args:
+        path (str): The snapshot directory.
+        replace (bool): Flag to overwrite existing books and vectors.
+        force (bool): Flag to import a snapshot exported with different embedding settings.
+        batch_size (int): The number of books inserted at once.
+        catalogue (str): The catalogue. Defaults to DEFAULT_CATALOGUE.
+
+    Returns:
+        dict: The snapshot manifest.
+    """
+    config = catalogue_config({key: getattr(Config, key) for key in dir(Config) if key.isupper()}, catalogue)
+    with open(os.path.join(path, 'manifest.json'), 'r') as file:
+        metadata = json.load(file).get('metadata', {})
+
+    # Vectors from another model or retrieval mode would be imported fine but make every search meaningless
+    mismatched = [key for key in VECTOR_SETTINGS if key in metadata and metadata[key] != config.get(key)]
+    if mismatched and not force:
+        raise SystemExit(
+            "The snapshot was exported with different embedding settings: "
+            + ", ".join(f"{key}={metadata[key]!r} (configured: {config.get(key)!r})" for key in mismatched)
+            + ". Pass --force to import it anyway."
+        )
+
+    client = MongoClient(config['MONGO_URI'])
+    try:
+        return import_snapshot(client[config['MONGO_DB']], create_vector_index(config), path, replace=replace,
+                               batch_size=batch_size)
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export or import a snapshot of the books and their vectors.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help="Write a snapshot of MongoDB and the vector index")
+    export_parser.add_argument('path', help="Snapshot directory to create")
+    export_parser.add_argument('--dtype', choices=['float32', 'float16'], default='float32',
+                               help="Precision the vectors are stored with")
+    export_parser.add_argument('--batch-size', type=int, default=10000, help="Number of books per row group")
+    export_parser.add_argument('--catalogue', help="Catalogue to export (default: DEFAULT_CATALOGUE)")
+
+    import_parser = subparsers.add_parser('import', help="Load MongoDB and the vector index from a snapshot")
+    import_parser.add_argument('path', help="Snapshot directory")
+    import_parser.add_argument('--replace', action='store_true', help="Overwrite existing books and vectors")
+    import_parser.add_argument('--force', action='store_true',
+                               help="Import a snapshot exported with different embedding settings")
+    import_parser.add_argument('--batch-size', type=int, default=10000, help="Number of books inserted at once")
+    import_parser.add_argument('--catalogue', help="Catalogue to import into (default: DEFAULT_CATALOGUE)")
+
+    args = parser.parse_args()
+
+    setup_logger(
+        log_level=getattr(logging, os.getenv('LOG_LEVEL', 'INFO')),
+        log_file=os.getenv('LOG_FILE', 'logs/snapshot.log'),
+        log_format=os.getenv('LOG_FORMAT', 'text'),
+        debug_sample_rate=float(os.getenv('LOG_DEBUG_SAMPLE_RATE', 1.0))
+    )
+
+    start = time.time()
+    if args.command == 'export':
+        manifest = export_data(args.path, vector_dtype=args.dtype, batch_size=args.batch_size, catalogue=args.catalogue)
+        print(f"Exported {manifest['book_count']} books and {manifest['vectors']['count']} vectors to {args.path}")
+    else:
+        manifest = import_data(args.path, replace=args.replace, force=args.force, batch_size=args.batch_size,
+                               catalogue=args.catalogue)
+        print(f"Imported {manifest['book_count']} books and {manifest['vectors']['count']} vectors from {args.path}")
+    print(f"Time elapsed: {time.time() - start:.1f} seconds")
@@ -1,9 +1,9 @@
 from pymongo import MongoClient
 from pymongo.errors import BulkWriteError
 import os
-import json
 import time
-from utils.helpers import generate_s3_key
+from datetime import datetime, timezone
+from utils.helpers import load_books, generate_s3_key
 
 
 def upload_data(file_path):
@@ -20,12 +20,13 @@ def upload_data(file_path):
     collection = db['books']
 
     # Load book data from JSON file
-    with open(file_path, 'r') as file:
-        books = json.load(file)
+    books = load_books(file_path)
 
-    # Update the thumbnail field with the s3 key for all books
+    # Update the thumbnail field with the s3 key for all books with a thumbnail, and stamp them for the indexer
+    now = datetime.now(timezone.utc)
     for book in books:
-        book['thumbnail'] = generate_s3_key(book)
+        book['thumbnail'] = generate_s3_key(book) if book.get('thumbnail') else None
+        book['updated_at'] = now
 
     # Insert all the data into DB
     try:
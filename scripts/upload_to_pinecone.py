@@ -1,47 +1,66 @@
-import json
 import os
 import time
 from tqdm import tqdm
 from app.models.weighted_embedding_model import WeightedEmbeddingModel
+from app.services.local_vector_index import LocalVectorIndex
+from app.services.vector_service import create_vector_index
 import math
-from pinecone import Pinecone
+from utils.helpers import load_books, parse_field_weights
 
 
-def upload_data(file_path):
+def upload_data(file_path, model=None):
     """
-    Uploads book data to Pinecone vector index from book JSON file.
+    Uploads book data to the vector index (Pinecone, or the local index if VECTOR_BACKEND=local) from book JSON file.
 
     Args:
         file_path (str): Path to the book data file.
+        model (WeightedEmbeddingModel): A model to use instead of loading HF_MODEL_NAME.
     """
     # Load book data from JSON file
-    with open(file_path, 'r') as file:
-        books = json.load(file)
+    books = load_books(file_path)
 
-    # Initialize Pinecone
-    pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-    index = pc.Index(host=os.getenv("PINECONE_INDEX_HOST"))
+    # Initialize vector index
+    index = create_vector_index({
+        'VECTOR_BACKEND': os.getenv("VECTOR_BACKEND"),
+        'LOCAL_VECTOR_INDEX_PATH': os.getenv("LOCAL_VECTOR_INDEX_PATH", "data/vectors.npz"),
+        'PINECONE_API_KEY': os.getenv("PINECONE_API_KEY"),
+        'PINECONE_INDEX_HOST': os.getenv("PINECONE_INDEX_HOST")
+    })
 
     model_name = os.getenv("HF_MODEL_NAME")
     chunk_size = 1000  # Size of each chunk
     batch_size = 64 # Size of batch for encoder model
 
-    model = WeightedEmbeddingModel(model_name=model_name, batch_size=batch_size, use_mps=True)
+    if model is None:
+        weights = parse_field_weights(os.getenv("FIELD_WEIGHTS"))
+        model = WeightedEmbeddingModel(model_name=model_name, batch_size=batch_size, use_mps=True, weights=weights)
+
+    # In the multi-vector retrieval mode the per-field vectors are stored instead of one weighted vector
+    if os.getenv("RETRIEVAL_MODE", "single") == 'multi':
+        fields = [field.strip() for field in os.getenv("MULTI_VECTOR_FIELDS", "").split(',') if field.strip()] or None
+        embed = lambda chunk: model.embed_multi(chunk, fields)
+    else:
+        embed = model.embed
 
     # Split data into chunks and embed each chunk
     chunks = create_chunks(books, chunk_size=chunk_size)
     
     embeddings = []
     for chunk in tqdm(chunks, total=len(chunks), desc="Processing chunks", unit="chunk"):
-        embeddings.extend(model.embed(chunk))
+        embeddings.extend(embed(chunk))
 
     vectors = [
         (book["isbn_13"], embedding)
         for book, embedding in zip(books, embeddings)
     ]
 
-    result = index.upsert(vectors=vectors)
-    print(f"Upserted {result['upserted_count']} vectors.")
+    # Pinecone limits the size of each request. The local index is written to disk on every upsert, so it gets a single one.
+    upsert_batch_size = len(vectors) if isinstance(index, LocalVectorIndex) else int(os.getenv("VECTOR_UPSERT_BATCH_SIZE", 100))
+    upserted_count = 0
+    for start in range(0, len(vectors), max(upsert_batch_size, 1)):
+        result = index.upsert(vectors=vectors[start:start + upsert_batch_size])
+        upserted_count += result['upserted_count']
+    print(f"Upserted {upserted_count} vectors.")
 
 
 def create_chunks(data, chunk_size):
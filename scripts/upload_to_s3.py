@@ -1,4 +1,7 @@
 import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from collections import Counter
+import hashlib
 import aioboto3
 import botocore.exceptions
 import aiohttp
@@ -7,102 +10,381 @@ import json
 from io import BytesIO
 from tqdm.asyncio import tqdm as atqdm
 import time
-from utils.helpers import generate_s3_key
+from utils.helpers import load_books, generate_s3_key, generate_rendition_key
+from utils.images import create_renditions, RENDITION_CONTENT_TYPE, RENDITION_WIDTHS
 
+DEFAULT_MANIFEST_PATH = 'data/thumbnail_manifest.json'
 
-async def upload_data(file_path):
+
+async def upload_data(file_path, manifest_path=DEFAULT_MANIFEST_PATH):
     """
     Uploads book thumbnails from book JSON file to an AWS S3 bucket asynchronously.
+    Every thumbnail is stored along with its WebP renditions, which are created in a process pool.
+
+    A local manifest of (isbn_13, source URL, ETag/Last-Modified, content hash) makes re-runs incremental:
+    sources are requested conditionally, unchanged images are skipped, and an image shared by several
+    ISBNs is only uploaded once and then copied server-side. The manifest is only trusted for objects that a
+    HEAD request finds in the bucket, so thumbnails deleted behind its back are uploaded again.
 
     Args:
         file_path (str): The path to the JSON file containing book data.
+        manifest_path (str): The path to the manifest JSON file.
     """
     # Retrieve AWS credentials for client
     bucket_name = os.getenv('AWS_BUCKET_NAME')
     region = os.getenv('AWS_REGION')
     access_key_id = os.getenv('AWS_ACCESS_KEY_ID')
     secret_access_key = os.getenv('AWS_SECRET_ACCESS_KEY')
+    endpoint_url = os.getenv('AWS_ENDPOINT_URL') or None
 
     # Access book data from file
-    with open(file_path, 'r') as file:
-        books = json.load(file)
+    books = load_books(file_path)
+
+    manifest = ThumbnailManifest(manifest_path)
+
+    # Process pool for creating the thumbnail renditions off the event loop
+    pool = ProcessPoolExecutor()
 
     # Create asynchronous clients for HTTP req and S3 client
     async with aiohttp.ClientSession() as session, aioboto3.Session().client(
         's3',
         region_name=region,
         aws_access_key_id=access_key_id,
-        aws_secret_access_key=secret_access_key
+        aws_secret_access_key=secret_access_key,
+        endpoint_url=endpoint_url
     ) as s3_client:
         num_books = len(books)
-
-        # Tasks will hold the coroutines to be executed
-        tasks = []
+        uploader = ThumbnailUploader(session, s3_client, bucket_name, manifest, pool)
 
         # Progress bar
         pbar = atqdm(total=num_books, desc="Uploading Book Thumbnails to S3")
 
         # Setup and execute coroutines
-        for book in books:
-
-            # Extract thumbail from JSON file and generate unique S3 key
-            thumbnail_url = book['thumbnail']
-            s3_key = generate_s3_key(book)
-
-            # Create coroutine task and schedule it for execution
-            task = asyncio.create_task(download_and_upload_thumbnail(
-                session=session,
-                s3_client=s3_client,
-                thumbnail_url=thumbnail_url,
-                bucket_name=bucket_name,
-                s3_key=s3_key,
-                pbar=pbar
-            ))
-            tasks.append(task)
+        tasks = [
+            asyncio.create_task(uploader.sync_thumbnail(book['isbn_13'], book['thumbnail'], generate_s3_key(book), pbar))
+            for book in books
+        ]
 
-        # Wait for coroutines to finish and count successes
-        results = await asyncio.gather(*tasks)
+        # Wait for coroutines to finish and count outcomes
+        results = Counter(await asyncio.gather(*tasks))
         pbar.close()
-        num_thumbnails_uploaded = sum(results)
 
-    print(f'Uploaded {num_thumbnails_uploaded}/{num_books} thumbails.')
+    pool.shutdown()
+    manifest.save()
 
+    print(f"Synced {num_books - results['failed']}/{num_books} thumbnails: "
+          f"{results['uploaded']} uploaded, {results['copied']} copied, {results['unchanged']} unchanged, {results['failed']} failed.")
+    print(f"Downloaded {uploader.bytes_downloaded} bytes, uploaded {uploader.bytes_uploaded} bytes.")
 
-async def download_and_upload_thumbnail(session, s3_client, thumbnail_url, bucket_name, s3_key, pbar):
+
+class ThumbnailManifest:
+    """
+    A local record of the source and content hash of every thumbnail in the bucket.
     """
-    Downloads a thumbnail image from a URL and uploads it to an S3 bucket.
 
-    Args:
-        session (aiohttp.ClientSession): The asynchronous HTTP session.
-        s3_client (aioboto3.S3.Client): The asynchronous S3 client.
-        thumbnail_url (str): The URL of the thumbnail image.
-        bucket_name (str): The name of the S3 bucket.
-        s3_key (str): The S3 key for the uploaded image.
-        pbar (tqdm): The progress bar to update.
-
-    Returns:
-        bool: True if the thumbnail was successfully uploaded, False otherwise.
+    def __init__(self, path):
+        """
+        Loads the manifest from path, or starts an empty one if it does not exist.
+
+        Args:
+            path (str): The path to the manifest JSON file.
+        """
+        self._path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                self.entries = json.load(file).get('thumbnails', {})
+
+        # S3 key of an uploaded thumbnail for each content hash, used to deduplicate shared images
+        self.keys_by_hash = {}
+        for isbn_13, entry in self.entries.items():
+            self.keys_by_hash.setdefault(entry['sha256'], entry['s3_key'])
+
+
+    def record(self, isbn_13, entry):
+        """
+        Records the thumbnail that is now stored for a book.
+
+        Args:
+            isbn_13 (str): The ISBN-13 of the book.
+            entry (dict): The source URL, S3 key, content hash and cache validators of the thumbnail.
+        """
+        self.release(isbn_13, entry['sha256'])
+        self.entries[isbn_13] = entry
+        self.keys_by_hash.setdefault(entry['sha256'], entry['s3_key'])
+
+
+    def release(self, isbn_13, sha256):
+        """
+        Stops using a book's object as a copy source for its recorded content, as it is being overwritten.
+
+        Args:
+            isbn_13 (str): The ISBN-13 of the book.
+            sha256 (str): The content hash the object will hold.
+        """
+        previous = self.entries.get(isbn_13)
+        if previous and previous['sha256'] != sha256 and self.keys_by_hash.get(previous['sha256']) == previous['s3_key']:
+            del self.keys_by_hash[previous['sha256']]
+
+
+    def remove(self, isbns):
+        """
+        Forgets the thumbnails of books that were deleted from the bucket, so they are uploaded again on the next run.
+
+        Args:
+            isbns (iterable): The ISBN-13s of the books.
+
+        Returns:
+            int: The number of removed entries.
+        """
+        removed = sum(self.entries.pop(isbn_13, None) is not None for isbn_13 in isbns)
+
+        # A deleted object cannot be a copy source, but another book with the same image may still be one
+        self.keys_by_hash = {}
+        for entry in self.entries.values():
+            self.keys_by_hash.setdefault(entry['sha256'], entry['s3_key'])
+        return removed
+
+
+    def save(self):
+        """
+        Atomically writes the manifest to disk.
+        """
+        manifest_dir = os.path.dirname(self._path)
+        if manifest_dir and not os.path.exists(manifest_dir):
+            os.makedirs(manifest_dir)
+
+        tmp_path = f"{self._path}.tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump({'version': 1, 'thumbnails': self.entries}, file, indent=4)
+        os.replace(tmp_path, self._path)
+
+
+class ThumbnailUploader:
+    """
+    Syncs thumbnails to S3, skipping unchanged images and deduplicating identical ones.
     """
-    try:
-        # Asynchronously download data in memory, and then upload to S3
-        async with session.get(thumbnail_url) as response:
-            if response.status == 200:
-                image_data = BytesIO(await response.read())
-                await s3_client.upload_fileobj(image_data, bucket_name, s3_key)
-                return True
+
+    def __init__(self, session, s3_client, bucket_name, manifest, pool):
+        """
+        Args:
+            session (aiohttp.ClientSession): The asynchronous HTTP session.
+            s3_client (aioboto3.S3.Client): The asynchronous S3 client.
+            bucket_name (str): The name of the S3 bucket.
+            manifest (ThumbnailManifest): The manifest of previously uploaded thumbnails.
+            pool (ProcessPoolExecutor): The process pool used to create the renditions.
+        """
+        self._session = session
+        self._s3_client = s3_client
+        self._bucket_name = bucket_name
+        self._manifest = manifest
+        self._pool = pool
+
+        # In-flight downloads by source URL and uploads by content hash, so each happens once per run.
+        # Only the content hash of completed downloads is kept, so image bytes are not held for the whole run.
+        self._downloads = {}
+        self._url_hashes = {}
+        self._uploads = {}
+        # Keys found in or written to the bucket in this run, and the in-flight copies reading each key
+        self._verified = set()
+        self._readers = {}
+
+        self.bytes_downloaded = 0
+        self.bytes_uploaded = 0
+
+
+    async def sync_thumbnail(self, isbn_13, thumbnail_url, s3_key, pbar):
+        """
+        Makes sure a book's thumbnail and renditions in S3 match its source image.
+
+        Args:
+            isbn_13 (str): The ISBN-13 of the book.
+            thumbnail_url (str): The URL of the thumbnail image.
+            s3_key (str): The S3 key for the uploaded image.
+            pbar (tqdm): The progress bar to update.
+
+        Returns:
+            str: 'uploaded', 'copied', 'unchanged' or 'failed'.
+        """
+        try:
+            entry = self._manifest.entries.get(isbn_13)
+            # Only revalidate against the source if it is the same URL that was uploaded before
+            known = entry if entry and entry['url'] == thumbnail_url and entry['s3_key'] == s3_key else None
+            # The object may have been deleted by a lifecycle rule, the console or another tool
+            if known and not await self._exists(s3_key):
+                known = None
+
+            if not known and thumbnail_url in self._url_hashes:
+                # Another book already fetched this URL in this run, so its content hash is known
+                image_data = None
+                sha256, validators = self._url_hashes[thumbnail_url]
+            else:
+                # Books sharing a source URL share one in-flight download, unless they hold different validators
+                download_key = (thumbnail_url, known and known.get('etag'), known and known.get('last_modified'))
+                download = self._downloads.get(download_key)
+                if download is None:
+                    download = asyncio.ensure_future(self._download(thumbnail_url, known))
+                    download.add_done_callback(lambda _: self._downloads.pop(download_key, None))
+                    self._downloads[download_key] = download
+                image_data, validators = await download
+
+                if image_data is None:
+                    # 304 Not Modified
+                    return 'unchanged'
+
+                sha256 = hashlib.sha256(image_data).hexdigest()
+                self._url_hashes[thumbnail_url] = (sha256, validators)
+
+            new_entry = {'url': thumbnail_url, 's3_key': s3_key, 'sha256': sha256, **validators}
+            if known and known['sha256'] == sha256:
+                # The source does not support conditional requests, but the content is the same
+                self._manifest.record(isbn_13, new_entry)
+                return 'unchanged'
+
+            # Copies of the previous content must not read the object from now on
+            self._manifest.release(isbn_13, sha256)
+
+            # Upload each distinct image once; other ISBNs with the same image get a server-side copy
+            status = 'copied'
+            source_key = self._manifest.keys_by_hash.get(sha256)
+            if source_key is not None and not await self._exists(source_key):
+                self._manifest.keys_by_hash.pop(sha256, None)
+                source_key = None
+            elif source_key is not None and self._manifest.keys_by_hash.get(sha256) != source_key:
+                # The source was released while its existence was checked
+                source_key = None
+            if source_key is None:
+                upload = self._uploads.get(sha256)
+                if upload is None and image_data is None:
+                    # The content was downloaded for another book, whose object is gone
+                    image_data, _ = await self._download(thumbnail_url, None)
+                if upload is None:
+                    upload = asyncio.ensure_future(self._upload(image_data, s3_key))
+                    self._uploads[sha256] = upload
+                source_key = await upload
+
+            if source_key == s3_key:
+                status = 'uploaded' if sha256 in self._uploads else 'unchanged'
             else:
-                print(f'Failed to download image from {thumbnail_url}. Status: {response.status}')
-    except aiohttp.ClientError as e:
-        print(f'HTTP client error occurred: {e}')
-    except botocore.exceptions.ClientError as e:
-        print(f"An AWS service error occurred: {e}")
-    except Exception as e:
-        print(f"An error occurred: {e}")
-    finally:
-        pbar.update(1) # Update progress bar
-    
-    # Return False if there are any errors or exceptions
-    return False
+                await self._copy(source_key, s3_key)
+
+            self._manifest.record(isbn_13, new_entry)
+            return status
+        except aiohttp.ClientError as e:
+            print(f'HTTP client error occurred: {e}')
+        except botocore.exceptions.ClientError as e:
+            print(f"An AWS service error occurred: {e}")
+        except Exception as e:
+            print(f"An error occurred: {e}")
+        finally:
+            pbar.update(1) # Update progress bar
+
+        # Return 'failed' if there are any errors or exceptions
+        return 'failed'
+
+
+    async def _exists(self, s3_key):
+        """
+        Returns whether an object exists in the bucket. Keys found or written earlier in the run are not requested again.
+        """
+        if s3_key in self._verified:
+            return True
+        try:
+            await self._s3_client.head_object(Bucket=self._bucket_name, Key=s3_key)
+        except botocore.exceptions.ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        self._verified.add(s3_key)
+        return True
+
+
+    async def _wait_for_readers(self, s3_key):
+        """
+        Waits for the in-flight copies that read an object, before it is overwritten.
+        """
+        readers = self._readers.get(s3_key)
+        if readers:
+            await asyncio.gather(*list(readers), return_exceptions=True)
+
+
+    async def _download(self, thumbnail_url, entry):
+        """
+        Downloads a thumbnail, conditionally if it was downloaded before.
+
+        Returns:
+            tuple: The image bytes (None if not modified) and the source's cache validators.
+
+        Raises:
+            aiohttp.ClientResponseError: If the source responds with an error.
+        """
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        async with self._session.get(thumbnail_url, headers=headers) as response:
+            if response.status == 304:
+                return None, {}
+            response.raise_for_status()
+
+            image_data = await response.read()
+            self.bytes_downloaded += len(image_data)
+            validators = {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified')
+            }
+            return image_data, validators
+
+
+    async def _upload(self, image_data, s3_key):
+        """
+        Uploads a thumbnail and its renditions, which are created in the process pool.
+
+        Returns:
+            str: The S3 key the thumbnail was uploaded to.
+        """
+        renditions = await asyncio.get_running_loop().run_in_executor(self._pool, create_renditions, image_data)
+
+        await self._wait_for_readers(s3_key)
+        uploads = [self._s3_client.upload_fileobj(BytesIO(image_data), self._bucket_name, s3_key)]
+        for size, rendition in renditions.items():
+            uploads.append(self._s3_client.upload_fileobj(
+                BytesIO(rendition),
+                self._bucket_name,
+                generate_rendition_key(s3_key, size),
+                ExtraArgs={'ContentType': RENDITION_CONTENT_TYPE}
+            ))
+        await asyncio.gather(*uploads)
+        self.bytes_uploaded += len(image_data) + sum(len(rendition) for rendition in renditions.values())
+        self._verified.add(s3_key)
+        return s3_key
+
+
+    async def _copy(self, source_key, s3_key):
+        """
+        Copies a thumbnail and its renditions within the bucket, without transferring the bytes through this host.
+        The copy is registered as a reader of the source, so an upload of other content to it waits for the copy.
+        """
+        keys = [(source_key, s3_key)] + [
+            (generate_rendition_key(source_key, size), generate_rendition_key(s3_key, size))
+            for size in RENDITION_WIDTHS
+        ]
+        await self._wait_for_readers(s3_key)
+        copy = asyncio.ensure_future(asyncio.gather(*(
+            self._s3_client.copy_object(
+                Bucket=self._bucket_name,
+                Key=destination,
+                CopySource={'Bucket': self._bucket_name, 'Key': source}
+            )
+            for source, destination in keys
+        )))
+        readers = self._readers.setdefault(source_key, set())
+        readers.add(copy)
+        copy.add_done_callback(readers.discard)
+        await copy
+        self._verified.add(s3_key)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,164 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pymongo import ReturnDocument
+
+
+def expensive(view):
+    """
+    Marks a view as expensive (e.g. it embeds text), so it counts against the concurrency cap.
+    """
+    view.expensive = True
+    return view
+
+
+class MemoryRateLimitStore:
+    """
+    Token buckets held in process memory. Every process limits on its own, so with N worker processes a client
+    can make up to N times the configured rate. Use MongoRateLimitStore to share the buckets.
+    """
+
+    def __init__(self, max_keys=100000):
+        """
+        Args:
+            max_keys (int): The maximum number of buckets kept. The least recently used buckets are evicted first.
+        """
+        # Key -> (tokens, monotonic time of the last update), least recently used first
+        self._buckets = OrderedDict()
+        self._max_keys = max_keys
+        self._lock = threading.Lock()
+
+
+    def take(self, key, rate, capacity, cost=1):
+        """
+        Takes tokens from a key's bucket if it holds enough of them.
+
+        Args:
+            key (str): The client the bucket belongs to.
+            rate (float): The number of tokens added per second.
+            capacity (int): The maximum number of tokens, i.e. the largest burst.
+            cost (int): The number of tokens to take.
+
+        Returns:
+            tuple: Whether the tokens were taken, and the number of seconds until they would be (0 if taken).
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self._max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (cost - tokens) / rate
+
+
+class MongoRateLimitStore:
+    """
+    Token buckets stored in a MongoDB collection, so every process and host shares the limit of a client.
+    A bucket is refilled and taken from in a single atomic pipeline update, so there is one round trip per request.
+    """
+
+    def __init__(self, collection, idle_seconds=3600):
+        """
+        Args:
+            collection: The collection to store the buckets in.
+            idle_seconds (int): The number of seconds after which the bucket of an idle client is dropped.
+                It must be longer than it takes to refill a bucket, as a dropped bucket starts full.
+        """
+        self._collection = collection
+        self._collection.create_index('updated_at', expireAfterSeconds=idle_seconds)
+
+
+    def take(self, key, rate, capacity, cost=1):
+        """
+        Takes tokens from a key's bucket if it holds enough of them.
+
+        Args:
+            key (str): The client the bucket belongs to.
+            rate (float): The number of tokens added per second.
+            capacity (int): The maximum number of tokens, i.e. the largest burst.
+            cost (int): The number of tokens to take.
+
+        Returns:
+            tuple: Whether the tokens were taken, and the number of seconds until they would be (0 if taken).
+        """
+        now = datetime.now(timezone.utc)
+        # Hosts' clocks may differ slightly, so the elapsed time is never negative
+        elapsed = {'$max': [0, {'$divide': [{'$subtract': [now, {'$ifNull': ['$updated_at', now]}]}, 1000]}]}
+        bucket = self._collection.find_one_and_update(
+            {'_id': key},
+            [
+                {'$set': {
+                    'tokens': {'$min': [capacity, {'$add': [{'$ifNull': ['$tokens', capacity]}, {'$multiply': [elapsed, rate]}]}]},
+                    'updated_at': now
+                }},
+                {'$set': {'allowed': {'$gte': ['$tokens', cost]}}},
+                {'$set': {'tokens': {'$cond': ['$allowed', {'$subtract': ['$tokens', cost]}, '$tokens']}}}
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if bucket['allowed']:
+            return True, 0.0
+        return False, (cost - bucket['tokens']) / rate
+
+
+class ConcurrencyLimiter:
+    """
+    Caps the number of requests that run at once. Requests over the cap wait in a bounded queue, in arrival order,
+    for a limited time. When the queue is full they are rejected right away, so an overloaded process sheds load
+    instead of letting the latency of every request grow with the backlog.
+    """
+
+    def __init__(self, max_concurrent, max_queue=0):
+        """
+        Args:
+            max_concurrent (int): The maximum number of requests running at once.
+            max_queue (int): The maximum number of requests waiting for a slot.
+        """
+        self._max_concurrent = max_concurrent
+        self._max_queue = max_queue
+        self._running = 0
+        self._waiting = 0
+        self._condition = threading.Condition()
+
+
+    def acquire(self, timeout=None):
+        """
+        Takes a slot, waiting for one if the cap is reached and the queue is not full.
+
+        Args:
+            timeout (float): The maximum number of seconds to wait for a slot.
+
+        Returns:
+            bool: True if a slot was taken and must be released, False if the request should be rejected.
+        """
+        with self._condition:
+            # Requests already waiting go first
+            if self._running < self._max_concurrent and not self._waiting:
+                self._running += 1
+                return True
+            if self._waiting >= self._max_queue:
+                return False
+
+            self._waiting += 1
+            try:
+                admitted = self._condition.wait_for(lambda: self._running < self._max_concurrent, timeout)
+                if admitted:
+                    self._running += 1
+                return admitted
+            finally:
+                self._waiting -= 1
+
+
+    def release(self):
+        """
+        Releases a slot taken by acquire.
+        """
+        with self._condition:
+            self._running -= 1
+            self._condition.notify()
@@ -1,14 +1,38 @@
-def generate_s3_key(book):
+import hashlib
+import json
+import re
+
+# S3 prefix of the thumbnails of the default catalogue
+THUMBNAIL_PREFIX = 'thumbnails/'
+# Separates the key of a thumbnail from the size of its renditions. Renditions are siblings of the original, as
+# S3-compatible stores such as MinIO cannot store an object under the key of another object
+RENDITION_SEPARATOR = '_'
+
+def generate_s3_key(book, prefix=THUMBNAIL_PREFIX):
     """
     Generates an S3 key using information from a book JSON object.
 
     Args:
         book (dict): The JSON object containing book data.
+        prefix (str): The thumbnail prefix of the book's catalogue.
 
     Returns:
         str: The generated S3 key.
     """
-    return f"thumbnails/{book['isbn_13']}"
+    return f"{prefix}{book['isbn_13']}"
+
+def generate_rendition_key(s3_key, size):
+    """
+    Generates the S3 key of a thumbnail rendition from the key of the original thumbnail.
+
+    Args:
+        s3_key (str): The S3 key of the original thumbnail.
+        size (str): The name of the rendition size (e.g. 'small').
+
+    Returns:
+        str: The S3 key of the rendition.
+    """
+    return f"{s3_key}{RENDITION_SEPARATOR}{size}.webp"
 
 def camel_case(text):
     """
@@ -21,4 +45,121 @@ def camel_case(text):
         str: The camel case version of the input string.
     """
     words = text.split()
-    return ''.join([word.capitalize() for word in words])
\ No newline at end of file
+    return ''.join([word.capitalize() for word in words])
+
+def load_books(file_path):
+    """
+    Loads book data from a JSON file containing an array of books, or an NDJSON file with one book per line.
+
+    Args:
+        file_path (str): The path to the book data file.
+
+    Returns:
+        list: The books.
+    """
+    with open(file_path, 'r') as file:
+        if file_path.endswith('.ndjson'):
+            return [json.loads(line) for line in file if line.strip()]
+        return json.load(file)
+
+def parse_field_weights(spec):
+    """
+    Parses field weights given as 'field:weight' pairs separated by commas, e.g. 'title:2,description:4'.
+
+    Args:
+        spec (str): The field weights.
+
+    Returns:
+        dict: The weight of each field, or None if spec is empty.
+
+    Raises:
+        ValueError: If a pair is malformed or a weight is not a number.
+    """
+    if not spec or not spec.strip():
+        return None
+
+    weights = {}
+    for pair in spec.split(','):
+        field, separator, weight = pair.partition(':')
+        if not separator or not field.strip():
+            raise ValueError(f"Field weights must be 'field:weight' pairs, got '{pair}'")
+        weights[field.strip()] = float(weight)
+    return weights
+
+def load_catalogues(path):
+    """
+    Loads the catalogue definitions from a JSON object keyed by catalogue id, e.g.
+    {"scifi": {}, "romance": {"categories": ["Historical", "Contemporary"], "mongo_db": "romance_catalog"}}.
+
+    Args:
+        path (str): The path to the JSON file.
+
+    Returns:
+        dict: The settings of each catalogue, or an empty dict if path is not set.
+
+    Raises:
+        ValueError: If a catalogue id is not made of lowercase letters, digits, '-' and '_', or a setting is unknown.
+    """
+    if not path:
+        return {}
+
+    with open(path, 'r') as file:
+        catalogues = json.load(file)
+
+    allowed = {'mongo_db', 'bucket', 'vector_namespace', 'local_vector_index_path', 'categories', 'formats', 'lengths'}
+    for catalogue_id, settings in catalogues.items():
+        # Ids are used in URLs, database names, vector namespaces and file names
+        if not re.fullmatch(r'[a-z0-9_-]+', catalogue_id):
+            raise ValueError(f"Invalid catalogue id '{catalogue_id}': use lowercase letters, digits, '-' and '_'")
+        unknown = set(settings) - allowed
+        if unknown:
+            raise ValueError(f"Unknown settings for catalogue '{catalogue_id}': {', '.join(sorted(unknown))}")
+    return catalogues
+
+def parse_fields(spec, allowed):
+    """
+    Parses a comma-separated list of field names, e.g. 'title,author,thumbnail'.
+
+    Args:
+        spec (str): The field names.
+        allowed (set): The field names that can be requested.
+
+    Returns:
+        set: The requested fields, or None if spec is empty.
+
+    Raises:
+        ValueError: If a field is not allowed.
+    """
+    if not spec or not spec.strip():
+        return None
+
+    fields = {field.strip() for field in spec.split(',') if field.strip()}
+    unknown = fields - set(allowed)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}. Fields must be among: {', '.join(sorted(allowed))}")
+    return fields
+
+def book_version_etag(books, *variant):
+    """
+    Generates a weak ETag for a representation of one or more books from their ISBN-13s and 'updated_at'
+    timestamps, which every write sets. The ETag is weak, as presigned thumbnail URLs differ between
+    otherwise identical responses.
+
+    Args:
+        books (list): The books, as stored in the database.
+        *variant: Request parameters that change the representation (e.g. the thumbnail size), and the presign
+            epoch if the representation embeds presigned thumbnail URLs.
+
+    Returns:
+        str: The ETag value, without the W/ prefix and quotes.
+        None: If a book has no 'updated_at'.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for part in variant:
+        digest.update(f"{part}\x1f".encode())
+    for book in books:
+        updated_at = book.get('updated_at')
+        if updated_at is None:
+            return None
+        digest.update(f"{book['isbn_13']}:{updated_at.isoformat()}\x1e".encode())
+    return digest.hexdigest()
@@ -0,0 +1,45 @@
+from io import BytesIO
+from PIL import Image
+
+# Fixed widths (in pixels) of the thumbnail renditions served to clients
+RENDITION_WIDTHS = {
+    'small': 128,
+    'medium': 256,
+    'large': 512
+}
+
+RENDITION_FORMAT = 'WEBP'
+RENDITION_CONTENT_TYPE = 'image/webp'
+
+
+def create_renditions(image_data, widths=None, quality=80):
+    """
+    Decodes an image once and re-encodes it as WebP at each rendition width.
+    Images are never upscaled, so a rendition wider than the source keeps the source width.
+    This is CPU-bound, so it is meant to be run in a process pool.
+
+    Args:
+        image_data (bytes): The encoded source image.
+        widths (dict): The rendition widths keyed by size name. Defaults to RENDITION_WIDTHS.
+        quality (int): The WebP quality, from 0 to 100.
+
+    Returns:
+        dict: The encoded renditions keyed by size name.
+    """
+    widths = widths or RENDITION_WIDTHS
+
+    with Image.open(BytesIO(image_data)) as image:
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+
+        # Resize from the largest rendition down, so each resize starts from the smallest sufficient image
+        renditions = {}
+        for size, width in sorted(widths.items(), key=lambda item: item[1], reverse=True):
+            if image.width > width:
+                height = max(1, round(image.height * width / image.width))
+                image = image.resize((width, height), Image.LANCZOS)
+
+            buffer = BytesIO()
+            image.save(buffer, format=RENDITION_FORMAT, quality=quality, method=4)
+            renditions[size] = buffer.getvalue()
+
+    return renditions
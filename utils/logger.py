@@ -1,14 +1,34 @@
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+import atexit
+import json
+import queue
+import random
 import sys
 import os
 
 logger = logging.getLogger('Scifi Catalog')
 
-def setup_logger(log_level=logging.INFO, log_file='logs/app.log'):
+# Argument types that are safe to format later on the listener thread, because they cannot change in the meantime
+_IMMUTABLE_TYPES = (str, int, float, bool, type(None), bytes)
+
+_listener = None
+
+
+def setup_logger(log_level=logging.INFO, log_file='logs/app.log', log_format='text', debug_sample_rate=1.0):
     """
     Sets up the logger configuration.
+    Records are put on an in-memory queue and written to the file and console by a background listener thread,
+    so logging never blocks a request on disk or console I/O.
+
+    Args:
+        log_level (int): The minimum level to log.
+        log_file (str): The path of the rotating log file.
+        log_format (str): 'text', or 'json' for one JSON object per line.
+        debug_sample_rate (float): The fraction of DEBUG records to keep. Higher levels are always kept.
     """
+    global _listener
+
     # Create log directory if passed and it doesn't exist
     log_dir = os.path.dirname(log_file)
     if log_dir and not os.path.exists(log_dir):
@@ -23,12 +43,92 @@ def setup_logger(log_level=logging.INFO, log_file='logs/app.log'):
     ch = logging.StreamHandler(sys.stdout)
 
     # Create formatter and apply to handlers
-    formatter = logging.Formatter('%(asctime)s %(levelname)s:%(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
+    if log_format == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s %(levelname)s:%(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
     fh.setFormatter(formatter)
     ch.setFormatter(formatter)
 
-    # Add handlers to logger
-    logger.addHandler(fh)
-    logger.addHandler(ch)
+    # Replace a previous setup, flushing what it still had queued
+    _stop_listener()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+
+    # Request threads only enqueue records; the listener thread formats and writes them
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    if debug_sample_rate < 1:
+        queue_handler.addFilter(DebugSampler(debug_sample_rate))
+    logger.addHandler(queue_handler)
+
+    _listener = QueueListener(log_queue, fh, ch, respect_handler_level=True)
+    _listener.start()
+
+    return logger
+
+
+@atexit.register
+def _stop_listener():
+    """
+    Stops the listener thread once it has written every queued record.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    A QueueHandler that leaves the %-formatting of the message to the listener thread.
+    The standard QueueHandler formats every record in the logging thread before enqueueing it.
+    """
+
+    def prepare(self, record):
+        # Arguments that could be mutated before the listener gets to them are formatted now.
+        # A single mapping argument is kept as the dict itself, so it is never deferred.
+        if record.args and (isinstance(record.args, dict)
+                            or not all(isinstance(arg, _IMMUTABLE_TYPES) for arg in record.args)):
+            record.msg, record.args = record.getMessage(), None
+        # Tracebacks are rendered now, as the frames may be gone by the time the listener formats the record
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class DebugSampler(logging.Filter):
+    """
+    Keeps a random fraction of DEBUG records, to bound the volume of high-frequency debug events.
+    """
+
+    def __init__(self, rate):
+        super().__init__()
+        self._rate = rate
+
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or random.random() < self._rate
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line.
+    """
 
-    return logger
\ No newline at end of file
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S%z'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'line': record.lineno,
+            'thread': record.threadName
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
@@ -0,0 +1,251 @@
+import functools
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from pymongo import monitoring
+
+# Latency buckets in seconds, from sub-millisecond cache hits to multi-second embeddings
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+
+
+class MetricsRegistry:
+    """
+    A process-local registry of metrics, rendered in the Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+
+    def render(self):
+        """
+        Returns every metric in the Prometheus text exposition format (version 0.0.4).
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+class _Metric:
+    """
+    A metric family with optional labels. Children are created once per label combination and cached, so
+    looking up a child on the hot path is a dict access.
+    """
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self._labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+
+    def labels(self, *values):
+        """
+        Returns the child metric for a combination of label values, in the order of the label names.
+        """
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self._labelnames):
+                raise ValueError(f"{self.name} expects labels {self._labelnames}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child(values))
+        return child
+
+
+    def samples(self):
+        with self._lock:
+            children = sorted(self._children.items())
+        for values, child in children:
+            yield from child.samples(self.name, self._format_labels(values))
+
+
+    def _format_labels(self, values, extra=None):
+        pairs = list(zip(self._labelnames, values)) + ([extra] if extra else [])
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+    def _new_child(self, values):
+        raise NotImplementedError
+
+
+class _CounterChild:
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+
+    def samples(self, name, labels):
+        yield f"{name}_total{labels} {self._value}"
+
+
+class Counter(_Metric):
+    """
+    A monotonically increasing count, exported as <name>_total.
+    """
+    type = 'counter'
+
+    def _new_child(self, values):
+        return _CounterChild()
+
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class _HistogramChild:
+
+    def __init__(self, buckets, format_labels):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+        self._format_labels = format_labels
+
+
+    def observe(self, value):
+        index = bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+
+    def samples(self, name, labels):
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        cumulative = 0
+        for bound, count in zip(self._buckets + (float('inf'),), counts):
+            cumulative += count
+            yield f"{name}_bucket{self._format_labels(('le', '+Inf' if bound == float('inf') else repr(float(bound))))} {cumulative}"
+        yield f"{name}_sum{labels} {total}"
+        yield f"{name}_count{labels} {cumulative}"
+
+
+class Histogram(_Metric):
+    """
+    A distribution of observed values in cumulative buckets.
+    """
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        self._buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+
+    def _new_child(self, values):
+        # Buckets carry an extra 'le' label next to the child's own labels
+        return _HistogramChild(self._buckets, lambda extra: self._format_labels(values, extra))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def timed(histogram, *label_values):
+    """
+    Decorates a function or coroutine function to observe its duration in a histogram.
+    The child metric is resolved once at decoration time, so a call only adds two clock reads and an observe.
+
+    Args:
+        histogram (Histogram): The histogram to observe the duration in.
+        *label_values: The label values of the child to observe in.
+    """
+    child = histogram.labels(*label_values)
+
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    child.observe(time.perf_counter() - start)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - start)
+        return wrapper
+
+    return decorator
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """
+    Observes the duration of every MongoDB command the client sends, as reported by the driver.
+    """
+
+    def started(self, event):
+        pass
+
+
+    def succeeded(self, event):
+        MONGO_COMMAND_DURATION.labels(event.command_name, 'success').observe(event.duration_micros / 1e6)
+
+
+    def failed(self, event):
+        MONGO_COMMAND_DURATION.labels(event.command_name, 'failure').observe(event.duration_micros / 1e6)
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'Latency of HTTP requests by route.', ['method', 'route', 'status'])
+SERVICE_CALL_DURATION = Histogram(
+    'service_call_duration_seconds', 'Duration of service and model methods.', ['service', 'method'])
+MONGO_COMMAND_DURATION = Histogram(
+    'mongo_command_duration_seconds', 'Duration of MongoDB commands.', ['command', 'outcome'])
+S3_PRESIGN = Counter(
+    's3_presigned_urls', 'Presigned URLs generated.', ['outcome'])
+S3_PRESIGN_DURATION = Histogram(
+    's3_presign_duration_seconds', 'Time to generate one presigned URL.')
+EMBED_BATCH_SIZE = Histogram(
+    'embed_batch_size', 'Number of books or queries per embedding call.', ['operation'], buckets=SIZE_BUCKETS)
+ENCODE_BATCH_SIZE = Histogram(
+    'encode_batch_size', 'Number of texts sent to the model per encode call, after the cache.', buckets=SIZE_BUCKETS)
+ENCODE_DURATION = Histogram(
+    'encode_duration_seconds', 'Duration of model encode calls.')
+CACHE_REQUESTS = Counter(
+    'cache_requests', 'Cache lookups by cache and result (hit or miss).', ['cache', 'result'])
+VECTOR_QUERY_DURATION = Histogram(
+    'vector_query_duration_seconds', 'Latency of vector index queries.')
+RERANK_REQUESTS = Counter(
+    'rerank_requests', 'Searches by re-ranking outcome (reranked, cached, budget_exceeded, overloaded or failed).', ['outcome'])
+ADMISSION_REJECTIONS = Counter(
+    'admission_rejections', 'Requests rejected by admission control (rate_limited, overloaded or deadline_exceeded).', ['reason'])
+ADMISSION_QUEUE_WAIT = Histogram(
+    'admission_queue_wait_seconds', 'Time expensive requests waited for a concurrency slot, admitted or not.')
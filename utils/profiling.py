@@ -0,0 +1,154 @@
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+# Functions a thread sits in while it waits; stacks ending in them are idle time, not work
+# (SimpleQueue.get is implemented in C, so a QueueListener waiting for records is last seen in 'dequeue')
+IDLE_FUNCTIONS = {
+    ('threading.py', 'wait'), ('threading.py', '_wait_for_tstate_lock'), ('queue.py', 'get'),
+    ('selectors.py', 'select'), ('thread.py', '_worker'), ('socketserver.py', 'serve_forever'),
+    ('handlers.py', 'dequeue')
+}
+
+
+class SamplingProfiler:
+    """
+    A statistical profiler that snapshots the stacks of a request's threads at a fixed interval from a
+    background thread. The profiled code is not instrumented, so the overhead is one stack walk per interval.
+
+    Only the thread that starts the profiler is sampled, plus the threads and event loops added to it. asgiref
+    runs each async view on its own event loop, in a new thread, and the loop hands blocking work to its own
+    default executor. Adding the loop therefore covers the view and its executor threads, and leaves out
+    concurrent requests and background threads such as the log listener.
+    """
+
+    def __init__(self, interval=0.005):
+        """
+        Args:
+            interval (float): The number of seconds between samples.
+        """
+        self._interval = interval
+        self._stacks = Counter()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._thread_ids = set()
+        self._loops = []
+
+
+    def start(self):
+        """
+        Starts sampling the calling thread, and any thread or loop added later.
+        """
+        self.add_thread()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+
+
+    def add_thread(self, thread_id=None):
+        """
+        Samples a thread as well. Defaults to the calling thread.
+        """
+        self._thread_ids.add(thread_id if thread_id is not None else threading.get_ident())
+
+
+    def add_loop(self, loop):
+        """
+        Samples the threads of an event loop's default executor as well, e.g. those running asyncio.to_thread.
+        """
+        self._loops.append(loop)
+
+
+    def stop(self):
+        """
+        Stops sampling.
+
+        Returns:
+            Counter: The number of samples of every collapsed stack.
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self._stacks
+
+
+    def _run(self):
+        while not self._stop_event.wait(self._interval):
+            thread_ids = set(self._thread_ids)
+            for loop in self._loops:
+                # The executor is created on the first asyncio.to_thread call, and its threads as work arrives
+                executor = getattr(loop, '_default_executor', None)
+                thread_ids.update(thread.ident for thread in list(getattr(executor, '_threads', ())))
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id not in thread_ids:
+                    continue
+                stack = _collapse(frame)
+                if stack is not None:
+                    self._stacks[stack] += 1
+
+
+def _collapse(frame):
+    """
+    Returns the stack of a frame as 'root;...;leaf', or None if the thread is idle.
+    """
+    code = frame.f_code
+    if (os.path.basename(code.co_filename), code.co_name) in IDLE_FUNCTIONS:
+        return None
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        # Functions are named by their first line, so samples from different lines of a function merge
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def route_directory(route):
+    """
+    Returns a directory name for a route template, e.g. 'GET_api_v1_book_id' for GET /api/v1/book/<id>.
+    """
+    return re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'
+
+
+def write_collapsed(stacks, path):
+    """
+    Writes stacks in the collapsed format of flamegraph.pl ('frame;frame;frame count' per line).
+
+    Args:
+        stacks (dict): The number of samples of every collapsed stack.
+        path (str): The file to write.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as file:
+        for stack, count in sorted(stacks.items()):
+            file.write(f"{stack} {count}\n")
+
+
+def read_collapsed(path, stacks=None):
+    """
+    Adds the stacks of a collapsed file to a counter.
+
+    Args:
+        path (str): The file to read.
+        stacks (Counter): The counter to add to. A new one is created if not passed.
+
+    Returns:
+        Counter: The number of samples of every collapsed stack.
+    """
+    stacks = stacks if stacks is not None else Counter()
+    with open(path, 'r') as file:
+        for line in file:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack and count.isdigit():
+                stacks[stack] += int(count)
+    return stacks
+
+
+def profile_path(directory, method, route):
+    """
+    Returns a new file path for a profile of one request, grouped by route.
+    """
+    name = f"{time.strftime('%Y%m%dT%H%M%S')}-{time.time_ns() % 10**9:09d}-{os.getpid()}-{threading.get_ident()}.folded"
+    return os.path.join(directory, route_directory(f"{method} {route}"), name)